@@ -1,4 +1,7 @@
+import os
 from pathlib import Path
+import threading
+import time
 
 import logging
 import readline
@@ -7,56 +10,189 @@ from neomodel import config, db
 from watchdog.events import PatternMatchingEventHandler
 from watchdog.observers import Observer
 
+from world_graph.centrality import CentralityIndex
+from world_graph.change_detection import DEFAULT_SNAPSHOT_PATH, ChangeVerifier
+from world_graph.metrics import METRICS
+from world_graph.query_accounting import DEFAULT_QUERY_BUDGET, QueryAccountant
 from world_graph.utils import time_function
-from world_graph.neo_model_handler import MockFileSystemEvent, NeoModelEventHandler, create_neo_model_connection
-from world_graph.read_obs_file import GraphDog
+from world_graph.neo_model_handler import NeoModelEventHandler, create_neo_model_connection
+from world_graph.read_obs_file import DEFAULT_MEMORY_CEILING, GraphDog
 from world_graph.chunking import MarkdownThenNLTKSentWithLinkMasking
 from world_graph.embedding import load_embedding_model
+from world_graph.embedding_spaces import EmbeddingSpaceManager
+from world_graph.note_parsing import sentence_tokenizer
+from world_graph.parse_cache import ParseCache, embedder_signature
+from world_graph.scheduler import Priority, PriorityScheduler, ScheduledEmbeddings
+from world_graph.unit_of_work import EventBatcher, UnitOfWork
+
+
+# Seconds between verify passes over the vault, and between polls when watchdog cannot watch it
+VERIFY_INTERVAL = 300.0
+POLL_INTERVAL = 5.0
+CENTRALITY_INTERVAL = 3600.0
+# Seconds before a failed warm-up is tried again, doubled after each failure up to the maximum
+WARM_UP_RETRY_DELAY = 10.0
+WARM_UP_MAX_RETRY_DELAY = 300.0
 
 
 @time_function
-def start_sync(handle, vault_path):
-    for idx, path in enumerate(Path(vault_path).rglob("*.md")):
-        handle.on_created()(MockFileSystemEvent(path))
+def start_sync(verifier: ChangeVerifier, scheduler: PriorityScheduler):
+    # Dispatches every note changed since the verifier's stored snapshot, all of them on a first run
+    with scheduler.priority(Priority.BACKGROUND):
+        verifier.verify()
+
+
+def configure_logging(level: int = logging.INFO) -> None:
+    from rich.logging import RichHandler
+
+    logging.basicConfig(level=level, format="%(message)s", datefmt="[%X]", handlers=[RichHandler(rich_tracebacks=True)])
+
+
+def warm_up(gd: GraphDog, handle: NeoModelEventHandler, scheduler: PriorityScheduler, ready: threading.Event) -> None:
+    """
+    Loads the embedding model, settles the embedding space, and loads NLTK and the splitters, off the main thread.
+
+    The watcher and REPL are already running, anything needing the model waits on `ready`. A failed
+    warm-up is retried with backoff until it succeeds, events stay queued in the meantime rather
+    than being ingested without embeddings.
+    """
+    delay = WARM_UP_RETRY_DELAY
+    while True:
+        start_time = time.perf_counter()
+        try:
+            load_models(gd, handle, scheduler)
+        except Exception as e:
+            logging.exception(f"Warm-up failed, events stay queued until it succeeds, retrying in {round(delay)} seconds: {e}")
+            time.sleep(delay)
+            delay = min(delay * 2, WARM_UP_MAX_RETRY_DELAY)
+            continue
+        logging.info(f"Warm-up finished in {round(time.perf_counter() - start_time, 2)} seconds.")
+        ready.set()
+        return
+
+
+def load_models(gd: GraphDog, handle: NeoModelEventHandler, scheduler: PriorityScheduler) -> None:
+    embedding_backend = os.getenv("WORLD_GRAPH_EMBEDDING_BACKEND")
+    embedding, dim = load_embedding_model(model_name=os.getenv("WORLD_GRAPH_EMBEDDING_MODEL"), backend=embedding_backend)
+    embedding = ScheduledEmbeddings(embedding, scheduler, dimension=dim)
+
+    spaces = EmbeddingSpaceManager(handle, scheduler=scheduler)
+    active_space = spaces.active_space()
+    if active_space is None:
+        spaces.adopt(embedding)
+    elif active_space.model != embedder_signature(embedding):
+        # Keep serving the active model while the configured one is backfilled, then switch over
+        serving, _ = load_embedding_model(model_name=active_space.model, dimension=active_space.dimension, backend=embedding_backend)
+        spaces.apply(active_space, ScheduledEmbeddings(serving, scheduler, dimension=active_space.dimension))
+        spaces.start_migration(embedding)
+    else:
+        spaces.apply(spaces.ensure_space(embedding), embedding)
+
+    sentence_tokenizer()
+    if isinstance(gd.splitter, MarkdownThenNLTKSentWithLinkMasking):
+        gd.splitter.warm_up()
+
+
+def after_warm_up(ready: threading.Event, callback):
+    # Events arriving during warm-up queue up in the observer until the model is loaded
+    def _return(event):
+        ready.wait()
+        return callback(event)
+
+    return _return
 
 
 @time_function
 def main():
     vault_path = "/home/xoph/repos/github/nfroseth/world_graph_ai_context/world_graph/src_v2/zoo"
 
+    configure_logging()
+    METRICS.enable()
+    metrics_port = os.getenv("WORLD_GRAPH_METRICS_PORT")
+    if metrics_port:
+        METRICS.start_http_endpoint(int(metrics_port))
+    METRICS.start_periodic_dump(Path(os.getenv("WORLD_GRAPH_METRICS_DUMP", "world_graph_metrics.json")), interval=60.0)
+
     create_neo_model_connection()
-    embedding, dim = load_embedding_model()
+    scheduler = PriorityScheduler()
     splitter = MarkdownThenNLTKSentWithLinkMasking()
-    gd = GraphDog(vault_path, None, splitter, embedding)
+    # Notes past the streaming threshold are ingested in windows sized to fit this many bytes
+    memory_ceiling = int(os.getenv("WORLD_GRAPH_MEMORY_CEILING", DEFAULT_MEMORY_CEILING))
+    gd = GraphDog(vault_path, None, splitter, None, parse_cache=ParseCache(), memory_ceiling=memory_ceiling)
 
-    handle = NeoModelEventHandler(gd)
+    query_accountant = QueryAccountant(query_budget=int(os.getenv("WORLD_GRAPH_QUERY_BUDGET", DEFAULT_QUERY_BUDGET)))
+    query_accountant.install()
+    scheduler.install_graph()  # After the accountant, so time spent queued is not counted as round-trip time
+    centrality = CentralityIndex(scheduler=scheduler)
+    handle = NeoModelEventHandler(gd, query_accountant=query_accountant, unit_of_work=UnitOfWork(scheduler=scheduler), centrality=centrality)
+    centrality_weight = float(os.getenv("WORLD_GRAPH_CENTRALITY_WEIGHT", "0.1"))
 
-    event_handler = PatternMatchingEventHandler(patterns=["*.md"], case_sensitive=True)
-    observer = Observer()
+    ready = threading.Event()
+    threading.Thread(target=warm_up, args=(gd, handle, scheduler, ready), name="warm-up", daemon=True).start()
 
-    event_handler.on_created = handle.on_created()
-    event_handler.on_deleted = handle.on_deleted()
-    event_handler.on_modified = handle.on_modified()
-    event_handler.on_moved = handle.on_moved()
+    def checkpoint():
+        ready.wait()
+        scheduler.checkpoint()
 
-    observer.schedule(event_handler, path=Path(vault_path), recursive=True)
-    observer.start()
+    snapshot_path = Path(os.getenv("WORLD_GRAPH_VAULT_SNAPSHOT", DEFAULT_SNAPSHOT_PATH))
+    verifier = ChangeVerifier(handle, vault_path, snapshot_path=snapshot_path, checkpoint=checkpoint)
 
-    # start_sync(handle, vault_path)
+    event_handler = PatternMatchingEventHandler(patterns=["*.md"], case_sensitive=True)
+    observer = Observer()
 
-    handle.create_vector_index("FilledNeoNode_content_embedding_mxbai_large", node_type="FilledNeoNote")
-    handle.create_vector_index("NeoSplit_content_embedding_mxbai_large", node_type="NeoSplit")
+    callbacks = {"created": handle.on_created(), "deleted": handle.on_deleted(), "modified": handle.on_modified(), "moved": handle.on_moved()}
+    batcher = None
+    event_batch_size = int(os.getenv("WORLD_GRAPH_EVENT_BATCH_SIZE", "1"))
+    if event_batch_size > 1:
+        # Coalesces bursts of events and commits each batch once, events keep queueing in it until warm-up succeeded
+        batcher = EventBatcher(handle.unit_of_work, callbacks, max_batch_size=event_batch_size)
+        threading.Thread(target=lambda: (ready.wait(), batcher.start()), name="batcher-start", daemon=True).start()
+        callbacks = {event_type: batcher.callback(event_type) for event_type in callbacks}
+    else:
+        callbacks = {event_type: after_warm_up(ready, callback) for event_type, callback in callbacks.items()}
+
+    # With batching a path only counts as synced once the batch holding its event committed
+    event_handler.on_created = verifier.observed(callbacks["created"], deferred=batcher is not None)
+    event_handler.on_deleted = verifier.observed(callbacks["deleted"], deferred=batcher is not None)
+    event_handler.on_modified = verifier.observed(callbacks["modified"], deferred=batcher is not None)
+    event_handler.on_moved = verifier.observed(callbacks["moved"], deferred=batcher is not None)
+
+    # Without a stored snapshot, e.g. the one a bulk import or snapshot restore installs, nothing is known to be in the graph
+    # and the first pass dispatches every note as created
+    first_run = len(verifier.believed) == 0
+
+    try:
+        observer.schedule(event_handler, path=Path(vault_path), recursive=True)
+        observer.start()
+        verifier.start(VERIFY_INTERVAL, verify_now=first_run)
+    except OSError as e:
+        # Typically the inotify watch limit on a large vault
+        logging.warning(f"Watching {vault_path} failed ({e}), polling every {POLL_INTERVAL} seconds instead.")
+        verifier.start(POLL_INTERVAL, verify_now=first_run)
+    centrality.start(CENTRALITY_INTERVAL)
 
     try:
         print("Stream is active!")
         while True:
             user_input = input("Q:")
-            q_embed = embedding.embed_query(user_input)
-            results, meta = handle.query_vector_index(q_embed, top_k=8, node_type="FilledNeoNote")
+            # Embedded and scored under one target, even when a migration switches models in between
+            target = handle.embedding_target
+            if not ready.is_set() or target.embedder is None:
+                print("The embedding model is not available yet, see the log for the warm-up's progress.")
+                continue
+            with scheduler.priority(Priority.INTERACTIVE):
+                q_embed = target.embedder.embed_query(user_input)
+                results, meta = handle.query_vector_index(
+                    q_embed, top_k=8, node_type="FilledNeoNote", embed_name=target.embedding_property, centrality_weight=centrality_weight
+                )
             for row in results:
                 print(row[0].name, row[1])
     except KeyboardInterrupt:
         observer.stop()
+        verifier.stop()
+        centrality.stop()
+        if batcher is not None:
+            batcher.stop()
     except Exception as e:
         db.close_connection()
         raise e
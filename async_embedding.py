@@ -0,0 +1,205 @@
+from array import array
+import asyncio
+import base64
+import logging
+import random
+import sys
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from world_graph.metrics import METRICS
+
+embedding_log = logging.getLogger(__name__)
+
+RETRY_STATUS_CODES = frozenset((408, 429, 500, 502, 503, 504))
+
+
+class EmbeddingRequestError(RuntimeError):
+    pass
+
+
+class AsyncEmbeddingClient:
+    """
+    Pooled, concurrency-limited client for an OpenAI compatible /embeddings endpoint such as Infinity.
+
+    Texts from every caller are queued and sent as micro-batches, flushed once `max_batch_size`
+    texts are waiting or `max_batch_delay` seconds after the first, so concurrent file events and
+    queries share requests. At most `max_in_flight` requests run at once over one persistent
+    connection pool. Failed requests are retried with jittered exponential backoff. With
+    `use_base64` the server returns packed float32 vectors, which skips parsing JSON floats.
+
+    The client owns an event loop on a daemon thread. The `a`-prefixed methods can be awaited from
+    any loop, the synchronous ones block the calling thread until the vectors arrive. Implements
+    the langchain Embeddings interface without importing langchain.
+
+    Args:
+        model: Model name sent with each request
+        api_url: Base URL of the server, without the /embeddings suffix
+        max_in_flight: Requests allowed in flight at once
+        max_batch_size: Most texts sent in one request
+        max_batch_delay: Seconds the first queued text waits for others to join its batch
+        max_retries: Attempts after the first before a batch fails
+        backoff: Base delay in seconds, doubled after every failed attempt
+        timeout: Seconds before a request is abandoned and retried
+        use_base64: Ask for base64 encoded float32 vectors
+    """
+
+    def __init__(
+        self,
+        model: str,
+        api_url: str,
+        max_in_flight: int = 4,
+        max_batch_size: int = 32,
+        max_batch_delay: float = 0.005,
+        max_retries: int = 4,
+        backoff: float = 0.25,
+        timeout: float = 30.0,
+        use_base64: bool = True,
+    ):
+        import httpx
+
+        self.model = model
+        self._api_url = api_url.rstrip("/")
+        self._max_in_flight = max_in_flight
+        self._max_batch_size = max_batch_size
+        self._max_batch_delay = max_batch_delay
+        self._max_retries = max_retries
+        self._backoff = backoff
+        self._use_base64 = use_base64
+
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._loop.run_forever, name="embedding-client", daemon=True)
+        self._loop_thread.start()
+
+        async def _setup():
+            self._in_flight = asyncio.Semaphore(max_in_flight)
+            limits = httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight)
+            self._http = httpx.AsyncClient(base_url=self._api_url, limits=limits, timeout=timeout)
+
+        self._run(_setup())
+
+    @property
+    def api_url(self) -> str:
+        return self._api_url
+
+    def embed_documents(self, texts: List[str]) -> List[array]:
+        # Packed float32 as decoded, as_embedding stores them without a copy
+        return self._run(self._embed_many(texts))
+
+    def embed_query(self, text: str) -> List[float]:
+        # A list, query vectors are sent on to Cypher as parameters
+        return self._run(self._embed_many([text]))[0].tolist()
+
+    async def aembed_documents(self, texts: List[str]) -> List[array]:
+        return await self._await_on_loop(self._embed_many(texts))
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self._await_on_loop(self._embed_many([text])))[0].tolist()
+
+    def probe_dimension(self) -> int:
+        return len(self.embed_query("A sentence to encode."))
+
+    def close(self) -> None:
+        if not self._loop.is_running():
+            return
+        self._run(self._http.aclose())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop_thread.join()
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def _await_on_loop(self, coroutine):
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self._loop:
+            return await coroutine
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, self._loop))
+
+    async def _embed_many(self, texts: List[str]) -> List[array]:
+        futures = []
+        for text in texts:
+            future = self._loop.create_future()
+            self._pending.append((text, future))
+            futures.append(future)
+            if len(self._pending) >= self._max_batch_size:
+                self._flush()
+
+        if self._pending and self._flush_handle is None:
+            self._flush_handle = self._loop.call_later(self._max_batch_delay, self._flush)
+        return list(await asyncio.gather(*futures))
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        while self._pending:
+            batch, self._pending = self._pending[: self._max_batch_size], self._pending[self._max_batch_size :]
+            self._loop.create_task(self._send(batch))
+
+    async def _send(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        async with self._in_flight:
+            try:
+                vectors = await self._post_with_retries([text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+
+        for (_, future), vector in zip(batch, vectors):
+            if not future.done():
+                future.set_result(vector)
+
+    async def _post_with_retries(self, texts: List[str]) -> List[array]:
+        import httpx
+
+        payload = {"model": self.model, "input": texts}
+        if self._use_base64:
+            payload["encoding_format"] = "base64"
+
+        for attempt in range(self._max_retries + 1):
+            start_time = time.perf_counter()
+            try:
+                response = await self._http.post("/embeddings", json=payload)
+                if response.status_code in RETRY_STATUS_CODES:
+                    raise EmbeddingRequestError(f"Embedding server returned {response.status_code}")
+                response.raise_for_status()
+                vectors = self._decode(response.json(), len(texts))
+            except (httpx.TransportError, EmbeddingRequestError) as e:
+                METRICS.inc("embedding_requests_total", result="retry" if attempt < self._max_retries else "error")
+                if attempt == self._max_retries:
+                    raise EmbeddingRequestError(f"Embedding {len(texts)} texts failed after {attempt + 1} attempts: {e}") from e
+                delay = self._backoff * 2**attempt * random.uniform(0.5, 1.5)
+                embedding_log.warning(f"Embedding request failed ({e}), retrying in {round(delay, 2)} seconds.")
+                await asyncio.sleep(delay)
+                continue
+
+            METRICS.inc("embedding_requests_total", result="ok")
+            METRICS.inc("embedding_texts_total", len(texts))
+            METRICS.observe("embedding_request_seconds", time.perf_counter() - start_time)
+            return vectors
+
+    def _decode(self, body: dict, expected: int) -> List[array]:
+        rows = sorted(body["data"], key=lambda row: row.get("index", 0))
+        if len(rows) != expected:
+            raise EmbeddingRequestError(f"Expected {expected} embeddings, received {len(rows)}")
+
+        vectors = []
+        for row in rows:
+            embedding = row["embedding"]
+            if isinstance(embedding, str):
+                vector = array("f")
+                vector.frombytes(base64.b64decode(embedding))
+                if sys.byteorder != "little":
+                    vector.byteswap()
+            else:
+                vector = array("f", embedding)
+            vectors.append(vector)
+        return vectors
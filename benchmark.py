@@ -0,0 +1,194 @@
+import argparse
+import json
+import logging
+from pathlib import Path
+import resource
+import shutil
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+from world_graph.chunking import MarkdownThenNLTKSentWithLinkMasking
+from world_graph.embedding import load_embedding_model
+from world_graph.metrics import METRICS, percentiles
+from world_graph.read_obs_file import GraphDog
+from world_graph.synthetic_vault_gen import SyntheticVault
+
+bench_log = logging.getLogger(__name__)
+
+DEFAULT_SCALES = (1_000, 10_000)
+
+
+def peak_rss_bytes() -> int:
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def timed(function: Callable, *args, **kwargs) -> float:
+    start_time = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start_time
+
+
+def latency_summary(samples: List[float]) -> Dict[str, float]:
+    summary = percentiles(samples)
+    summary["mean"] = sum(samples) / len(samples) if samples else 0.0
+    summary["count"] = len(samples)
+    return summary
+
+
+def bench_generate(vault: SyntheticVault, num_notes: int) -> Dict[str, Any]:
+    elapsed = timed(vault.generate, num_notes=num_notes)
+    return {"notes": num_notes, "seconds": elapsed, "notes_per_second": num_notes / elapsed}
+
+
+def bench_parse(graphdog: GraphDog, note_paths: List[Path], trace_memory: bool = False) -> Dict[str, Any]:
+    """
+    Serializes every note without touching the graph, the ceiling for bulk ingest throughput.
+    """
+    if trace_memory:
+        tracemalloc.start()
+
+    total_bytes = 0
+    latencies = []
+    start_time = time.perf_counter()
+    for path in note_paths:
+        note_start = time.perf_counter()
+        note = graphdog.serialize_obsidian_note(path)
+        latencies.append(time.perf_counter() - note_start)
+        total_bytes += len(note.content)
+    elapsed = time.perf_counter() - start_time
+
+    results = {
+        "notes": len(note_paths),
+        "seconds": elapsed,
+        "notes_per_second": len(note_paths) / elapsed,
+        "mib_per_second": total_bytes / elapsed / 2**20,
+        "per_note": latency_summary(latencies),
+        "peak_rss_bytes": peak_rss_bytes(),
+    }
+    if trace_memory:
+        results["peak_traced_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return results
+
+
+def bench_ingest(handle, note_paths: List[Path]) -> Dict[str, Any]:
+    from world_graph.neo_model_handler import MockFileSystemEvent
+
+    on_created = handle.on_created()
+    latencies = []
+    start_time = time.perf_counter()
+    for path in note_paths:
+        latencies.append(timed(on_created, MockFileSystemEvent(path)))
+    elapsed = time.perf_counter() - start_time
+    return {
+        "notes": len(note_paths),
+        "seconds": elapsed,
+        "notes_per_second": len(note_paths) / elapsed,
+        "per_note": latency_summary(latencies),
+        "peak_rss_bytes": peak_rss_bytes(),
+    }
+
+
+def bench_events(handle, vault_path: Path, note_paths: List[Path], samples: int = 50) -> Dict[str, Any]:
+    """
+    Per event latency of create, modify, move and delete against an already ingested vault.
+
+    Each sample copies an existing note under a new name, then edits, renames and deletes it,
+    driving the matching handler callback after every file operation.
+    """
+    from world_graph.neo_model_handler import MockFileSystemEvent
+
+    on_created, on_modified, on_moved, on_deleted = handle.on_created(), handle.on_modified(), handle.on_moved(), handle.on_deleted()
+    latencies = {"create": [], "modify": [], "move": [], "delete": []}
+    for idx, source in enumerate(note_paths[:samples]):
+        created = vault_path / f"Benchmark Note {idx}.md"
+        moved = vault_path / f"Benchmark Note {idx} Moved.md"
+
+        shutil.copyfile(source, created)
+        latencies["create"].append(timed(on_created, MockFileSystemEvent(created)))
+
+        with open(created, "a", encoding="utf-8") as note_file:
+            note_file.write(f"\nAn edit made by the benchmark #benchmark [[{source.stem}]]\n")
+        latencies["modify"].append(timed(on_modified, MockFileSystemEvent(created)))
+
+        created.rename(moved)
+        latencies["move"].append(timed(on_moved, MockFileSystemEvent(created, dest_path=moved)))
+
+        moved.unlink()
+        latencies["delete"].append(timed(on_deleted, MockFileSystemEvent(moved)))
+
+    return {event_type: latency_summary(samples) for event_type, samples in latencies.items()}
+
+
+def bench_query(handle, embedder, queries: List[str], top_k: int = 8) -> Dict[str, Any]:
+    latencies = {"FilledNeoNote": [], "NeoSplit": []}
+    for query in queries:
+        q_embed = embedder.embed_query(query)
+        for node_type, samples in latencies.items():
+            samples.append(timed(handle.query_vector_index, q_embed, top_k=top_k, node_type=node_type))
+    return {node_type: latency_summary(samples) for node_type, samples in latencies.items()}
+
+
+def run_scale(num_notes: int, work_dir: Path, use_neo4j: bool, dimension: int, seed: int, embedding_latency: float = 0.0) -> Dict[str, Any]:
+    bench_log.info(f"Benchmarking a synthetic vault of {num_notes} notes.")
+    vault = SyntheticVault(str(work_dir / f"vault_{num_notes}"), seed=seed, folder_depth=2, dangling_rate=0.05)
+    results: Dict[str, Any] = {"notes": num_notes, "generate": bench_generate(vault, num_notes)}
+
+    note_paths = sorted(vault.path / relative_path for relative_path in vault.notes_written.values())
+    embedder, dimension = load_embedding_model(backend="hash", dimension=dimension, latency=embedding_latency)
+    graphdog = GraphDog(vault.path, None, MarkdownThenNLTKSentWithLinkMasking(), embedder)
+    results["parse"] = bench_parse(graphdog, note_paths)
+
+    if use_neo4j:
+        from neomodel import db
+
+        from world_graph.neo_model_handler import NeoModelEventHandler, clear_database, create_neo_model_connection
+
+        create_neo_model_connection(clear_on_connect=True)
+        handle = NeoModelEventHandler(graphdog)
+        results["ingest"] = bench_ingest(handle, note_paths)
+        handle.create_vector_index("FilledNeoNode_content_embedding_bench", node_type="FilledNeoNote", dimension=dimension)
+        handle.create_vector_index("NeoSplit_content_embedding_bench", node_type="NeoSplit", dimension=dimension)
+        results["events"] = bench_events(handle, vault.path, note_paths)
+        results["query"] = bench_query(handle, embedder, [f"Where does the {animal} live?" for animal in SyntheticVault.animals[:20]])
+        clear_database()
+        db.close_connection()
+
+    results["peak_rss_bytes"] = peak_rss_bytes()
+    return results
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="End to end benchmarks over deterministic synthetic vaults.")
+    parser.add_argument("--scales", type=int, nargs="+", default=list(DEFAULT_SCALES), help="Vault sizes, in notes")
+    parser.add_argument("--neo4j", action="store_true", help="Also benchmark ingest, events and queries against the configured Neo4j (it is cleared)")
+    parser.add_argument("--dimension", type=int, default=1024, help="Dimension of the stub embeddings")
+    parser.add_argument("--embedding-latency", type=float, default=0.0, help="Seconds the stub embedder sleeps per request")
+    parser.add_argument("--seed", type=int, default=2342)
+    parser.add_argument("--work-dir", type=Path, default=None, help="Where vaults are generated, a temporary directory by default")
+    parser.add_argument("--out", type=Path, default=Path("bench_results.json"))
+    args = parser.parse_args(argv)
+
+    METRICS.enable()
+    work_dir = args.work_dir or Path(tempfile.mkdtemp(prefix="world_graph_bench_"))
+    report = {"started": time.time(), "scales": []}
+    try:
+        for num_notes in args.scales:
+            report["scales"].append(run_scale(num_notes, work_dir, args.neo4j, args.dimension, args.seed, args.embedding_latency))
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report["metrics"] = METRICS.snapshot()
+    args.out.write_text(json.dumps(report, indent=2))
+    for scale in report["scales"]:
+        parse = scale["parse"]
+        bench_log.info(f"{scale['notes']} notes: generate {round(scale['generate']['notes_per_second'])} notes/s, parse {round(parse['notes_per_second'])} notes/s")
+    bench_log.info(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,474 @@
+import argparse
+from datetime import datetime, timezone
+import json
+import logging
+import os
+from pathlib import Path
+import shutil
+import subprocess
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Type
+import uuid
+
+from neomodel import ArrayProperty, BooleanProperty, DateTimeProperty, FloatProperty, IntegerProperty, StructuredNode, StructuredRel, db
+
+from world_graph.metrics import METRICS
+from world_graph.neo_model_schema import (
+    LEGACY_EMBEDDING_PROPERTY,
+    Alias,
+    DanglingNeoNote,
+    EmbeddingSpace,
+    FilledNeoNote,
+    Folder,
+    NeoSplit,
+    ObsidianLink as ObsidianLinkRel,
+    Tag,
+    folder_hierarchy,
+)
+from world_graph.objects import AnchorIndex, Note, ObsidianLink, normalize_name
+from world_graph.parse_cache import embedder_signature
+from world_graph.read_obs_file import EMBEDDING_BATCH_NOTES, GraphDog
+
+export_log = logging.getLogger(__name__)
+
+MANIFEST_NAME = "import_manifest.json"
+VAULT_SNAPSHOT_NAME = "vault_snapshot.json"
+ARRAY_DELIMITER = ";"
+
+# neo4j-admin column types of the values neomodel writes for each property type, anything else is a string
+_ADMIN_TYPES = ((BooleanProperty, "boolean"), (IntegerProperty, "long"), (FloatProperty, "double"), (DateTimeProperty, "double"))
+
+
+def admin_type(prop) -> str:
+    if isinstance(prop, ArrayProperty):
+        return f"{admin_type(prop.base_property)}[]" if prop.base_property is not None else "string[]"
+    for property_type, column_type in _ADMIN_TYPES:
+        if isinstance(prop, property_type):
+            return column_type
+    return "string"
+
+
+def _csv_field(value) -> str:
+    # None leaves the property unset, while an empty string stays an empty string (the root Folder's path)
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, (list, tuple)):
+        value = ARRAY_DELIMITER.join(_csv_field(item) for item in value)
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+class _CsvFile:
+    __slots__ = ("_path", "_file", "_columns", "rows")
+
+    def __init__(self, path: Path, header: List[str], columns: List[str]):
+        self._path = path
+        self._file = open(path, "w", encoding="utf-8", newline="")
+        self._file.write(",".join(header) + "\n")
+        self._columns = columns
+        self.rows = 0
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def write(self, fixed: List, props: Dict) -> None:
+        self._file.write(",".join(_csv_field(value) for value in [*fixed, *(props.get(column) for column in self._columns)]) + "\n")
+        self.rows += 1
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class NodeFile(_CsvFile):
+    """
+    Bulk import CSV for one neomodel node class, with the labels and property types neomodel would write.
+    """
+
+    def __init__(self, out_dir: Path, node_class: Type[StructuredNode], extra_columns: Optional[Dict[str, str]] = None):
+        self._properties = node_class.defined_properties(aliases=False, rels=False)
+        self.labels = ARRAY_DELIMITER.join(node_class.inherited_labels())
+        columns = {name: admin_type(prop) for name, prop in self._properties.items()}
+        columns.update(extra_columns if extra_columns else {})
+        header = [":ID", ":LABEL", *(name if column_type == "string" else f"{name}:{column_type}" for name, column_type in columns.items())]
+        super().__init__(out_dir / f"nodes_{node_class.__name__}.csv", header, list(columns))
+
+    def add(self, node_id: str, **props) -> None:
+        for name, value in props.items():
+            prop = self._properties.get(name)
+            if prop is not None and value is not None:
+                props[name] = prop.deflate(value)
+        self.write([node_id, self.labels], props)
+
+
+class RelationshipFile(_CsvFile):
+    def __init__(self, out_dir: Path, relationship_type: str, model: Optional[Type[StructuredRel]] = None):
+        self._properties = model.defined_properties(aliases=False, rels=False) if model else {}
+        columns = {name: admin_type(prop) for name, prop in self._properties.items()}
+        header = [":START_ID", ":END_ID", ":TYPE", *(name if column_type == "string" else f"{name}:{column_type}" for name, column_type in columns.items())]
+        self.relationship_type = relationship_type
+        super().__init__(out_dir / f"relationships_{relationship_type}.csv", header, list(columns))
+
+    def add(self, start_id: str, end_id: str, **props) -> None:
+        self.write([start_id, end_id, self.relationship_type], props)
+
+
+def open_import_files(out_dir: Path, embedding_property: str = LEGACY_EMBEDDING_PROPERTY) -> Tuple[Dict[str, NodeFile], Dict[str, RelationshipFile]]:
+    # One file per node class and relationship type of neo_model_schema, keyed by class name and type
+    embedded = {embedding_property: "double[]"} if embedding_property != LEGACY_EMBEDDING_PROPERTY else None
+    nodes = {
+        node_class.__name__: NodeFile(out_dir, node_class, embedded if node_class in (FilledNeoNote, NeoSplit) else None)
+        for node_class in (FilledNeoNote, NeoSplit, DanglingNeoNote, Alias, Tag, Folder, EmbeddingSpace)
+    }
+    relationships = {
+        relationship_type: RelationshipFile(out_dir, relationship_type, ObsidianLinkRel if relationship_type == "MENTIONED" else None)
+        for relationship_type in ("MENTIONED", "MENTIONED_SPLIT", "HEAD_SPLIT", "CONTAIN_SPLIT", "NEXT_SPLIT", "HAS_ALIAS", "TAGGED", "IN_FOLDER", "CHILD_OF")
+    }
+    return nodes, relationships
+
+
+def write_import_manifest(
+    out_dir: Path, vault, embedding_property: str, dimension: Optional[int], nodes: Dict[str, NodeFile], relationships: Dict[str, RelationshipFile]
+) -> Dict[str, int]:
+    counts = {name: csv_file.rows for name, csv_file in (*nodes.items(), *relationships.items())}
+    manifest = {
+        "vault": str(vault),
+        "embedding_property": embedding_property,
+        "dimension": dimension,
+        "nodes": [csv_file.path.name for csv_file in nodes.values() if csv_file.rows],
+        "relationships": [csv_file.path.name for csv_file in relationships.values() if csv_file.rows],
+        "counts": counts,
+    }
+    (Path(out_dir) / MANIFEST_NAME).write_text(json.dumps(manifest, indent=2))
+    return counts
+
+
+class BulkExporter:
+    """
+    Writes a whole vault as neo4j-admin import CSVs, for a first load at bulk import speed.
+
+    Nodes and relationships follow neo_model_schema: labels, property names and types come from the
+    neomodel classes, and links are resolved the way NeoModelEventHandler resolves them, path first,
+    then name or alias, else a DanglingNeoNote. The first pass parses and embeds the notes in
+    batches and writes them out, keeping only names, aliases and anchors in memory and spooling the
+    links to disk. The second pass resolves the links once every note is known. The vault is
+    scanned before the first note is read and the scan written with the CSVs, finalize_import
+    installs it for ChangeVerifier so the app only picks up what changed since.
+
+    Args:
+        graphdog: Parses and embeds the notes, its embedder decides the vectors written
+        out_dir: Directory the CSVs and their manifest are written to
+        embedding_property: Property the vectors are written to, the active embedding space's
+        batch_size: Notes parsed and embedded together
+    """
+
+    def __init__(self, graphdog: GraphDog, out_dir, embedding_property: str = LEGACY_EMBEDDING_PROPERTY, batch_size: int = EMBEDDING_BATCH_NOTES):
+        self._graphdog = graphdog
+        self._out_dir = Path(out_dir)
+        self._embedding_property = embedding_property
+        self._batch_size = batch_size
+
+        self._note_ids: Dict[str, str] = {}
+        self._note_ids_by_key: Dict[str, List[str]] = {}
+        self._note_ids_by_alias: Dict[str, List[str]] = {}
+        self._dangle_ids: Dict[str, str] = {}
+        self._anchors: Dict[str, AnchorIndex] = {}
+        self._tags: Set[str] = set()
+        self._folders: Set[str] = set()
+        self._aliases: Set[str] = set()
+        self._dimension: Optional[int] = None
+
+    def export(self, note_paths: Optional[Iterable[Path]] = None) -> Dict[str, int]:
+        """
+        Returns:
+            Dict[str, int]: Rows written per node label and relationship type
+        """
+        from world_graph.change_detection import VaultSnapshot, scan_vault
+
+        start_time = time.perf_counter()
+        self._out_dir.mkdir(parents=True, exist_ok=True)
+        # Scanned before any note is read, so the app's verifier dispatches whatever changes during the export
+        vault_snapshot = scan_vault(self._graphdog.path_to_notes)
+        if note_paths is None:
+            note_paths = sorted(vault_snapshot.paths())
+        else:
+            note_paths = list(note_paths)
+            exported = {vault_snapshot.relative(path) for path in note_paths}
+            vault_snapshot = VaultSnapshot(vault_snapshot.root, {path: stat for path, stat in vault_snapshot.entries.items() if path in exported})
+        self._nodes, self._relationships = open_import_files(self._out_dir, self._embedding_property)
+        links_path = self._out_dir / "links.jsonl.tmp"
+        try:
+            with open(links_path, "w", encoding="utf-8") as links_file:
+                for start in range(0, len(note_paths), self._batch_size):
+                    for note in self._graphdog.serialize_obsidian_notes(note_paths[start : start + self._batch_size]):
+                        self._write_note(note, links_file)
+                    METRICS.inc("bulk_exported_notes_total", min(self._batch_size, len(note_paths) - start))
+                    export_log.info(f"Exported {min(start + self._batch_size, len(note_paths))} / {len(note_paths)} notes.")
+
+            self._write_shared_nodes()
+            with open(links_path, encoding="utf-8") as links_file:
+                self._resolve_links(links_file)
+        finally:
+            for csv_file in (*self._nodes.values(), *self._relationships.values()):
+                csv_file.close()
+            links_path.unlink(missing_ok=True)
+
+        vault_snapshot.save(self._out_dir / VAULT_SNAPSHOT_NAME)
+        counts = write_import_manifest(self._out_dir, self._graphdog.path_to_notes, self._embedding_property, self._dimension, self._nodes, self._relationships)
+        export_log.info(f"Exported {len(note_paths)} notes to {self._out_dir} in {round(time.perf_counter() - start_time, 2)} seconds.")
+        return counts
+
+    def _write_note(self, note: Note, links_file) -> None:
+        note_id = f"n{len(self._note_ids)}"
+        self._note_ids[str(note.path)] = note_id
+        self._note_ids_by_key.setdefault(normalize_name(note.name), []).append(note_id)
+        if len(note.anchors):
+            self._anchors[note_id] = note.anchors
+
+        vectors = {self._embedding_property: note.embedding.tolist() if len(note.embedding) else None}
+        if self._dimension is None and len(note.embedding):
+            self._dimension = len(note.embedding)
+        self._nodes["FilledNeoNote"].add(
+            note_id,
+            path=str(note.path),
+            content=note.content,
+            name=note.name,
+            name_key=normalize_name(note.name),
+            modified_time=note.modified_time,
+            anchor_index=note.anchors.to_dict(),
+            **vectors,
+        )
+
+        previous_split_id = None
+        for split in note.splits:
+            split_id = f"{note_id}s{split.count}"
+            split_vectors = {self._embedding_property: split.embedding.tolist() if len(split.embedding) else None}
+            self._nodes["NeoSplit"].add(split_id, count=split.count, name=split.name, content=split.content, **split_vectors)
+            self._relationships["HEAD_SPLIT" if previous_split_id is None else "NEXT_SPLIT"].add(previous_split_id if previous_split_id else note_id, split_id)
+            self._relationships["CONTAIN_SPLIT"].add(note_id, split_id)
+            for tag in {tag.casefold() for tag in split.tags}:
+                self._tags.add(tag)
+                self._relationships["TAGGED"].add(split_id, f"t:{tag}")
+            previous_split_id = split_id
+
+        for alias in note.aliases:
+            key = normalize_name(alias)
+            if key not in self._aliases:
+                self._aliases.add(key)
+                self._nodes["Alias"].add(f"a:{key}", key=key, name=alias)
+            self._note_ids_by_alias.setdefault(key, []).append(note_id)
+            self._relationships["HAS_ALIAS"].add(note_id, f"a:{key}")
+
+        for tag in {tag.casefold() for tag in note.tags}:
+            self._tags.add(tag)
+            self._relationships["TAGGED"].add(note_id, f"t:{tag}")
+
+        folder_path = self._folder_of(note.path)
+        if folder_path is not None:
+            for row in folder_hierarchy(folder_path, self._graphdog.vault_name):
+                if row["path"] not in self._folders:
+                    self._folders.add(row["path"])
+                    self._nodes["Folder"].add(f"f:{row['path']}", path=row["path"], name=row["name"])
+                    if row["parent"] is not None:
+                        self._relationships["CHILD_OF"].add(f"f:{row['path']}", f"f:{row['parent']}")
+            self._relationships["IN_FOLDER"].add(note_id, f"f:{folder_path}")
+
+        links = [
+            [split.count, link.format_type, str(link.target), link.display_text, link.headers, link.block_hash]
+            for split in note.splits
+            for link in split.outgoing_links
+        ]
+        if links:
+            links_file.write(json.dumps([note_id, links]) + "\n")
+
+    def _write_shared_nodes(self) -> None:
+        # A tag's immediate parent is created with it, as set_tags_and_folder does
+        parents = {tag.rsplit("/", 1)[0] for tag in self._tags if "/" in tag}
+        for tag in sorted(self._tags | parents):
+            self._nodes["Tag"].add(f"t:{tag}", name=tag)
+        for tag in sorted(self._tags):
+            if "/" in tag:
+                self._relationships["CHILD_OF"].add(f"t:{tag}", f"t:{tag.rsplit('/', 1)[0]}")
+
+        embedder = self._graphdog.embedder
+        if embedder is not None and self._dimension is not None:
+            # Recorded as the active space, so the app serves these vectors instead of re-embedding them
+            self._nodes["EmbeddingSpace"].add(
+                "space",
+                model=embedder_signature(embedder),
+                property=self._embedding_property,
+                dimension=self._dimension,
+                state="active",
+                updated_time=datetime.now(timezone.utc),
+            )
+
+    def _resolve_links(self, links_file) -> None:
+        root = self._graphdog.path_to_notes
+        for line in links_file:
+            note_id, links = json.loads(line)
+            mentions, chunk_links = {}, set()  # Target id to the chunk links to it, see ObsidianLinkRel.chunk_links
+            for count, format_type, target, display_text, headers, block_hash in links:
+                link = ObsidianLink(format_type, Path(target), display_text, headers, block_hash)
+                if link.is_self_link():
+                    self._queue_chunk_link(chunk_links, note_id, count, note_id, link)
+                    continue
+
+                target_id = self._note_ids.get(str(root / link.target))
+                if target_id is None:
+                    candidates = self._resolve_name(link.target.stem)
+                    if len(candidates) > 1:
+                        export_log.warning(f"Link from {note_id} to {link.target.stem} has {len(candidates)} candidates, skipped.")
+                        continue
+                    target_id = candidates[0] if candidates else self._create_dangle(link.target.stem)
+
+                anchored_links = mentions.setdefault(target_id, [])
+                if link.is_link_to_chunk():
+                    anchored_links.append([count, headers, block_hash])
+                    if not target_id.startswith("d"):
+                        self._queue_chunk_link(chunk_links, note_id, count, target_id, link)
+
+            for target_id, anchored_links in mentions.items():
+                chunk_links_json = json.dumps(anchored_links) if anchored_links else None
+                self._relationships["MENTIONED"].add(note_id, target_id, uid=uuid.uuid4().hex, chunk_links=chunk_links_json)
+            for source_split_id, target_split_id in chunk_links:
+                self._relationships["MENTIONED_SPLIT"].add(source_split_id, target_split_id)
+
+    def _resolve_name(self, name: str) -> List[str]:
+        key = normalize_name(name)
+        if key in self._dangle_ids:
+            return [self._dangle_ids[key]]
+        return list(dict.fromkeys(self._note_ids_by_key.get(key, []) + self._note_ids_by_alias.get(key, [])))
+
+    def _create_dangle(self, name: str) -> str:
+        key = normalize_name(name)
+        dangle_id = f"d{len(self._dangle_ids)}"
+        self._dangle_ids[key] = dangle_id
+        self._nodes["DanglingNeoNote"].add(dangle_id, name=name, name_key=key)
+        return dangle_id
+
+    def _queue_chunk_link(self, chunk_links: Set[Tuple[str, str]], note_id: str, count: int, target_id: str, link) -> None:
+        anchors = self._anchors.get(target_id)
+        target_count = anchors.resolve(link) if anchors else None
+        if target_count is not None:
+            chunk_links.add((f"{note_id}s{count}", f"{target_id}s{target_count}"))
+
+    def _folder_of(self, path: Path) -> Optional[str]:
+        try:
+            relative_path = Path(path).relative_to(self._graphdog.path_to_notes)
+        except ValueError:
+            return None
+        return "" if relative_path.parent == Path(".") else relative_path.parent.as_posix()
+
+
+def install_vault_snapshot(source, vault_snapshot_path=None) -> bool:
+    """
+    Hands the vault state a load was made from to ChangeVerifier, so the app's first run only
+    dispatches the notes changed since instead of creating every note again.
+
+    Args:
+        source: Vault snapshot written by BulkExporter.export or export_snapshot
+        vault_snapshot_path: ChangeVerifier's snapshot path, WORLD_GRAPH_VAULT_SNAPSHOT by default
+
+    Returns:
+        bool: Whether there was a vault snapshot to install
+    """
+    from world_graph.change_detection import DEFAULT_SNAPSHOT_PATH
+
+    source = Path(source)
+    if not source.exists():
+        export_log.warning(f"No vault snapshot at {source}, the app's first run ingests the whole vault again.")
+        return False
+    vault_snapshot_path = Path(vault_snapshot_path if vault_snapshot_path else os.getenv("WORLD_GRAPH_VAULT_SNAPSHOT", DEFAULT_SNAPSHOT_PATH))
+    shutil.copyfile(source, vault_snapshot_path)
+    export_log.info(f"Installed the vault snapshot of {source.parent} at {vault_snapshot_path}.")
+    return True
+
+
+def import_command(export_dir, database: str = "neo4j", neo4j_admin: str = "neo4j-admin") -> List[str]:
+    export_dir = Path(export_dir)
+    manifest = json.loads((export_dir / MANIFEST_NAME).read_text())
+    command = [neo4j_admin, "database", "import", "full", database, "--overwrite-destination", "--id-type=string", "--multiline-fields=true"]
+    command.append(f"--array-delimiter={ARRAY_DELIMITER}")
+    command.extend(f"--nodes={export_dir / name}" for name in manifest["nodes"])
+    command.extend(f"--relationships={export_dir / name}" for name in manifest["relationships"])
+    return command
+
+
+def load_into_neo4j(export_dir, database: str = "neo4j", neo4j_admin: Optional[str] = None) -> None:
+    """
+    Runs the offline `neo4j-admin database import full` over an export, replacing `database`.
+
+    The database must be stopped, or not yet created. Start it afterwards and run `finalize_import`.
+    """
+    neo4j_admin = neo4j_admin if neo4j_admin else os.getenv("NEO4J_ADMIN", "neo4j-admin")
+    if shutil.which(neo4j_admin) is None:
+        raise FileNotFoundError(f"{neo4j_admin} not found, set NEO4J_ADMIN to the neo4j-admin of the local Neo4j installation.")
+    command = import_command(export_dir, database, neo4j_admin)
+    export_log.info(f"Running {' '.join(command[:5])} with {len(command) - 5} inputs.")
+    subprocess.run(command, check=True)
+
+
+def finalize_import(export_dir, m: int = 128, ef: int = 400, vault_snapshot_path=None) -> None:
+    """
+    Creates the neomodel constraints and indexes, scores centrality, then creates the vector indexes, once the imported database is running.
+
+    A bulk export's vault snapshot is installed at `vault_snapshot_path` last, see install_vault_snapshot.
+    """
+    from world_graph.centrality import CentralityIndex
+    from world_graph.embedding_spaces import EMBEDDED_LABELS, vector_index_name
+    from world_graph.neo_model_handler import NeoModelEventHandler
+
+    manifest = json.loads((Path(export_dir) / MANIFEST_NAME).read_text())
+    db.install_all_labels()
+    CentralityIndex().recompute()
+    if manifest["dimension"] is not None:
+        handle = NeoModelEventHandler(GraphDog(manifest["vault"], None))
+        for label in EMBEDDED_LABELS:
+            name = vector_index_name(label, manifest["embedding_property"])
+            handle.create_vector_index(name, node_type=label, embed_name=manifest["embedding_property"], dimension=manifest["dimension"], m=m, ef=ef)
+    # A restored snapshot's work dir has none, snapshot's restore installs it itself
+    if (Path(export_dir) / VAULT_SNAPSHOT_NAME).exists():
+        install_vault_snapshot(Path(export_dir) / VAULT_SNAPSHOT_NAME, vault_snapshot_path)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="First load of a large vault through neo4j-admin bulk import.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="Parse and embed the vault into import CSVs")
+    export.add_argument("vault", type=Path)
+    export.add_argument("out", type=Path)
+    export.add_argument("--embedding-property", default=LEGACY_EMBEDDING_PROPERTY)
+    export.add_argument("--batch-size", type=int, default=EMBEDDING_BATCH_NOTES)
+    load = commands.add_parser("load", help="Import an export into a stopped database")
+    load.add_argument("export", type=Path)
+    load.add_argument("--database", default="neo4j")
+    load.add_argument("--neo4j-admin", default=None)
+    finalize = commands.add_parser("finalize", help="Create indexes once the imported database is running")
+    finalize.add_argument("export", type=Path)
+    finalize.add_argument("--vault-snapshot", type=Path, default=None, help="ChangeVerifier's snapshot path, WORLD_GRAPH_VAULT_SNAPSHOT by default")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "export":
+        from world_graph.chunking import MarkdownThenNLTKSentWithLinkMasking
+        from world_graph.embedding import load_embedding_model
+
+        embedding, _ = load_embedding_model(model_name=os.getenv("WORLD_GRAPH_EMBEDDING_MODEL"), backend=os.getenv("WORLD_GRAPH_EMBEDDING_BACKEND"))
+        graphdog = GraphDog(args.vault, None, MarkdownThenNLTKSentWithLinkMasking(), embedding)
+        counts = BulkExporter(graphdog, args.out, args.embedding_property, args.batch_size).export()
+        print(json.dumps(counts, indent=2))
+    elif args.command == "load":
+        load_into_neo4j(args.export, args.database, args.neo4j_admin)
+    else:
+        from world_graph.neo_model_handler import create_neo_model_connection
+
+        create_neo_model_connection()
+        finalize_import(args.export, vault_snapshot_path=args.vault_snapshot)
+        db.close_connection()
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,203 @@
+from contextlib import contextmanager
+import logging
+import threading
+import time
+from typing import Dict, List, Optional
+
+from neomodel import db
+
+from world_graph.metrics import METRICS
+from world_graph.scheduler import Priority
+
+centrality_log = logging.getLogger(__name__)
+
+DAMPING = 0.85
+# Score of a note nothing links to, centrality is PageRank scaled so an average note scores about 1
+BASE_CENTRALITY = 1 - DAMPING
+RECOMPUTE_BATCH_SIZE = 1000
+
+# Sets a note's own in-degree and score from the notes linking to it, then adds its share to every note it links to.
+# Splits carry their note's score, so split level searches can be boosted without a join.
+_NOTE_LINKED_CYPHER = """
+MATCH (n:FilledNeoNote) WHERE elementId(n) = $element_id
+CALL {
+    WITH n
+    OPTIONAL MATCH (source:FilledNeoNote)-[:MENTIONED]->(n) WHERE source <> n
+    WITH DISTINCT source
+    WITH source, COUNT { MATCH (source)-[:MENTIONED]->(target) WHERE target <> source RETURN DISTINCT target } AS out_degree
+    RETURN count(source) AS in_degree, sum(CASE WHEN source IS NULL THEN 0.0 ELSE coalesce(source.centrality, $base) / out_degree END) AS inflow
+}
+SET n.in_degree = in_degree, n.centrality = $base + $damping * inflow
+WITH n, COUNT { MATCH (n)-[:MENTIONED]->(target) WHERE target <> n RETURN DISTINCT target } AS out_degree
+CALL {
+    WITH n
+    MATCH (n)-[:CONTAIN_SPLIT]->(split:NeoSplit)
+    SET split.centrality = n.centrality
+}
+CALL {
+    WITH n, out_degree
+    MATCH (n)-[:MENTIONED]->(target:FilledNeoNote) WHERE target <> n
+    WITH DISTINCT n, out_degree, target
+    SET target.in_degree = coalesce(target.in_degree, 0) + 1,
+        target.centrality = coalesce(target.centrality, $base) + $damping * n.centrality / out_degree
+    WITH target
+    MATCH (target)-[:CONTAIN_SPLIT]->(split:NeoSplit)
+    SET split.centrality = target.centrality
+}"""
+
+# Takes back the share a note about to lose its outgoing links gave every note it links to
+_NOTE_UNLINKING_CYPHER = """
+MATCH (n:FilledNeoNote) WHERE elementId(n) = $element_id
+WITH n, COUNT { MATCH (n)-[:MENTIONED]->(target) WHERE target <> n RETURN DISTINCT target } AS out_degree
+MATCH (n)-[:MENTIONED]->(target:FilledNeoNote) WHERE target <> n
+WITH DISTINCT n, out_degree, target
+WITH target, coalesce(target.centrality, $base) - $damping * coalesce(n.centrality, $base) / out_degree AS centrality
+SET target.in_degree = CASE WHEN coalesce(target.in_degree, 0) > 0 THEN target.in_degree - 1 ELSE 0 END,
+    target.centrality = CASE WHEN centrality < $base THEN $base ELSE centrality END
+WITH target
+MATCH (target)-[:CONTAIN_SPLIT]->(split:NeoSplit)
+SET split.centrality = target.centrality"""
+
+_WRITE_SCORES_CYPHER = """
+UNWIND $rows AS row
+MATCH (n:FilledNeoNote) WHERE elementId(n) = row.id
+SET n.centrality = row.centrality, n.in_degree = row.in_degree
+WITH n
+MATCH (n)-[:CONTAIN_SPLIT]->(split:NeoSplit)
+SET split.centrality = n.centrality"""
+
+
+def centrality_boost(score_var: str) -> str:
+    # Cypher for a note's score squashed into [0, 1), an average note gets 0.5
+    centrality = f"coalesce({score_var}.centrality, {BASE_CENTRALITY})"
+    return f"({centrality} / ({centrality} + 1.0))"
+
+
+class CentralityIndex:
+    """
+    Keeps a PageRank style centrality, and the exact in-degree, of every note over MENTIONED links.
+
+    The score follows the classic form centrality(n) = (1 - d) + d * sum(centrality(s) / out_degree(s))
+    over the notes s linking to n, a link counting once per pair of notes. It is updated
+    incrementally from each event's link changes: a created note takes its score from the notes
+    already linking to it and adds its share to the notes it links to, a note losing its links
+    takes its share back. These first order updates do not propagate further, `recompute` rebuilds
+    every score with power iteration and is run periodically in the background to remove the drift.
+
+    Args:
+        damping: PageRank damping factor
+        iterations: Most power iterations per recompute
+        tolerance: Recompute stops once no score moves by more than this
+        scheduler: Runs recomputes as background work, yielding to queries and live edits
+        batch_size: Notes written per statement when recomputing
+    """
+
+    def __init__(
+        self,
+        damping: float = DAMPING,
+        iterations: int = 30,
+        tolerance: float = 1e-4,
+        scheduler=None,
+        batch_size: int = RECOMPUTE_BATCH_SIZE,
+    ):
+        self._damping = damping
+        self._iterations = iterations
+        self._tolerance = tolerance
+        self._scheduler = scheduler
+        self._batch_size = batch_size
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base(self) -> float:
+        return 1 - self._damping
+
+    def note_linked(self, element_id: str) -> None:
+        # After a note and its outgoing links were written
+        db.cypher_query(_NOTE_LINKED_CYPHER, {"element_id": element_id, "base": self.base, "damping": self._damping})
+
+    def note_unlinking(self, element_id: str) -> None:
+        # Before a note's outgoing links are removed
+        db.cypher_query(_NOTE_UNLINKING_CYPHER, {"element_id": element_id, "base": self.base, "damping": self._damping})
+
+    def recompute(self) -> Dict[str, float]:
+        """
+        Rebuilds every note's score and in-degree from the whole MENTIONED graph.
+
+        Returns:
+            Dict[str, float]: Notes scored, iterations run and seconds taken
+        """
+        start_time = time.perf_counter()
+        with self._background():
+            node_rows, _ = db.cypher_query("MATCH (n:FilledNeoNote) RETURN elementId(n)")
+            edge_rows, _ = db.cypher_query(
+                """
+                MATCH (source:FilledNeoNote)-[:MENTIONED]->(target:NeoNote) WHERE source <> target
+                RETURN DISTINCT elementId(source), elementId(target)"""
+            )
+
+        # Dangles are kept as link targets, they hold no score but count towards their sources' out-degree
+        index: Dict[str, int] = {row[0]: i for i, row in enumerate(node_rows)}
+        num_notes = len(index)
+        out_degree = [0] * num_notes
+        incoming: List[List[int]] = [[] for _ in range(num_notes)]
+        for source_id, target_id in edge_rows:
+            source = index.get(source_id)
+            if source is None:
+                continue
+            out_degree[source] += 1
+            target = index.get(target_id)
+            if target is not None:
+                incoming[target].append(source)
+
+        scores = [1.0] * num_notes
+        iterations = 0
+        for iterations in range(1, self._iterations + 1):
+            shares = [score / degree if degree else 0.0 for score, degree in zip(scores, out_degree)]
+            updated = [self.base + self._damping * sum(shares[source] for source in sources) for sources in incoming]
+            delta = max((abs(new - old) for new, old in zip(updated, scores)), default=0.0)
+            scores = updated
+            if delta < self._tolerance:
+                break
+
+        element_ids = list(index)
+        for start in range(0, num_notes, self._batch_size):
+            rows = [
+                {"id": element_ids[i], "centrality": scores[i], "in_degree": len(incoming[i])}
+                for i in range(start, min(start + self._batch_size, num_notes))
+            ]
+            with self._background():
+                db.cypher_query(_WRITE_SCORES_CYPHER, {"rows": rows})
+
+        elapsed = time.perf_counter() - start_time
+        METRICS.observe("centrality_recompute_seconds", elapsed)
+        centrality_log.info(f"Recomputed centrality of {num_notes} notes over {len(edge_rows)} links in {iterations} iterations, {round(elapsed, 2)} seconds.")
+        return {"notes": num_notes, "links": len(edge_rows), "iterations": iterations, "seconds": elapsed}
+
+    def start(self, interval: float) -> threading.Thread:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(interval,), name="centrality", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            try:
+                self.recompute()
+            except Exception as e:
+                centrality_log.exception(f"Centrality recompute failed: {e}")
+
+    @contextmanager
+    def _background(self):
+        if self._scheduler is None:
+            yield
+            return
+        with self._scheduler.priority(Priority.BACKGROUND):
+            self._scheduler.checkpoint()
+            yield
@@ -0,0 +1,351 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import json
+import logging
+import os
+from pathlib import Path
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from world_graph.metrics import METRICS
+
+change_log = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+DEFAULT_IGNORED_DIRS = frozenset((".git", ".obsidian", ".trash"))
+DEFAULT_SCAN_WORKERS = 8
+DEFAULT_SNAPSHOT_PATH = "world_graph_vault_snapshot.json"
+# Seconds a path is left to watchdog after one of its events, so a verify pass does not replay an event still in flight
+WATCHDOG_GRACE_PERIOD = 2.0
+
+
+class FileStat(NamedTuple):
+    inode: int
+    size: int
+    mtime_ns: int
+
+
+class SnapshotDiff(NamedTuple):
+    created: List[str]
+    deleted: List[str]
+    modified: List[str]
+    moved: List[Tuple[str, str]]
+
+    def is_empty(self) -> bool:
+        return not (self.created or self.deleted or self.modified or self.moved)
+
+    def __len__(self) -> int:
+        return len(self.created) + len(self.deleted) + len(self.modified) + len(self.moved)
+
+
+class VaultSnapshot:
+    """
+    (inode, size, mtime_ns) of every note in a vault, keyed by vault relative posix path.
+    """
+
+    __slots__ = ("_root", "_entries")
+
+    def __init__(self, root, entries: Optional[Dict[str, FileStat]] = None):
+        self._root = Path(root)
+        self._entries = entries if entries is not None else {}
+
+    @property
+    def root(self) -> Path:
+        return self._root
+
+    @property
+    def entries(self) -> Dict[str, FileStat]:
+        return self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def paths(self) -> List[Path]:
+        return [self._root / relative_path for relative_path in self._entries]
+
+    def relative(self, path) -> Optional[str]:
+        try:
+            return Path(path).relative_to(self._root).as_posix()
+        except ValueError:
+            return None
+
+    def update_path(self, path) -> None:
+        # Re-stat one file after an event, dropping it if it is gone
+        relative_path = self.relative(path)
+        if relative_path is None:
+            return
+        try:
+            stat = os.stat(path, follow_symlinks=False)
+        except OSError:
+            self._entries.pop(relative_path, None)
+            return
+        self._entries[relative_path] = FileStat(stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def remove_path(self, path) -> None:
+        relative_path = self.relative(path)
+        if relative_path is not None:
+            self._entries.pop(relative_path, None)
+
+    def save(self, path) -> None:
+        path = Path(path)
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        rows = [[relative_path, *stat] for relative_path, stat in self._entries.items()]
+        tmp_path.write_text(json.dumps({"version": SNAPSHOT_VERSION, "root": str(self._root), "entries": rows}, separators=(",", ":")))
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(cls, path, root) -> Optional["VaultSnapshot"]:
+        try:
+            stored = json.loads(Path(path).read_text())
+        except (OSError, ValueError):
+            return None
+        if stored.get("version") != SNAPSHOT_VERSION or stored.get("root") != str(root):
+            return None
+        return cls(root, {row[0]: FileStat(*row[1:]) for row in stored["entries"]})
+
+
+def scan_vault(
+    root,
+    note_ext_type: str = ".md",
+    workers: int = DEFAULT_SCAN_WORKERS,
+    ignored_dirs: Iterable[str] = DEFAULT_IGNORED_DIRS,
+) -> VaultSnapshot:
+    """
+    Walks the vault with one `os.scandir` per directory, spread over a thread pool.
+
+    Directories are scanned as soon as their parent lists them, so wide trees and slow network
+    mounts keep every worker busy. Symlinks are not followed.
+    """
+    root = Path(root)
+    ignored_dirs = frozenset(ignored_dirs)
+    root_prefix = len(str(root)) + 1
+
+    def _scan_directory(directory: str) -> Tuple[List[Tuple[str, FileStat]], List[str]]:
+        files, subdirectories = [], []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.name not in ignored_dirs:
+                                subdirectories.append(entry.path)
+                        elif entry.name.endswith(note_ext_type) and entry.is_file(follow_symlinks=False):
+                            stat = entry.stat(follow_symlinks=False)
+                            relative_path = entry.path[root_prefix:].replace(os.sep, "/")
+                            files.append((relative_path, FileStat(stat.st_ino, stat.st_size, stat.st_mtime_ns)))
+                    except OSError:
+                        continue  # Removed mid-scan
+        except OSError as e:
+            change_log.debug(f"Skipping unreadable directory {directory}: {e}")
+        return files, subdirectories
+
+    start_time = time.perf_counter()
+    entries: Dict[str, FileStat] = {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="vault-scan") as pool:
+        pending = {pool.submit(_scan_directory, str(root))}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, subdirectories = future.result()
+                entries.update(files)
+                pending.update(pool.submit(_scan_directory, subdirectory) for subdirectory in subdirectories)
+
+    METRICS.observe("vault_scan_seconds", time.perf_counter() - start_time)
+    return VaultSnapshot(root, entries)
+
+
+def diff_snapshots(old: VaultSnapshot, new: VaultSnapshot) -> SnapshotDiff:
+    """
+    Changes taking `old` to `new`. A deleted and a created path sharing an inode are reported as a move.
+    """
+    old_entries, new_entries = old.entries, new.entries
+    deleted = [path for path in old_entries if path not in new_entries]
+    created = [path for path in new_entries if path not in old_entries]
+    modified = [path for path, stat in new_entries.items() if path in old_entries and old_entries[path] != stat]
+
+    moved = []
+    if deleted and created:
+        created_by_inode = {new_entries[path].inode: path for path in created}
+        for path in list(deleted):
+            destination = created_by_inode.pop(old_entries[path].inode, None)
+            if destination is not None:
+                moved.append((path, destination))
+        moved_sources = {source for source, _ in moved}
+        moved_destinations = {destination for _, destination in moved}
+        deleted = [path for path in deleted if path not in moved_sources]
+        created = [path for path in created if path not in moved_destinations]
+
+    return SnapshotDiff(created, deleted, modified, moved)
+
+
+class ChangeVerifier:
+    """
+    Keeps the graph in line with the vault when watchdog misses events, or instead of watchdog.
+
+    The verifier holds the vault state it believes the graph reflects. Events delivered by watchdog
+    pass through `observed` and update that belief. Every `interval` seconds the vault is scanned and
+    diffed against it, and whatever changed without an event is dispatched to the handler. Paths
+    with a watchdog event in the last `grace_period` seconds are left alone. Without an observer,
+    e.g. past the inotify watch limit, the same loop acts as a polling watcher.
+
+    Args:
+        handle: Exposes on_created, on_modified, on_moved and on_deleted like NeoModelEventHandler
+        vault_path: Root of the vault
+        snapshot_path: Where the believed state is persisted between runs, None to keep it in memory
+        interval: Seconds between verify passes
+        note_ext_type: Extension of the files tracked
+        workers: Threads used by each scan
+        checkpoint: Called before each dispatched change, e.g. PriorityScheduler.checkpoint to yield to queries
+    """
+
+    def __init__(
+        self,
+        handle,
+        vault_path,
+        snapshot_path=None,
+        interval: float = 60.0,
+        note_ext_type: str = ".md",
+        workers: int = DEFAULT_SCAN_WORKERS,
+        grace_period: float = WATCHDOG_GRACE_PERIOD,
+        checkpoint: Optional[Callable[[], None]] = None,
+    ):
+        self._handle = handle
+        self._vault_path = Path(vault_path)
+        self._snapshot_path = Path(snapshot_path) if snapshot_path else None
+        self._interval = interval
+        self._note_ext_type = note_ext_type
+        self._workers = workers
+        self._grace_period = grace_period
+        self._checkpoint = checkpoint
+        self._lock = threading.Lock()
+        self._recent_events: Dict[str, float] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        stored = VaultSnapshot.load(self._snapshot_path, self._vault_path) if self._snapshot_path else None
+        self._believed = stored if stored is not None else VaultSnapshot(self._vault_path)
+
+    @property
+    def believed(self) -> VaultSnapshot:
+        return self._believed
+
+    def observed(self, callback: Callable, deferred: bool = False) -> Callable:
+        """
+        Wraps a watchdog callback so the paths of its events count as seen once it succeeded.
+
+        With `deferred` the callback only queues the event, e.g. EventBatcher.callback, and is called
+        as `callback(event, on_done)`. The paths then count as seen once `on_done(True)` reports the
+        event committed. A failed event leaves the paths unseen, so the next verify pass dispatches
+        it again.
+        """
+
+        def _settle(paths: List[str], succeeded: bool) -> None:
+            with self._lock:
+                for path in paths:
+                    if succeeded:
+                        self._believed.update_path(path)
+                    else:
+                        self._recent_events.pop(self._believed.relative(path), None)
+
+        def _return(event):
+            paths = [os.fsdecode(event.src_path)] + ([os.fsdecode(event.dest_path)] if getattr(event, "dest_path", "") else [])
+            now = time.monotonic()
+            with self._lock:
+                for path in paths:
+                    relative_path = self._believed.relative(path)
+                    if relative_path is not None:
+                        self._recent_events[relative_path] = now
+            if deferred:
+                return callback(event, lambda succeeded: _settle(paths, succeeded))
+            try:
+                result = callback(event)
+            except Exception:
+                _settle(paths, False)
+                raise
+            _settle(paths, True)
+            return result
+
+        return _return
+
+    def scan(self) -> VaultSnapshot:
+        return scan_vault(self._vault_path, self._note_ext_type, self._workers)
+
+    def verify(self) -> SnapshotDiff:
+        """
+        Scans the vault once and dispatches every change the handler has not seen.
+        """
+        pass_start = time.monotonic()
+        actual = self.scan()
+        with self._lock:
+            diff = diff_snapshots(self._believed, actual)
+            recent = {path for path, seen in self._recent_events.items() if seen >= pass_start - self._grace_period}
+            self._recent_events = {path: self._recent_events[path] for path in recent}
+
+        diff = SnapshotDiff(
+            [path for path in diff.created if path not in recent],
+            [path for path in diff.deleted if path not in recent],
+            [path for path in diff.modified if path not in recent],
+            [(source, destination) for source, destination in diff.moved if source not in recent and destination not in recent],
+        )
+        if not diff.is_empty():
+            change_log.warning(
+                f"Verifier found {len(diff)} unseen changes: {len(diff.created)} created, {len(diff.modified)} modified, "
+                f"{len(diff.moved)} moved, {len(diff.deleted)} deleted."
+            )
+        self.apply(diff, actual)
+        return diff
+
+    def apply(self, diff: SnapshotDiff, actual: VaultSnapshot) -> None:
+        from world_graph.neo_model_handler import MockFileSystemEvent
+
+        root = self._vault_path
+        dispatches = (
+            ("deleted", self._handle.on_deleted(), [(root / path, "") for path in diff.deleted]),
+            ("moved", self._handle.on_moved(), [(root / source, root / destination) for source, destination in diff.moved]),
+            ("created", self._handle.on_created(), [(root / path, "") for path in diff.created]),
+            ("modified", self._handle.on_modified(), [(root / path, "") for path in diff.modified]),
+        )
+        for event_type, callback, events in dispatches:
+            for src_path, dest_path in events:
+                if self._checkpoint:
+                    self._checkpoint()
+                METRICS.inc("missed_events_total", event_type=event_type)
+                try:
+                    callback(MockFileSystemEvent(src_path, dest_path=dest_path, event_type=event_type))
+                except Exception as e:
+                    change_log.exception(f"Replaying missed {event_type} of {src_path} failed: {e}")
+                    continue
+                with self._lock:
+                    for path in (src_path, dest_path):
+                        if path:
+                            relative_path = actual.relative(path)
+                            if relative_path in actual.entries:
+                                self._believed.entries[relative_path] = actual.entries[relative_path]
+                            else:
+                                self._believed.remove_path(path)
+
+        if self._snapshot_path:
+            with self._lock:
+                self._believed.save(self._snapshot_path)
+
+    def start(self, interval: Optional[float] = None, verify_now: bool = False) -> threading.Thread:
+        # With `verify_now` the first pass runs right away instead of after one interval
+        self._interval = interval if interval else self._interval
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(verify_now,), name="change-verifier", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, verify_now: bool = False) -> None:
+        while not self._stop.wait(0 if verify_now else self._interval):
+            verify_now = False
+            try:
+                self.verify()
+            except Exception as e:
+                change_log.exception(f"Verify pass over {self._vault_path} failed: {e}")
@@ -1,10 +1,35 @@
+import functools
 import re
-from typing import List
-from langchain_text_splitters import MarkdownHeaderTextSplitter, NLTKTextSplitter
-from langchain_core.documents import Document
+import threading
+from typing import TYPE_CHECKING, List
 
+from world_graph.note_parsing import sentence_tokenizer
 from world_graph.objects import NoteSplitter
 
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+
+
+@functools.lru_cache(maxsize=None)
+def punkt_text_splitter_class() -> type:
+    # Defined on first use, so langchain is only imported once a note is split
+    from langchain_text_splitters import TextSplitter
+
+    class PunktTextSplitter(TextSplitter):
+        """
+        NLTKTextSplitter, with its sentences split by the punkt tokenizer every thread shares, see note_parsing.sentence_tokenizer.
+        """
+
+        def __init__(self, separator: str = "\n\n", language: str = "english", **kwargs) -> None:
+            super().__init__(**kwargs)
+            self._separator = separator
+            self._language = language
+
+        def split_text(self, text: str) -> List[str]:
+            return self._merge_splits(sentence_tokenizer(self._language)(text), self._separator)
+
+    return PunktTextSplitter
+
 
 class MarkdownThenNLTKSentWithLinkMasking(NoteSplitter):
     def __init__(self, headers_to_split_on=None, chunk_size=10, chunk_overlap=0) -> None:
@@ -22,14 +47,46 @@ class MarkdownThenNLTKSentWithLinkMasking(NoteSplitter):
             else headers_to_split_on
         )
 
-        # MD splits
-        self.markdown_splitter = MarkdownHeaderTextSplitter(headers_to_split_on=headers_to_split_on, strip_headers=False)
-        self.nltk_splitter = NLTKTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        self._settings = (tuple(headers_to_split_on), chunk_size, chunk_overlap)
+
+        # langchain and NLTK are only imported, and the splitters built, on the first split (or `warm_up`)
+        self._markdown_splitter = None
+        self._nltk_splitter = None
+        self._build_lock = threading.Lock()
+
+    @property
+    def signature(self) -> str:
+        return f"{type(self).__name__}{self._settings}"
+
+    @property
+    def markdown_splitter(self):
+        if self._markdown_splitter is None:
+            self.warm_up()
+        return self._markdown_splitter
+
+    @property
+    def nltk_splitter(self):
+        if self._nltk_splitter is None:
+            self.warm_up()
+        return self._nltk_splitter
+
+    def warm_up(self) -> None:
+        with self._build_lock:
+            if self._nltk_splitter is not None:
+                return
+            from langchain_text_splitters import MarkdownHeaderTextSplitter
+
+            headers_to_split_on, chunk_size, chunk_overlap = self._settings
+            # MD splits
+            self._markdown_splitter = MarkdownHeaderTextSplitter(headers_to_split_on=list(headers_to_split_on), strip_headers=False)
+            self._nltk_splitter = punkt_text_splitter_class()(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
 
     def split_string(self, note_content: str) -> List[str]:
+        from langchain_core.documents import Document
+
         return [c.page_content for c in self.split_documents([Document(note_content)])]
 
-    def split_documents(self, markdown_documents: List[Document]) -> List[Document]:
+    def split_documents(self, markdown_documents: List["Document"]) -> List["Document"]:
         """
         Splits a list of markdown documents into smaller segments while preserving
         embedded wiki-style links.
@@ -48,6 +105,8 @@ class MarkdownThenNLTKSentWithLinkMasking(NoteSplitter):
                 A list of `Document` objects, each representing a smaller segment of
                 the original documents, with wiki-style links restored.
         """
+        from langchain_core.documents import Document
+
         out_docs = []
 
         wikilink_pattern = r"\[\[.*?\]\]"
@@ -1,24 +1,196 @@
-from typing import Optional, Tuple
+from functools import lru_cache
+import hashlib
+import json
+import logging
+import math
+import os
+from pathlib import Path
+import random
+import re
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
 
-from langchain_core.embeddings.embeddings import Embeddings
-from langchain_community.embeddings import InfinityEmbeddings
-import requests
+if TYPE_CHECKING:
+    from langchain_core.embeddings.embeddings import Embeddings
 
+embedding_log = logging.getLogger(__name__)
 
 INFINITY_API_URL = "http://127.0.0.1:7997"
+DEFAULT_EMBEDDING_BACKEND = "infinity"
+# Dimensions seen per backend and model, so a restart does not have to probe the server before starting
+DIMENSION_CACHE_PATH = Path(os.getenv("WORLD_GRAPH_DIMENSION_CACHE", "~/.cache/world_graph/embedding_dimensions.json")).expanduser()
 
-def load_embedding_model(model_name: Optional[str] = None, dimension: Optional[int] = None) -> Tuple[Embeddings, int]:
-    embeddings = InfinityEmbeddings(
-        model="mixedbread-ai/mxbai-embed-large-v1",
-        infinity_api_url=INFINITY_API_URL,
-    )
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+EmbeddingLoader = Callable[..., Tuple["Embeddings", int]]
+EMBEDDING_BACKENDS: Dict[str, EmbeddingLoader] = {}
+# Backends that ask the server for the dimension when none is given, their answers are cached in DIMENSION_CACHE_PATH
+_PROBING_BACKENDS = set()
+
+
+def register_embedding_backend(name: str, probes_dimension: bool = False) -> Callable[[EmbeddingLoader], EmbeddingLoader]:
+    """
+    Registers a loader under `name` for `load_embedding_model`.
+
+    A loader takes `model_name`, `dimension` and any backend specific keyword options and returns
+    the embeddings with their dimension.
+    """
+
+    def _register(loader: EmbeddingLoader) -> EmbeddingLoader:
+        EMBEDDING_BACKENDS[name] = loader
+        if probes_dimension:
+            _PROBING_BACKENDS.add(name)
+        return loader
+
+    return _register
+
+
+class DeterministicHashEmbeddings:
+    """
+    Offline stand-in for an embedding server, built from hash-seeded random projections.
+
+    Every token maps to a fixed gaussian vector seeded by its hash, a text embeds to the normalised
+    sum of its token vectors. Texts sharing words end up close together, so vector queries return
+    plausible neighbours while costing nothing but the projection. `latency` seconds are slept per
+    request and `max_batch_size` splits `embed_documents` into requests, mimicking a model server.
+    Implements the langchain Embeddings interface without importing langchain.
+    """
+
+    def __init__(self, dimension: int = 1024, seed: int = 0, latency: float = 0.0, max_batch_size: Optional[int] = None):
+        self.model = f"hash-{dimension}-{seed}"
+        self.dimension = dimension
+        self.seed = seed
+        self.latency = latency
+        self.max_batch_size = max_batch_size
+        self._token_vector = lru_cache(maxsize=65536)(self._project_token)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        batch_size = self.max_batch_size or max(len(texts), 1)
+        vectors = []
+        for start in range(0, len(texts), batch_size):
+            self._simulate_request()
+            vectors.extend(self._embed(text) for text in texts[start : start + batch_size])
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        self._simulate_request()
+        return self._embed(text)
+
+    def _simulate_request(self) -> None:
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def _embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.dimension
+        tokens = _TOKEN_PATTERN.findall(text.casefold()) or [text]
+        for token in tokens:
+            for i, v in enumerate(self._token_vector(token)):
+                vector[i] += v
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def _project_token(self, token: str) -> Tuple[float, ...]:
+        digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8, salt=self.seed.to_bytes(8, "little")).digest()
+        rng = random.Random(digest)
+        return tuple(rng.gauss(0.0, 1.0) for _ in range(self.dimension))
+
+
+@register_embedding_backend("infinity", probes_dimension=True)
+def load_infinity_embeddings(model_name: Optional[str] = None, dimension: Optional[int] = None, api_url: str = INFINITY_API_URL) -> Tuple["Embeddings", int]:
+    from langchain_community.embeddings import InfinityEmbeddings
+    import requests
+
+    model_name = model_name if model_name else "mixedbread-ai/mxbai-embed-large-v1"
+    embeddings = InfinityEmbeddings(model=model_name, infinity_api_url=api_url)
     if dimension is None:
         results = requests.post(
-            f"{INFINITY_API_URL}/embeddings",
+            f"{api_url}/embeddings",
             json={
-                "model": "mixedbread-ai/mxbai-embed-large-v1",
+                "model": model_name,
                 "input": ["A sentence to encode."],
             },
         )
         dimension = len(results.json()["data"][0]["embedding"])  # Expecting 512
     return embeddings, dimension
+
+
+@register_embedding_backend("infinity_async", probes_dimension=True)
+def load_async_infinity_embeddings(
+    model_name: Optional[str] = None, dimension: Optional[int] = None, api_url: str = INFINITY_API_URL, **client_options
+) -> Tuple["Embeddings", int]:
+    from world_graph.async_embedding import AsyncEmbeddingClient
+
+    model_name = model_name if model_name else "mixedbread-ai/mxbai-embed-large-v1"
+    embeddings = AsyncEmbeddingClient(model_name, api_url, **client_options)
+    return embeddings, dimension if dimension else embeddings.probe_dimension()
+
+
+@register_embedding_backend("hash")
+def load_hash_embeddings(
+    model_name: Optional[str] = None, dimension: Optional[int] = None, seed: int = 0, latency: float = 0.0, max_batch_size: Optional[int] = None
+) -> Tuple["Embeddings", int]:
+    dimension = dimension if dimension else 1024
+    return DeterministicHashEmbeddings(dimension, seed=seed, latency=latency, max_batch_size=max_batch_size), dimension
+
+
+def embedding_dimension(embeddings: "Embeddings") -> int:
+    # Declared by the stub backends, otherwise probed with one request
+    dimension = getattr(embeddings, "dimension", None)
+    return dimension if dimension else len(embeddings.embed_query("A sentence to encode."))
+
+
+def load_embedding_model(model_name: Optional[str] = None, dimension: Optional[int] = None, backend: Optional[str] = None, **options) -> Tuple["Embeddings", int]:
+    """
+    Loads embeddings from a registered backend.
+
+    Args:
+        model_name: Model served by the backend, the backend's default if None
+        dimension: Embedding dimension, else the one cached from a previous run, else probed from the backend
+        backend: Name passed to `register_embedding_backend`, "infinity" if None
+        **options: Backend specific options, e.g. api_url for infinity or latency for hash
+
+    Returns:
+        The embeddings and their dimension
+    """
+    backend = backend if backend else DEFAULT_EMBEDDING_BACKEND
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend {backend!r}, expected one of {sorted(EMBEDDING_BACKENDS)}")
+    if backend not in _PROBING_BACKENDS:
+        return EMBEDDING_BACKENDS[backend](model_name=model_name, dimension=dimension, **options)
+
+    dimension = dimension if dimension else cached_dimension(backend, model_name)
+    embeddings, dimension = EMBEDDING_BACKENDS[backend](model_name=model_name, dimension=dimension, **options)
+    remember_dimension(backend, model_name, dimension)
+    return embeddings, dimension
+
+
+_dimension_cache_lock = threading.Lock()
+
+
+def _dimension_cache_key(backend: str, model_name: Optional[str]) -> str:
+    return f"{backend}:{model_name if model_name else 'default'}"
+
+
+def cached_dimension(backend: str, model_name: Optional[str]) -> Optional[int]:
+    try:
+        return json.loads(DIMENSION_CACHE_PATH.read_text()).get(_dimension_cache_key(backend, model_name))
+    except (OSError, ValueError):
+        return None
+
+
+def remember_dimension(backend: str, model_name: Optional[str], dimension: int) -> None:
+    key = _dimension_cache_key(backend, model_name)
+    with _dimension_cache_lock:
+        try:
+            dimensions = json.loads(DIMENSION_CACHE_PATH.read_text())
+        except (OSError, ValueError):
+            dimensions = {}
+        if dimensions.get(key) == dimension:
+            return
+        dimensions[key] = dimension
+        try:
+            DIMENSION_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+            DIMENSION_CACHE_PATH.write_text(json.dumps(dimensions, indent=2))
+        except OSError as e:
+            embedding_log.debug(f"Could not cache embedding dimensions at {DIMENSION_CACHE_PATH}: {e}")
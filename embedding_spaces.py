@@ -0,0 +1,261 @@
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import logging
+import math
+import re
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from neomodel import db
+
+from world_graph.embedding import embedding_dimension
+from world_graph.metrics import METRICS
+from world_graph.neo_model_handler import EmbeddingTarget, NeoModelEventHandler
+from world_graph.neo_model_schema import LEGACY_EMBEDDING_PROPERTY, EmbeddingSpace
+from world_graph.parse_cache import embedder_signature
+from world_graph.read_obs_file import normalize_embedding_text
+from world_graph.scheduler import Priority, PriorityScheduler
+
+if TYPE_CHECKING:
+    from langchain_core.embeddings.embeddings import Embeddings
+
+spaces_log = logging.getLogger(__name__)
+
+EMBEDDED_LABELS = ("FilledNeoNote", "NeoSplit")
+BACKFILL_BATCH_SIZE = 64
+
+# Streamed notes keep no content, their vector is the normalized sum of their splits', see GraphDog.stream_obsidian_note
+_STREAMED_NOTES_CYPHER = """
+MATCH (n:FilledNeoNote)-[:CONTAIN_SPLIT]->(split:NeoSplit)
+WHERE n[$property] IS NULL AND n.content IS NULL
+WITH n, collect(split[$property]) AS vectors
+WHERE all(vector IN vectors WHERE vector IS NOT NULL)
+"""
+
+
+def embedding_property_name(model: str) -> str:
+    # e.g. "mixedbread-ai/mxbai-embed-large-v1" -> "content_embedding__mixedbread_ai_mxbai_embed_large_v1"
+    return f"{LEGACY_EMBEDDING_PROPERTY}__{re.sub(r'[^0-9a-zA-Z]+', '_', model).strip('_').lower()}"
+
+
+def vector_index_name(label: str, embedding_property: str) -> str:
+    return f"{label}_{embedding_property}"
+
+
+class EmbeddingSpaceManager:
+    """
+    Keeps one embedding property and pair of vector indexes per model, and moves between them online.
+
+    The active space is recorded in the graph as the EmbeddingSpace node in state "active". It is the
+    property new notes are written to and queries score. `migrate` re-embeds the stored content of
+    every split and note into a shadow space, without touching the files, then switches the active
+    space in one statement. A final pass picks up notes written under the old model in between,
+    once every event that started under it has committed.
+
+    Args:
+        handle: Event handler whose writes and queries follow the active space
+        scheduler: Runs the backfill as background work, yielding to queries and live edits
+        batch_size: Texts embedded and written per round trip while backfilling
+        max_texts_per_second: Throttle on the backfill, None for as fast as the scheduler allows
+    """
+
+    def __init__(
+        self,
+        handle: NeoModelEventHandler,
+        scheduler: Optional[PriorityScheduler] = None,
+        batch_size: int = BACKFILL_BATCH_SIZE,
+        max_texts_per_second: Optional[float] = None,
+    ):
+        self._handle = handle
+        self._scheduler = scheduler
+        self._batch_size = batch_size
+        self._max_texts_per_second = max_texts_per_second
+        self._migration: Optional[threading.Thread] = None
+
+    def spaces(self) -> List[EmbeddingSpace]:
+        return EmbeddingSpace.nodes.all()
+
+    def active_space(self) -> Optional[EmbeddingSpace]:
+        return EmbeddingSpace.nodes.first_or_none(state="active")
+
+    def ensure_space(self, embedder: "Embeddings", embedding_property: Optional[str] = None) -> EmbeddingSpace:
+        """
+        Registers `embedder`'s space, in shadow state unless it already exists, with its vector indexes.
+        """
+        model = embedder_signature(embedder)
+        space = EmbeddingSpace.nodes.first_or_none(model=model)
+        if space is None:
+            space = EmbeddingSpace(
+                model=model,
+                property=embedding_property if embedding_property else embedding_property_name(model),
+                dimension=embedding_dimension(embedder),
+                state="shadow",
+                updated_time=datetime.now(timezone.utc),
+            ).save()
+
+        for label in EMBEDDED_LABELS:
+            self._handle.create_vector_index(vector_index_name(label, space.property), node_type=label, embed_name=space.property, dimension=space.dimension)
+        return space
+
+    def adopt(self, embedder: "Embeddings") -> EmbeddingSpace:
+        """
+        First start with spaces: makes `embedder` the active space. A graph written before spaces
+        existed keeps its vectors, they are taken to come from `embedder`.
+        """
+        legacy_rows, _ = db.cypher_query(f"MATCH (n:FilledNeoNote) WHERE n.{LEGACY_EMBEDDING_PROPERTY} IS NOT NULL RETURN count(n) > 0")
+        has_legacy_vectors = bool(legacy_rows and legacy_rows[0][0])
+        space = self.ensure_space(embedder, LEGACY_EMBEDDING_PROPERTY if has_legacy_vectors else None)
+        self.activate(space)
+        self.apply(space, embedder)
+        return space
+
+    def activate(self, space: EmbeddingSpace) -> None:
+        # Retiring the previous space and promoting this one happen in the same statement
+        q = """
+        MATCH (space:EmbeddingSpace {model: $model})
+        OPTIONAL MATCH (previous:EmbeddingSpace {state: "active"}) WHERE previous <> space
+        SET previous.state = "retired", previous.updated_time = $now
+        SET space.state = "active", space.updated_time = $now"""
+        db.cypher_query(q, {"model": space.model, "now": datetime.now(timezone.utc).timestamp()})
+        spaces_log.info(f"Embedding space {space.model} ({space.property}) is now active.")
+
+    def apply(self, space: EmbeddingSpace, embedder: "Embeddings") -> EmbeddingTarget:
+        # Points this process's ingest and queries at `space`, the property and model swapped together
+        previous = self._handle.set_embedding_target(space.property, embedder)
+        self._handle.graghdog.set_embedder(embedder)
+        return previous
+
+    def remaining(self, space: EmbeddingSpace) -> Dict[str, int]:
+        counts = {}
+        for label in EMBEDDED_LABELS:
+            results, _ = db.cypher_query(f"MATCH (n:{label}) WHERE n[$property] IS NULL AND n.content IS NOT NULL RETURN count(n)", {"property": space.property})
+            counts[label] = results[0][0]
+        results, _ = db.cypher_query(f"{_STREAMED_NOTES_CYPHER} RETURN count(n)", {"property": space.property})
+        counts["FilledNeoNote"] += results[0][0]
+        return counts
+
+    def backfill(self, space: EmbeddingSpace, embedder: "Embeddings") -> int:
+        """
+        Embeds the stored content of every split and note still missing `space`'s property.
+
+        Streamed notes are done last, from their splits' vectors in `space`.
+
+        Returns:
+            int: Nodes written
+        """
+        written = 0
+        for label in EMBEDDED_LABELS:
+            read_q = f"""
+            MATCH (n:{label}) WHERE n[$property] IS NULL AND n.content IS NOT NULL
+            RETURN elementId(n), n.content
+            LIMIT $batch_size"""
+            write_q = f"""
+            UNWIND $rows AS row
+            MATCH (n:{label}) WHERE elementId(n) = row.id
+            SET n += row.props"""
+            while True:
+                batch_start = time.monotonic()
+                with self._background():
+                    rows, _ = db.cypher_query(read_q, {"property": space.property, "batch_size": self._batch_size})
+                    if not rows:
+                        break
+                    # Each distinct text embedded once, the model sent the first original among its duplicates
+                    representatives = {}
+                    for _, content in rows:
+                        representatives.setdefault(normalize_embedding_text(content), content)
+                    vectors = dict(zip(representatives, embedder.embed_documents(list(representatives.values()))))
+                    write_rows = [{"id": element_id, "props": {space.property: list(vectors[normalize_embedding_text(content)])}} for element_id, content in rows]
+                    db.cypher_query(write_q, {"rows": write_rows})
+
+                written += len(rows)
+                METRICS.inc("reembedded_nodes_total", len(rows), label=label)
+                self._throttle(len(rows), time.monotonic() - batch_start)
+
+        read_q = f"""
+        {_STREAMED_NOTES_CYPHER}
+        WITH n, vectors LIMIT $batch_size
+        RETURN elementId(n), reduce(total = head(vectors), vector IN tail(vectors) | [i IN range(0, size(vector) - 1) | total[i] + vector[i]])"""
+        write_q = """
+        UNWIND $rows AS row
+        MATCH (n:FilledNeoNote) WHERE elementId(n) = row.id
+        SET n += row.props"""
+        while True:
+            batch_start = time.monotonic()
+            with self._background():
+                rows, _ = db.cypher_query(read_q, {"property": space.property, "batch_size": self._batch_size})
+                if not rows:
+                    break
+                write_rows = []
+                for element_id, vector_sum in rows:
+                    norm = math.sqrt(sum(v * v for v in vector_sum)) or 1.0
+                    write_rows.append({"id": element_id, "props": {space.property: [v / norm for v in vector_sum]}})
+                db.cypher_query(write_q, {"rows": write_rows})
+
+            written += len(rows)
+            METRICS.inc("reembedded_nodes_total", len(rows), label="FilledNeoNote")
+            self._throttle(len(rows), time.monotonic() - batch_start)
+        return written
+
+    def migrate(self, embedder: "Embeddings") -> EmbeddingSpace:
+        """
+        Moves the graph to `embedder` online: shadow backfill, atomic switch, then a catch-up pass.
+        """
+        space = self.ensure_space(embedder)
+        spaces_log.info(f"Re-embedding into {space.property}, {self.remaining(space)} nodes to go.")
+        written = self.backfill(space, embedder)
+        self.activate(space)
+        previous = self.apply(space, embedder)
+        self._handle.wait_for_embedding_target(previous)
+        written += self.backfill(space, embedder)
+        spaces_log.info(f"Migration to {space.model} finished, {written} nodes re-embedded.")
+        return space
+
+    def start_migration(self, embedder: "Embeddings") -> threading.Thread:
+        if self._migration is not None and self._migration.is_alive():
+            raise RuntimeError("An embedding migration is already running.")
+        self._migration = threading.Thread(target=self.migrate, args=(embedder,), name="embedding-migration", daemon=True)
+        self._migration.start()
+        return self._migration
+
+    def drop_space(self, space: EmbeddingSpace) -> int:
+        """
+        Removes a retired space's vector indexes and properties, in batches.
+        """
+        if space.state == "active":
+            raise ValueError(f"Embedding space {space.model} is active, activate another before dropping it.")
+
+        for label in EMBEDDED_LABELS:
+            db.cypher_query(f"DROP INDEX {vector_index_name(label, space.property)} IF EXISTS")
+
+        removed = 0
+        for label in EMBEDDED_LABELS:
+            q = f"""
+            MATCH (n:{label}) WHERE n[$property] IS NOT NULL
+            WITH n LIMIT $batch_size
+            SET n += $cleared
+            RETURN count(n)"""
+            while True:
+                with self._background():
+                    results, _ = db.cypher_query(q, {"property": space.property, "batch_size": self._batch_size * 16, "cleared": {space.property: None}})
+                if results[0][0] == 0:
+                    break
+                removed += results[0][0]
+        space.delete()
+        return removed
+
+    @contextmanager
+    def _background(self):
+        if self._scheduler is None:
+            yield
+            return
+        with self._scheduler.priority(Priority.BACKGROUND):
+            self._scheduler.checkpoint()
+            yield
+
+    def _throttle(self, texts: int, elapsed: float) -> None:
+        if self._max_texts_per_second:
+            delay = texts / self._max_texts_per_second - elapsed
+            if delay > 0:
+                time.sleep(delay)
+
@@ -0,0 +1,402 @@
+import json
+import logging
+import os
+from pathlib import Path
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from neomodel import db
+from watchdog.events import FileSystemEvent, FileSystemEventHandler
+from watchdog.observers import Observer
+
+from world_graph.metrics import percentiles
+from world_graph.neo_model_handler import MockFileSystemEvent, NeoModelEventHandler
+
+replay_log = logging.getLogger(__name__)
+
+EVENT_LOG_VERSION = 1
+REPLAYED_EVENT_TYPES = ("created", "modified", "moved", "deleted")
+DEFAULT_MAX_SNAPSHOT_BYTES = 1024 * 1024
+
+# Each statement counts one kind of inconsistency left in the graph once a replay has settled
+_CONSISTENCY_CYPHER = {
+    "ownerless_splits": "MATCH (split:NeoSplit) WHERE NOT EXISTS { MATCH (split)<-[:CONTAIN_SPLIT]-(:FilledNeoNote) } RETURN count(split)",
+    "unreferenced_dangles": "MATCH (dangle:DanglingNeoNote) WHERE NOT EXISTS { MATCH (dangle)<-[:MENTIONED]-() } RETURN count(dangle)",
+    "duplicate_paths": "MATCH (n:FilledNeoNote) WITH n.path AS path, count(*) AS copies WHERE copies > 1 RETURN count(path)",
+}
+
+
+class RecordedEvent:
+    __slots__ = ("offset", "event_type", "src_path", "dest_path", "is_directory", "snapshot")
+
+    def __init__(
+        self, offset: float, event_type: str, src_path: str, dest_path: str = "", is_directory: bool = False, snapshot: Optional[str] = None
+    ):
+        self.offset = offset  # Seconds since recording started
+        self.event_type = event_type
+        self.src_path = src_path  # Relative to the vault
+        self.dest_path = dest_path
+        self.is_directory = is_directory
+        self.snapshot = snapshot  # File contents right after the event, when recorded
+
+    def to_dict(self) -> Dict[str, Any]:
+        event = {"t": round(self.offset, 6), "type": self.event_type, "src": self.src_path}
+        if self.dest_path:
+            event["dest"] = self.dest_path
+        if self.is_directory:
+            event["dir"] = True
+        if self.snapshot is not None:
+            event["snapshot"] = self.snapshot
+        return event
+
+    @classmethod
+    def from_dict(cls, event: Dict[str, Any]) -> "RecordedEvent":
+        return cls(event["t"], event["type"], event["src"], event.get("dest", ""), event.get("dir", False), event.get("snapshot"))
+
+
+class EventRecorder(FileSystemEventHandler):
+    """
+    Captures the watchdog event stream of a vault to a JSON lines log for `EventReplayer`.
+
+    The first line is a header, every following line one event with its offset in seconds from the
+    start of the recording. Paths are stored relative to the vault so a log can be replayed against
+    a copy. With `snapshot_files` the contents of a note are stored with each create, modify or move
+    of it, which lets a replay rebuild the same sequence of file states.
+
+    Args:
+        vault_path: Root of the watched vault
+        log_path: JSON lines file the events are appended to
+        snapshot_files: Store note contents alongside their events
+        max_snapshot_bytes: Notes larger than this are recorded without a snapshot
+        note_ext_type: Only snapshot files with this extension
+    """
+
+    def __init__(
+        self,
+        vault_path,
+        log_path,
+        snapshot_files: bool = False,
+        max_snapshot_bytes: int = DEFAULT_MAX_SNAPSHOT_BYTES,
+        note_ext_type: str = ".md",
+    ):
+        super().__init__()
+        self._vault_path = Path(vault_path)
+        self._log_path = Path(log_path)
+        self._snapshot_files = snapshot_files
+        self._max_snapshot_bytes = max_snapshot_bytes
+        self._note_ext_type = note_ext_type
+        self._lock = threading.Lock()
+        self._log_file = None
+        self._observer = None
+        self._start_time = 0.0
+        self._events_recorded = 0
+
+    @property
+    def events_recorded(self) -> int:
+        return self._events_recorded
+
+    def start(self) -> None:
+        self._log_file = open(self._log_path, "w", encoding="utf-8")
+        self._start_time = time.monotonic()
+        header = {"version": EVENT_LOG_VERSION, "vault": str(self._vault_path), "started": time.time(), "snapshots": self._snapshot_files}
+        self._log_file.write(json.dumps(header) + "\n")
+
+        self._observer = Observer()
+        self._observer.schedule(self, path=self._vault_path, recursive=True)
+        self._observer.start()
+        replay_log.info(f"Recording events of {self._vault_path} to {self._log_path}")
+
+    def stop(self) -> None:
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+        with self._lock:
+            if self._log_file is not None:
+                self._log_file.close()
+                self._log_file = None
+        replay_log.info(f"Recorded {self._events_recorded} events to {self._log_path}")
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+    def on_any_event(self, event: FileSystemEvent) -> None:
+        if event.event_type not in REPLAYED_EVENT_TYPES:
+            return
+
+        offset = time.monotonic() - self._start_time
+        dest_path = getattr(event, "dest_path", "")
+        recorded = RecordedEvent(
+            offset,
+            event.event_type,
+            self._relative(event.src_path),
+            self._relative(dest_path) if dest_path else "",
+            event.is_directory,
+            self._snapshot(dest_path if event.event_type == "moved" else event.src_path, event),
+        )
+        line = json.dumps(recorded.to_dict()) + "\n"
+        with self._lock:
+            if self._log_file is None:
+                return
+            self._log_file.write(line)
+            self._events_recorded += 1
+
+    def _relative(self, path: str) -> str:
+        path = os.fsdecode(path)
+        try:
+            return str(Path(path).relative_to(self._vault_path))
+        except ValueError:
+            return path
+
+    def _snapshot(self, path: str, event: FileSystemEvent) -> Optional[str]:
+        if not self._snapshot_files or event.is_directory or event.event_type == "deleted":
+            return None
+        path = Path(os.fsdecode(path))
+        if path.suffix != self._note_ext_type:
+            return None
+        try:
+            if path.stat().st_size > self._max_snapshot_bytes:
+                return None
+            return path.read_text(encoding="utf-8")
+        except (OSError, UnicodeDecodeError):
+            # Already gone or mid-write, the next event carries the settled state
+            return None
+
+
+def load_event_log(log_path) -> Tuple[Dict[str, Any], List[RecordedEvent]]:
+    with open(log_path, "r", encoding="utf-8") as log_file:
+        header = json.loads(log_file.readline())
+        if header.get("version") != EVENT_LOG_VERSION:
+            raise ValueError(f"Unsupported event log version {header.get('version')} in {log_path}")
+        events = [RecordedEvent.from_dict(json.loads(line)) for line in log_file if line.strip()]
+    return header, events
+
+
+def check_graph_consistency(vault_path, note_ext_type: str = ".md") -> Dict[str, Any]:
+    """
+    Compares the notes on disk with the FilledNeoNotes in the graph and counts orphans left behind.
+
+    Returns:
+        Dict[str, Any]: Paths missing from or stale in the graph, orphan counts, and whether all are empty
+    """
+    on_disk = {str(path) for path in Path(vault_path).rglob("*" + note_ext_type)}
+    results, _ = db.cypher_query("MATCH (n:FilledNeoNote) WHERE n.path STARTS WITH $prefix RETURN n.path", {"prefix": str(vault_path)})
+    in_graph = {row[0] for row in results}
+
+    report = {
+        "notes_on_disk": len(on_disk),
+        "notes_in_graph": len(in_graph),
+        "missing_from_graph": sorted(on_disk - in_graph),
+        "stale_in_graph": sorted(in_graph - on_disk),
+    }
+    for name, q in _CONSISTENCY_CYPHER.items():
+        results, _ = db.cypher_query(q)
+        report[name] = results[0][0]
+
+    report["consistent"] = not (report["missing_from_graph"] or report["stale_in_graph"]) and all(report[name] == 0 for name in _CONSISTENCY_CYPHER)
+    return report
+
+
+class EventReplayer:
+    """
+    Drives a recorded event stream through a `NeoModelEventHandler` and measures how it copes.
+
+    A scheduler thread releases events into a queue at their recorded offsets divided by `speed`,
+    or all at once when `speed` is None, and the calling thread handles them in order, as the
+    watchdog observer would. Directory events and files without `note_ext_type` are applied to the
+    vault but not dispatched, matching the "*.md" pattern handler of the app.
+
+    Args:
+        handle: Handler under test
+        vault_path: Vault the events are replayed against, paths in the log are relative to it
+        speed: Replay speed relative to the recording, None to replay as fast as possible
+        apply_filesystem: Recreate each event on disk before dispatching it, using the recorded snapshots
+        note_ext_type: Extension of the files the handler is given
+    """
+
+    def __init__(
+        self,
+        handle: NeoModelEventHandler,
+        vault_path,
+        speed: Optional[float] = 1.0,
+        apply_filesystem: bool = True,
+        note_ext_type: str = ".md",
+    ):
+        self._handle = handle
+        self._vault_path = Path(vault_path)
+        self._speed = speed
+        self._apply_filesystem = apply_filesystem
+        self._note_ext_type = note_ext_type
+        self._dispatch: Dict[str, Callable[[FileSystemEvent], Any]] = {
+            "created": handle.on_created(),
+            "modified": handle.on_modified(),
+            "moved": handle.on_moved(),
+            "deleted": handle.on_deleted(),
+        }
+
+    def replay(self, events: List[RecordedEvent], check_consistency: bool = True) -> Dict[str, Any]:
+        """
+        Returns:
+            Dict[str, Any]: Per event type service and end to end latency percentiles, errors,
+            queue depth over time and, if asked, the final `check_graph_consistency` report
+        """
+        pending: "queue.Queue[Optional[Tuple[float, RecordedEvent]]]" = queue.Queue()
+        depth_samples: List[Tuple[float, int]] = []
+        start_time = time.monotonic()
+
+        def _schedule():
+            for event in events:
+                due = start_time + event.offset / self._speed if self._speed else time.monotonic()
+                delay = due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                pending.put((due, event))
+                depth_samples.append((time.monotonic() - start_time, pending.qsize()))
+            pending.put(None)
+
+        scheduler = threading.Thread(target=_schedule, name="event-replay-scheduler", daemon=True)
+        scheduler.start()
+
+        service: Dict[str, List[float]] = {event_type: [] for event_type in REPLAYED_EVENT_TYPES}
+        end_to_end: Dict[str, List[float]] = {event_type: [] for event_type in REPLAYED_EVENT_TYPES}
+        errors: Dict[str, int] = {event_type: 0 for event_type in REPLAYED_EVENT_TYPES}
+        skipped = 0
+
+        for due, event in iter(pending.get, None):
+            depth_samples.append((time.monotonic() - start_time, pending.qsize()))
+            if self._apply_filesystem:
+                self._apply(event)
+            if not self._is_dispatched(event):
+                skipped += 1
+                continue
+
+            dispatch_start = time.monotonic()
+            try:
+                self._dispatch[event.event_type](self._mock_event(event))
+            except Exception as e:
+                errors[event.event_type] += 1
+                replay_log.exception(f"Replaying {event.event_type} of {event.src_path} failed: {e}")
+            finished = time.monotonic()
+            service[event.event_type].append(finished - dispatch_start)
+            end_to_end[event.event_type].append(finished - due)
+
+        scheduler.join()
+        depths = [depth for _, depth in depth_samples]
+        report = {
+            "events": len(events),
+            "dispatched": sum(len(samples) for samples in service.values()),
+            "skipped": skipped,
+            "errors": errors,
+            "seconds": time.monotonic() - start_time,
+            "speed": self._speed,
+            "service_seconds": {event_type: _summary(samples) for event_type, samples in service.items() if samples},
+            "end_to_end_seconds": {event_type: _summary(samples) for event_type, samples in end_to_end.items() if samples},
+            "queue_depth": {"max": max(depths, default=0), "mean": sum(depths) / len(depths) if depths else 0.0, "samples": _downsample(depth_samples)},
+        }
+        if check_consistency:
+            report["consistency"] = check_graph_consistency(self._vault_path, self._note_ext_type)
+        return report
+
+    def _is_dispatched(self, event: RecordedEvent) -> bool:
+        if event.is_directory:
+            return False
+        path = event.dest_path if event.event_type == "moved" else event.src_path
+        return Path(path).suffix == self._note_ext_type
+
+    def _mock_event(self, event: RecordedEvent) -> MockFileSystemEvent:
+        dest_path = self._vault_path / event.dest_path if event.dest_path else ""
+        return MockFileSystemEvent(self._vault_path / event.src_path, dest_path=dest_path, event_type=event.event_type)
+
+    def _apply(self, event: RecordedEvent) -> None:
+        src_path = self._vault_path / event.src_path
+        if event.event_type == "moved":
+            dest_path = self._vault_path / event.dest_path
+            if src_path.exists() and not dest_path.exists():
+                dest_path.parent.mkdir(parents=True, exist_ok=True)
+                src_path.rename(dest_path)
+            if event.snapshot is not None:
+                dest_path.write_text(event.snapshot, encoding="utf-8")
+        elif event.event_type == "deleted":
+            if event.is_directory:
+                return  # The files inside arrive as their own delete events
+            src_path.unlink(missing_ok=True)
+        elif event.is_directory:
+            src_path.mkdir(parents=True, exist_ok=True)
+        elif event.snapshot is not None:
+            src_path.parent.mkdir(parents=True, exist_ok=True)
+            src_path.write_text(event.snapshot, encoding="utf-8")
+
+
+def replay_event_log(handle: NeoModelEventHandler, log_path, vault_path=None, speed: Optional[float] = 1.0, **replayer_options) -> Dict[str, Any]:
+    header, events = load_event_log(log_path)
+    replayer = EventReplayer(handle, vault_path if vault_path else header["vault"], speed=speed, **replayer_options)
+    return replayer.replay(events)
+
+
+def _summary(samples: List[float]) -> Dict[str, float]:
+    summary = percentiles(samples)
+    summary["count"] = len(samples)
+    summary["max"] = max(samples)
+    return summary
+
+
+def _downsample(samples: List[Tuple[float, int]], max_points: int = 200) -> List[Tuple[float, int]]:
+    # Keeps the deepest sample of each stretch, so bursts survive the thinning
+    if len(samples) <= max_points:
+        return samples
+    stride = len(samples) / max_points
+    return [max(samples[int(i * stride) : int((i + 1) * stride)], key=lambda sample: sample[1]) for i in range(max_points)]
+
+
+def main(argv: Optional[List[str]] = None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Record a vault's file events, or replay a recording against the graph.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    record = commands.add_parser("record", help="Record until interrupted")
+    record.add_argument("vault", type=Path)
+    record.add_argument("log", type=Path)
+    record.add_argument("--snapshots", action="store_true", help="Store note contents with their events")
+    replay = commands.add_parser("replay", help="Replay a recording through NeoModelEventHandler")
+    replay.add_argument("log", type=Path)
+    replay.add_argument("--vault", type=Path, default=None, help="Vault to replay against, the recorded one by default")
+    replay.add_argument("--speed", type=float, default=1.0, help="Speed relative to the recording, 0 for as fast as possible")
+    replay.add_argument("--out", type=Path, default=None, help="Write the report here as JSON")
+    args = parser.parse_args(argv)
+
+    if args.command == "record":
+        with EventRecorder(args.vault, args.log, snapshot_files=args.snapshots):
+            try:
+                while True:
+                    time.sleep(1)
+            except KeyboardInterrupt:
+                pass
+        return
+
+    from world_graph.embedding import load_embedding_model
+    from world_graph.neo_model_handler import create_neo_model_connection
+    from world_graph.read_obs_file import GraphDog
+
+    header, events = load_event_log(args.log)
+    vault_path = args.vault if args.vault else Path(header["vault"])
+    create_neo_model_connection()
+    embedding, _ = load_embedding_model(backend=os.getenv("WORLD_GRAPH_EMBEDDING_BACKEND"))
+    handle = NeoModelEventHandler(GraphDog(vault_path, None, None, embedding))
+    report = EventReplayer(handle, vault_path, speed=args.speed if args.speed > 0 else None).replay(events)
+    db.close_connection()
+
+    rendered = json.dumps(report, indent=2)
+    if args.out:
+        args.out.write_text(rendered)
+    print(rendered)
+
+
+if __name__ == "__main__":
+    exit(main())
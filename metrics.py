@@ -0,0 +1,242 @@
+from bisect import bisect_left
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import math
+from pathlib import Path
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+metrics_log = logging.getLogger(__name__)
+
+# Upper bounds in seconds, roughly x2.5 apart from 100us to 1min
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = ((4 * 1024, "4KiB"), (64 * 1024, "64KiB"), (1024 * 1024, "1MiB"), (16 * 1024 * 1024, "16MiB"))
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+_NULL_STAGE = nullcontext()
+
+
+def percentiles(values: Iterable[float], quantiles: Tuple[float, ...] = (0.5, 0.9, 0.99)) -> Dict[str, float]:
+    # Exact nearest-rank percentiles of raw samples, for benchmarks and replays rather than live metrics
+    ordered = sorted(values)
+    if not ordered:
+        return {f"p{round(q * 100)}": 0.0 for q in quantiles}
+    return {f"p{round(q * 100)}": ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))] for q in quantiles}
+
+
+def size_bucket(size: int) -> str:
+    # Coarse size label, so per-note metrics stay low cardinality
+    for limit, label in SIZE_BUCKETS:
+        if size < limit:
+            return f"<{label}"
+    return f">={SIZE_BUCKETS[-1][1]}"
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        # Upper bound of the bucket holding the q-th observation
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def to_dict(self) -> Dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], self.counts)),
+        }
+
+
+class _StageTimer:
+    __slots__ = ("_registry", "_stage", "_labels", "_start")
+
+    def __init__(self, registry: "MetricsRegistry", stage: str, labels: Dict[str, str]):
+        self._registry = registry
+        self._stage = stage
+        self._labels = labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._start
+        self._registry.observe("stage_seconds", elapsed, stage=self._stage, **self._labels)
+        if exc_type is not None:
+            self._registry.inc("stage_errors_total", stage=self._stage, **self._labels)
+        return False
+
+
+class MetricsRegistry:
+    """
+    Process wide counters and latency histograms, labelled by pipeline stage.
+
+    While disabled every call returns straight away, `stage` hands back a shared null context,
+    so instrumentation can stay in hot paths. Metrics are read through `snapshot`, the
+    Prometheus style `render_text`, a local HTTP endpoint or a periodic JSON dump.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self._enabled = enabled
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self._enabled
+
+    def enable(self) -> None:
+        self._enabled = True
+
+    def disable(self) -> None:
+        self._enabled = False
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        if not self._enabled:
+            return
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        if not self._enabled:
+            return
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    def stage(self, stage: str, **labels):
+        """
+        Times the enclosed block into the `stage_seconds` histogram.
+
+        Args:
+            stage: Pipeline stage, e.g. read, frontmatter, chunk, embed, graph_write, link_resolve, query
+            **labels: Extra labels such as event_type or size (see `size_bucket`)
+        """
+        if not self._enabled:
+            return _NULL_STAGE
+        return _StageTimer(self, stage, labels)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "timestamp": time.time(),
+                "counters": {name: [{"labels": dict(key), "value": value} for key, value in series.items()] for name, series in self._counters.items()},
+                "histograms": {
+                    name: [{"labels": dict(key), **histogram.to_dict()} for key, histogram in series.items()] for name, series in self._histograms.items()
+                },
+            }
+
+    def render_text(self) -> str:
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# TYPE {name} counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{_render_labels(key)} {value}")
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f"{name}_bucket{_render_labels(key + (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{_render_labels(key)} {histogram.sum}")
+                    lines.append(f"{name}_count{_render_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def dump_json(self, path: Path) -> None:
+        path = Path(path)
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        tmp_path.write_text(json.dumps(self.snapshot(), indent=2))
+        tmp_path.replace(path)
+
+    def start_http_endpoint(self, port: int = 9464, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        registry = self
+
+        class _MetricsRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith("/metrics.json"):
+                    body, content_type = json.dumps(registry.snapshot()).encode("utf-8"), "application/json"
+                else:
+                    body, content_type = registry.render_text().encode("utf-8"), "text/plain; version=0.0.4"
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                metrics_log.debug(format % args)
+
+        server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+        threading.Thread(target=server.serve_forever, name="metrics-endpoint", daemon=True).start()
+        metrics_log.info(f"Serving metrics on http://{host}:{port}/metrics")
+        return server
+
+    def start_periodic_dump(self, path: Path, interval: float = 60.0) -> threading.Event:
+        """
+        Writes `snapshot` to `path` every `interval` seconds on a daemon thread, set the returned event to stop it.
+        """
+        stop = threading.Event()
+
+        def _dump_loop():
+            while not stop.wait(interval):
+                try:
+                    self.dump_json(path)
+                except OSError as e:
+                    metrics_log.warning(f"Failed to dump metrics to {path}: {e}")
+
+        threading.Thread(target=_dump_loop, name="metrics-dump", daemon=True).start()
+        return stop
+
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _render_labels(key: LabelKey) -> str:
+    if not key:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in key) + "}"
+
+
+METRICS = MetricsRegistry()
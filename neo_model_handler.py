@@ -1,21 +1,97 @@
+from contextlib import nullcontext
+from datetime import datetime
+import json
 import os
 from pathlib import Path
 import time
-from typing import Callable, List, Optional, Set
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
 import logging
 import socket
+import threading
 
 from neomodel import db, config
 from watchdog.events import FileSystemEvent
 
-from world_graph.neo_model_schema import FilledNeoNote, NeoNote, DanglingNeoNote
-from world_graph.objects import GraphEventHandler, Note, Split
+from world_graph.centrality import CentralityIndex, centrality_boost
+from world_graph.embedding import embedding_dimension
+from world_graph.metrics import METRICS, size_bucket
+from world_graph.neo_model_schema import LEGACY_EMBEDDING_PROPERTY, FilledNeoNote, NeoNote, DanglingNeoNote
+from world_graph.query_accounting import QueryAccountant
+from world_graph.objects import AnchorIndex, GraphEventHandler, Note, ObsidianLink, Split, normalize_name
 from world_graph.read_obs_file import GraphDog
+from world_graph.scheduler import Priority
+from world_graph.unit_of_work import UnitOfWork, after_commit, after_transaction, in_transaction
 
 log_file_path = Path("")
 logging.getLogger("neo4j").setLevel(logging.WARNING)
 
 RUN_PRUNE_ON_OUT_OF_SYNC = True
+PRUNE_BATCH_SIZE = 1000
+
+# Each statement deletes up to $batch_size orphans of one kind and returns how many it removed
+_PRUNE_ORPHAN_CYPHER = {
+    "broken_next_splits": """
+        MATCH (a:NeoSplit)-[next:NEXT_SPLIT]->(b:NeoSplit)
+        WHERE NOT EXISTS { MATCH (a)<-[:CONTAIN_SPLIT]-(:FilledNeoNote)-[:CONTAIN_SPLIT]->(b) }
+        WITH next LIMIT $batch_size
+        DELETE next
+        RETURN count(*)""",
+    "ownerless_splits": """
+        MATCH (split:NeoSplit) WHERE NOT EXISTS { MATCH (split)<-[:CONTAIN_SPLIT]-(:FilledNeoNote) }
+        WITH split LIMIT $batch_size
+        DETACH DELETE split
+        RETURN count(*)""",
+    "unreferenced_dangles": """
+        MATCH (dangle:DanglingNeoNote) WHERE NOT EXISTS { MATCH (dangle)<-[:MENTIONED]-() }
+        WITH dangle LIMIT $batch_size
+        DETACH DELETE dangle
+        RETURN count(*)""",
+    "unused_aliases": """
+        MATCH (alias:Alias) WHERE NOT EXISTS { MATCH (alias)<-[:HAS_ALIAS]-() }
+        WITH alias LIMIT $batch_size
+        DETACH DELETE alias
+        RETURN count(*)""",
+    "unused_tags": """
+        MATCH (tag:Tag) WHERE NOT EXISTS { MATCH (tag)<-[:TAGGED|CHILD_OF]-() }
+        WITH tag LIMIT $batch_size
+        DETACH DELETE tag
+        RETURN count(*)""",
+    "empty_folders": """
+        MATCH (folder:Folder) WHERE NOT EXISTS { MATCH (folder)<-[:IN_FOLDER|CHILD_OF]-() }
+        WITH folder LIMIT $batch_size
+        DETACH DELETE folder
+        RETURN count(*)""",
+}
+
+# Tail shared by the note removal statements, expects `n` (the FilledNeoNote) and `dangle` in scope.
+# Deletes the note with its splits, then any dangle or alias only the note was keeping alive.
+# Returns the name keys the name resolver may hold for the note, its aliases and its dangles.
+_REMOVE_NOTE_CYPHER = """
+        OPTIONAL MATCH (n)-[:MENTIONED]->(target:DanglingNeoNote)
+        WITH n, dangle, collect(DISTINCT target) AS targets
+        OPTIONAL MATCH (n)-[:HAS_ALIAS]->(alias:Alias)
+        WITH n, dangle, targets, collect(alias) AS aliases
+        WITH n, dangle, targets, aliases, [n.name_key] + [alias IN aliases | alias.key] + [target IN targets | target.name_key] AS name_keys
+        CALL {
+            WITH n
+            MATCH (n)-[:CONTAIN_SPLIT]->(split:NeoSplit)
+            DETACH DELETE split
+        }
+        DETACH DELETE n
+        WITH dangle, targets, aliases, name_keys
+        CALL {
+            WITH targets
+            UNWIND targets AS target
+            WITH target WHERE NOT EXISTS { MATCH (target)<-[:MENTIONED]-() }
+            DETACH DELETE target
+        }
+        CALL {
+            WITH aliases
+            UNWIND aliases AS alias
+            WITH alias WHERE NOT EXISTS { MATCH ()-[:HAS_ALIAS]->(alias) }
+            DELETE alias
+        }
+        RETURN dangle, name_keys"""
 
 
 def create_neo_model_connection(clear_on_connect: bool = False):
@@ -39,10 +115,168 @@ def clear_database():
     db.cypher_query(cypher)
 
 
+class NameResolver:
+    """
+    Resolves link text to the notes it could mean, by normalized name or alias.
+
+    Lookups go through the indexed NeoNote.name_key and the unique Alias.key, and the nodes found
+    are cached in-process and trusted until invalidated. The event handler keeps the cache in
+    sync: it invalidates the keys of every note, alias and dangle it deletes, and what it caches
+    or remembers inside a transaction is only applied once that transaction commits.
+    """
+
+    def __init__(self):
+        self._nodes_by_key: Dict[str, List[NeoNote]] = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, name: str) -> List[NeoNote]:
+        key = normalize_name(name)
+        with self._lock:
+            cached_nodes = self._nodes_by_key.get(key)
+        if cached_nodes is not None:
+            return list(cached_nodes)
+
+        q = """
+        MATCH (n:NeoNote {name_key: $key}) RETURN n
+        UNION
+        MATCH (:Alias {key: $key})<-[:HAS_ALIAS]-(n:FilledNeoNote) RETURN n"""
+        results, _ = db.cypher_query(q, {"key": key}, resolve_objects=True)
+        nodes = [row[0] for row in results]
+        after_commit(self._cache, key, nodes)
+        return nodes
+
+    def remember(self, node: NeoNote, aliases: Iterable[str] = ()) -> None:
+        after_commit(self._add, node, {normalize_name(node.name), *(normalize_name(alias) for alias in aliases)})
+
+    def invalidate(self, *keys: str) -> None:
+        # Dropped right away, so the rest of the transaction looks the keys up again, and once more on commit
+        self._drop(keys)
+        after_commit(self._drop, keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._nodes_by_key.clear()
+
+    def _cache(self, key: str, nodes: List[NeoNote]) -> None:
+        with self._lock:
+            self._nodes_by_key[key] = nodes
+
+    def _add(self, node: NeoNote, keys: Set[str]) -> None:
+        # Only keys already cached are extended, anything else is looked up on first use
+        with self._lock:
+            for key in keys:
+                cached_nodes = self._nodes_by_key.get(key)
+                if cached_nodes is not None and all(cached.element_id != node.element_id for cached in cached_nodes):
+                    cached_nodes.append(node)
+
+    def _drop(self, keys: Iterable[str]) -> None:
+        with self._lock:
+            for key in keys:
+                self._nodes_by_key.pop(key, None)
+
+
+class EmbeddingTarget:
+    """
+    The property new vectors are written to together with the model producing them.
+
+    Swapped as a whole on a model switch, and read once per event, so an event never embeds with
+    one model and writes into another model's property.
+    """
+
+    __slots__ = ("_embedding_property", "_embedder")
+
+    def __init__(self, embedding_property: str, embedder=None):
+        self._embedding_property = embedding_property
+        self._embedder = embedder
+
+    @property
+    def embedding_property(self) -> str:
+        return self._embedding_property
+
+    @property
+    def embedder(self):
+        return self._embedder
+
+
 class NeoModelEventHandler(GraphEventHandler):
-    def __init__(self, graphdog: GraphDog):
+    def __init__(
+        self,
+        graphdog: GraphDog,
+        query_accountant: Optional[QueryAccountant] = None,
+        unit_of_work: Optional[UnitOfWork] = None,
+        centrality: Optional[CentralityIndex] = None,
+    ):
         self._graphdog = graphdog
         self._file_path_debouncing = {}
+        self._local = threading.local()
+        self._name_resolver = NameResolver()
+        self._query_accountant = query_accountant
+        # Each event commits once, nested handler calls (on_modified, on_moved) join the outer event's transaction
+        self._unit_of_work = unit_of_work if unit_of_work else UnitOfWork()
+        # Updated from each event's link changes, within the event's transaction
+        self._centrality = centrality if centrality else CentralityIndex()
+        self._embedding_target = EmbeddingTarget(LEGACY_EMBEDDING_PROPERTY, graphdog.embedder)
+        # Events still writing under each target, see wait_for_embedding_target
+        self._target_events: Dict[EmbeddingTarget, int] = {}
+        self._target_condition = threading.Condition()
+        # At most one prune runs at a time, requests made while it runs are served by one more pass
+        self._prune_lock = threading.Lock()
+        self._prune_thread: Optional[threading.Thread] = None
+        self._prune_again = False
+
+    def instrumented(self, event_type: str, function: Callable, prepare: Optional[Callable] = None) -> Callable:
+        """
+        Turns `function(event, prepared)` into an event callback counted, accounted and committed as one event.
+
+        `prepare(event, target)` reads, parses and embeds the event's note before the transaction is
+        opened, so only the graph writes hold it and a retried transaction does not embed again.
+        The callback's own `prepare(event)` runs that step ahead of time, e.g. EventBatcher does so
+        before opening a batch's transaction, and the result is passed back as `prepared`. A result
+        prepared under an embedding target that has since been replaced is prepared again. Its
+        `commits_alone(event)` tells which events are streamed and commit window by window.
+        """
+
+        def _prepare(event: FileSystemEvent) -> Optional[Tuple[EmbeddingTarget, Any]]:
+            if prepare is None or self.is_streamed(event_type, event):
+                return None
+            target = self.embedding_target
+            return target, prepare(event, target)
+
+        def _dispatch(event: FileSystemEvent, prepared: Optional[Tuple[EmbeddingTarget, Any]]):
+            if self.is_streamed(event_type, event):
+                # Commits window by window itself, see create_streamed_note
+                return function(event, None)
+            if prepared is None or prepared[0] is not self.embedding_target:
+                prepared = _prepare(event)
+            return self._unit_of_work.run(function, event, prepared[1] if prepared else None)
+
+        def _return(event: FileSystemEvent, prepared: Optional[Tuple[EmbeddingTarget, Any]] = None):
+            # on_modified and on_moved call the other handlers, only the outermost call is one event
+            if getattr(self._local, "event_type", None) is not None:
+                return _dispatch(event, prepared)
+
+            METRICS.inc("events_total", event_type=event_type)
+            accounting = self._query_accountant.event(event_type, event.src_path) if self._query_accountant else nullcontext()
+            self._local.event_type = event_type
+            self._local.embedding_target = self.hold_embedding_target()
+            try:
+                with accounting, METRICS.stage("event", event_type=event_type):
+                    return _dispatch(event, prepared)
+            finally:
+                # Released once the writes are final, after the batch commits when the event joined one
+                after_transaction(self.release_embedding_target, self._local.embedding_target)
+                self._local.event_type = None
+                self._local.embedding_target = None
+
+        _return.prepare = _prepare
+        _return.commits_alone = lambda event: self.is_streamed(event_type, event)
+        return _return
+
+    def is_streamed(self, event_type: str, event: FileSystemEvent) -> bool:
+        # Events ingesting a note too large to write in one transaction
+        if event_type == "moved":
+            return self.graghdog.should_stream(Path(event.dest_path))
+        return event_type in ("created", "modified") and self.graghdog.should_stream(Path(event.src_path))
 
     def wrap_debouncing(self, function: Callable, threshold: float = 0.01) -> Callable:
         def _return(event: FileSystemEvent):
@@ -69,12 +303,60 @@ class NeoModelEventHandler(GraphEventHandler):
     def graghdog(self) -> GraphDog:
         return self._graphdog
 
+    @property
+    def name_resolver(self) -> NameResolver:
+        return self._name_resolver
+
+    @property
+    def unit_of_work(self) -> UnitOfWork:
+        return self._unit_of_work
+
+    @property
+    def centrality(self) -> CentralityIndex:
+        return self._centrality
+
+    @property
+    def embedding_target(self) -> EmbeddingTarget:
+        # The event's target while one is handled on this thread, otherwise the current one
+        target = getattr(self._local, "embedding_target", None)
+        return target if target is not None else self._embedding_target
+
+    @property
+    def embedding_property(self) -> str:
+        # Where new notes' vectors are written and what queries score, see EmbeddingSpaceManager
+        return self.embedding_target.embedding_property
+
+    def set_embedding_target(self, embedding_property: str, embedder) -> EmbeddingTarget:
+        # Events starting from now on embed with `embedder` into `embedding_property`, returns the previous target
+        with self._target_condition:
+            previous, self._embedding_target = self._embedding_target, EmbeddingTarget(embedding_property, embedder)
+        return previous
+
+    def hold_embedding_target(self) -> EmbeddingTarget:
+        with self._target_condition:
+            target = self._embedding_target
+            self._target_events[target] = self._target_events.get(target, 0) + 1
+        return target
+
+    def release_embedding_target(self, target: EmbeddingTarget) -> None:
+        with self._target_condition:
+            self._target_events[target] -= 1
+            if self._target_events[target] == 0:
+                del self._target_events[target]
+                self._target_condition.notify_all()
+
+    def wait_for_embedding_target(self, target: EmbeddingTarget) -> None:
+        # Returns once no event that started under `target` is still running or uncommitted
+        with self._target_condition:
+            while target in self._target_events:
+                self._target_condition.wait()
+
     def move_link(self, source_note: NeoNote, old_note: NeoNote, to_note: NeoNote) -> None:
         source_note.mentions.disconnect(old_note)
         source_note.mentions.connect(to_note)
 
     def promote_dangle_to_note(self, dangle: DanglingNeoNote, note: Note) -> FilledNeoNote:
-        promoted_note = FilledNeoNote.from_note(note)
+        promoted_note = FilledNeoNote.from_note(note, self.embedding_property)
         for source_node in dangle.mentions.all():
             source_node.mentions.reconnect(dangle, promoted_note)
 
@@ -83,106 +365,371 @@ class NeoModelEventHandler(GraphEventHandler):
         return promoted_note
 
     def has_incoming_link(self, note_with_path: NeoNote) -> bool:
-        for source_or_target in set(note_with_path.mentions.all()):
-            for rel in note_with_path.mentions.all_relationships(source_or_target):
-                if rel.end_node() == note_with_path and rel.start_node() != note_with_path:  # Is the end the target, but not a self link?
-                    assert not isinstance(rel.start_node(), DanglingNeoNote)  # Validate that Only FilledNeoNotes ever start links
-                    return True
-        return False
-
-    def demote_note_to_dangle(self, dangle: DanglingNeoNote, neonote: FilledNeoNote) -> Optional[DanglingNeoNote]:
-        rel_nodes = set(neonote.mentions.all())
-        for source_or_target in rel_nodes:
-            for rel in neonote.mentions.all_relationships(source_or_target):
-                if rel.end_node() == neonote:
-                    assert not isinstance(rel.start_node(), DanglingNeoNote)  # Validate that Only FilledNeoNotes ever start links
-                    source_or_target.mentions.reconnect(neonote, dangle)
-
-        neonote.remove()
-
-        self.validate_unsupported_nodes(rel_nodes)
+        # Is anything other than the note itself pointing at it?
+        q = """
+        MATCH (n:NeoNote) WHERE elementId(n) = $element_id
+        RETURN EXISTS { MATCH (source:NeoNote)-[:MENTIONED]->(n) WHERE source <> n }"""
+        results, _ = db.cypher_query(q, {"element_id": note_with_path.element_id})
+        return bool(results and results[0][0])
+
+    def demote_note_to_dangle(self, neonote: FilledNeoNote) -> DanglingNeoNote:
+        # Creates the dangle, moves every incoming link onto it and removes the note, all in one statement
+        q = f"""
+        MATCH (n:FilledNeoNote) WHERE elementId(n) = $element_id
+        MERGE (dangle:DanglingNeoNote {{name: $name}})
+        ON CREATE SET dangle:NeoNote, dangle.name_key = $name_key
+        WITH n, dangle
+        CALL {{
+            WITH n, dangle
+            MATCH (source:NeoNote)-[incoming:MENTIONED]->(n) WHERE source <> n
+            CREATE (source)-[moved:MENTIONED]->(dangle)
+            SET moved = properties(incoming)
+            DELETE incoming
+        }}
+        {_REMOVE_NOTE_CYPHER}"""
+        q_param = {"element_id": neonote.element_id, "name": neonote.name, "name_key": normalize_name(neonote.name)}
+        results, _ = db.cypher_query(q, q_param, resolve_objects=True)
+        dangle, name_keys = results[0]
+        self.name_resolver.invalidate(*name_keys)
+        self.name_resolver.remember(dangle)
         return dangle
 
-    def validate_unsupported_nodes(self, nodes_to_validate: Set[NeoNote]) -> None:
-        for target_node in nodes_to_validate:
-            # If the "targets" are Nodes which require support, validate they have that support, otherwise remove the node
-            if isinstance(target_node, DanglingNeoNote) and len(target_node.mentions.all()) == 0:
-                # This is the payoff, traverse the bi directional relationship, and if there are no relationships remove the node.
-                target_node.delete()
+    def remove_note(self, neonote: FilledNeoNote) -> None:
+        q = f"""
+        MATCH (n:FilledNeoNote) WHERE elementId(n) = $element_id
+        WITH n, null AS dangle
+        {_REMOVE_NOTE_CYPHER}"""
+        results, _ = db.cypher_query(q, {"element_id": neonote.element_id})
+        if results:
+            self.name_resolver.invalidate(*results[0][1])
 
     def create_dangle(self, name: str) -> DanglingNeoNote:
-        return DanglingNeoNote(name=name).save()
+        dangle = DanglingNeoNote(name=name).save()
+        self.name_resolver.remember(dangle)
+        return dangle
 
-    def on_created(self) -> Callable[[FileSystemEvent], NeoNote]:
-        def _on_created(event: FileSystemEvent) -> NeoNote:
-            event_path = Path(event.src_path)
+    def folder_of(self, path: Path) -> Optional[str]:
+        # Vault relative folder of a note, "" at the vault root and None outside the vault
+        try:
+            relative_path = Path(path).relative_to(self.graghdog.path_to_notes)
+        except ValueError:
+            return None
+        return "" if relative_path.parent == Path(".") else relative_path.parent.as_posix()
+
+    def queue_chunk_link(self, chunk_links: List[Dict], split: Split, target: FilledNeoNote, anchors: AnchorIndex, link: ObsidianLink) -> None:
+        target_count = anchors.resolve(link)
+        if target_count is None:
+            logging.debug(f"No header or block in {target.name} matches the link {link}.")
+            return
+        chunk_links.append({"source_count": split.count, "target_id": target.element_id, "target_count": target_count})
+
+    def connect_chunk_links(self, neonote: FilledNeoNote, chunk_links: List[Dict]) -> None:
+        # All of a note's header and block links are written in one statement, each side found from its owning note
+        if not chunk_links:
+            return
+        q = """
+        UNWIND $chunk_links AS chunk_link
+        MATCH (source:FilledNeoNote)-[:CONTAIN_SPLIT]->(from_split:NeoSplit {count: chunk_link.source_count})
+        WHERE elementId(source) = $source_id
+        MATCH (target:FilledNeoNote)-[:CONTAIN_SPLIT]->(to_split:NeoSplit {count: chunk_link.target_count})
+        WHERE elementId(target) = chunk_link.target_id
+        MERGE (from_split)-[:MENTIONED_SPLIT]->(to_split)"""
+        db.cypher_query(q, {"source_id": neonote.element_id, "chunk_links": chunk_links})
+
+    def record_chunk_links(self, neonote: FilledNeoNote, anchored_links: Dict[str, List]) -> None:
+        # Stores each target's header and block links on the note's MENTIONED edges to it, resolved or not
+        if not anchored_links:
+            return
+        q = """
+        UNWIND $targets AS row
+        MATCH (source:FilledNeoNote)-[link:MENTIONED]->(target:NeoNote)
+        WHERE elementId(source) = $source_id AND elementId(target) = row.target_id
+        SET link.chunk_links = row.chunk_links"""
+        targets = [{"target_id": target_id, "chunk_links": json.dumps(links)} for target_id, links in anchored_links.items()]
+        db.cypher_query(q, {"source_id": neonote.element_id, "targets": targets})
+
+    def resolve_incoming_chunk_links(self, neonote: FilledNeoNote, anchors: AnchorIndex) -> None:
+        """
+        Links other notes' splits to the splits of a (re)created note, from the chunk links kept on their MENTIONED edges.
+
+        The note's splits were removed with it, and its incoming MENTIONED edges survived on its dangle,
+        so the header and block links pointing into it are resolved again against its new anchors.
+        """
+        q = """
+        MATCH (target:FilledNeoNote) WHERE elementId(target) = $element_id
+        MATCH (source:FilledNeoNote)-[link:MENTIONED]->(target)
+        WHERE source <> target AND link.chunk_links IS NOT NULL
+        RETURN DISTINCT elementId(source), link.chunk_links"""
+        results, _ = db.cypher_query(q, {"element_id": neonote.element_id})
+        chunk_links = []
+        for source_id, links in results:
+            for source_count, headers, block_hash in json.loads(links):
+                target_count = anchors.resolve(ObsidianLink("Wikilink", Path(neonote.name), None, headers, block_hash))
+                if target_count is not None:
+                    chunk_links.append({"source_id": source_id, "source_count": source_count, "target_count": target_count})
+        if not chunk_links:
+            return
+
+        q = """
+        MATCH (target:FilledNeoNote) WHERE elementId(target) = $element_id
+        UNWIND $chunk_links AS chunk_link
+        MATCH (source:FilledNeoNote)-[:CONTAIN_SPLIT]->(from_split:NeoSplit {count: chunk_link.source_count})
+        WHERE elementId(source) = chunk_link.source_id
+        MATCH (target)-[:CONTAIN_SPLIT]->(to_split:NeoSplit {count: chunk_link.target_count})
+        MERGE (from_split)-[:MENTIONED_SPLIT]->(to_split)"""
+        db.cypher_query(q, {"element_id": neonote.element_id, "chunk_links": chunk_links})
+
+    def resolve_links(self, neonote: FilledNeoNote, note: Note) -> None:
+        chunk_links = []
+        anchored_links: Dict[str, List] = {}  # Target element id to the note's chunk links to it
+        for split in note.splits:
+            for link in split.outgoing_links:
+                if link.is_self_link():
+                    self.queue_chunk_link(chunk_links, split, neonote, note.anchors, link)
+                    continue
 
-            note_with_path = FilledNeoNote.nodes.get_or_none(path=str(event_path))
-            if note_with_path:
-                logging.critical("Error, Received a Create Event on already existing NeoNote. Deleting prior Note.")
-                self.on_deleted()(MockFileSystemEvent(Path(event.src_path)))
-                # Update Event
-
-            ghost_note_with_name = DanglingNeoNote.nodes.get_or_none(name=event_path.stem)
-            if ghost_note_with_name:
-                note = self.graghdog.serialize_obsidian_note(event_path)
-                neonote = self.promote_dangle_to_note(ghost_note_with_name, note)
-            else:
-                note = self.graghdog.serialize_obsidian_note(event_path)
-                neonote = FilledNeoNote.from_note(note)
-
-            for link in note.outgoing_links:
                 linked_note_path = link.target
                 root = self.graghdog.path_to_notes
                 specific_path = root / linked_note_path
 
+                target = None
                 pulled_on_path = FilledNeoNote.nodes.first_or_none(path=specific_path)
                 if pulled_on_path:
+                    target = pulled_on_path
                     neonote.mentions.connect(pulled_on_path)
                     if link.is_link_to_chunk():
-                        pass
+                        self.queue_chunk_link(chunk_links, split, pulled_on_path, AnchorIndex.from_dict(pulled_on_path.anchor_index), link)
                 else:
-                    pulled_on_name = NeoNote.nodes.filter(name__iexact=linked_note_path.stem)
+                    pulled_on_name = self.name_resolver.resolve(linked_note_path.stem)
                     if len(pulled_on_name) == 0:
-                        dangle = self.create_dangle(linked_note_path.stem)
-                        neonote.mentions.connect(dangle)
+                        target = self.create_dangle(linked_note_path.stem)
+                        neonote.mentions.connect(target)
                     elif len(pulled_on_name) > 1:
                         log_message = f"Failed to link of note path, then note name from {note.name} to the name: {linked_note_path.stem} \n"
                         log_message += f"There were {len(pulled_on_name)} candidates found. Please update this link. Check log file at {log_file_path} for more details."
                         logging.critical(log_message)
                         logging.debug(f"{str(pulled_on_name)=}")  # Change to go to Log File
                     else:
-                        neonote.mentions.connect(pulled_on_name[0])
-                        if link.is_link_to_chunk():
-                            pass
+                        target = pulled_on_name[0]
+                        neonote.mentions.connect(target)
+                        if link.is_link_to_chunk() and isinstance(target, FilledNeoNote):
+                            target_anchors = AnchorIndex.from_dict(target.anchor_index)
+                            self.queue_chunk_link(chunk_links, split, target, target_anchors, link)
+
+                if target is not None and link.is_link_to_chunk():
+                    anchored_links.setdefault(target.element_id, []).append([split.count, link.headers, link.block_hash])
+
+        self.connect_chunk_links(neonote, chunk_links)
+        self.record_chunk_links(neonote, anchored_links)
+
+    def create_note_node(self, note: Note) -> FilledNeoNote:
+        # Takes over the dangle of the same name, if the note was linked to before it existed
+        ghost_note_with_name = DanglingNeoNote.nodes.first_or_none(name_key=normalize_name(note.name))
+        if ghost_note_with_name:
+            neonote = self.promote_dangle_to_note(ghost_note_with_name, note)
+            self.name_resolver.invalidate(normalize_name(ghost_note_with_name.name))
+        else:
+            neonote = FilledNeoNote.from_note(note, self.embedding_property)
+        self.name_resolver.remember(neonote, note.aliases)
+        return neonote
+
+    def create_streamed_note(self, event_path: Path) -> FilledNeoNote:
+        """
+        Ingests a note past the streaming threshold one window at a time, see GraphDog.stream_obsidian_note.
+
+        The note is created from its first window's frontmatter, then each window's splits are
+        written in a transaction of their own before the next window is read. The note's text is
+        only held by its splits. Only the splits' links are kept in between. The links, tags,
+        folder, anchors and embedding are written last, once the whole note was read. When a window
+        fails the partial note is deleted, the next event on the path ingests it again. Called
+        inside a transaction, every window joins it and the caller's rollback removes the note.
+        """
+        joined = in_transaction()
+        neonote, note = None, None
+        link_splits = []  # Each linking split's count and links, without its text
+        try:
+            with METRICS.stage("graph_write", size=size_bucket(event_path.stat().st_size)):
+                for note, _, splits in self.graghdog.stream_obsidian_note(event_path, self.embedding_target.embedder):
+                    if neonote is None:
+                        neonote = self._unit_of_work.run(self.start_streamed_note, note, splits)
+                    else:
+                        self._unit_of_work.run(neonote.append_window, splits, self.embedding_property)
+                    for split in splits:
+                        if split.outgoing_links:
+                            link_split = Split(split.count, "")
+                            for link in split.outgoing_links:
+                                link_split.add_outgoing_note_link(link)
+                            link_splits.append(link_split)
+
+            linked_note = Note(event_path, splits=link_splits, content="")
+            linked_note.set_anchors(note.anchors)
+            with METRICS.stage("link_resolve"):
+                self._unit_of_work.run(self.finish_streamed_note, neonote, note, linked_note)
+        except Exception:
+            if neonote is not None and not joined:
+                logging.error(f"Streaming {event_path.stem} failed, removing the partially written note.")
+                self._unit_of_work.run(self.delete_note, neonote)
+            raise
+
+        logging.info(f"Streamed create operation on {event_path.stem} completed.")
+        return neonote
+
+    def start_streamed_note(self, note: Note, splits: List[Split]) -> FilledNeoNote:
+        neonote = self.create_note_node(note)
+        neonote.append_window(splits, self.embedding_property)
+        return neonote
+
+    def finish_streamed_note(self, neonote: FilledNeoNote, note: Note, linked_note: Note) -> None:
+        # The streamed note holds the tags and anchors but no splits, its splits' tags were written with their window
+        neonote.finish_stream(note, self.embedding_property)
+        neonote.set_tags_and_folder(note, self.folder_of(note.path), self.graghdog.vault_name)
+        self.resolve_links(neonote, linked_note)
+        self.resolve_incoming_chunk_links(neonote, note.anchors)
+        self.centrality.note_linked(neonote.element_id)
+
+    def serialize_note(self, path: Path, target: EmbeddingTarget) -> Note:
+        return self.graghdog.serialize_obsidian_note(path, target.embedder)
+
+    def create_note(self, event_path: Path, note: Optional[Note] = None) -> NeoNote:
+        # `note` is the file already parsed and embedded outside the transaction, parsed here when None
+        note_with_path = FilledNeoNote.nodes.get_or_none(path=str(event_path))
+        if note_with_path:
+            logging.critical("Error, Received a Create Event on already existing NeoNote. Deleting prior Note.")
+            self.on_deleted()(MockFileSystemEvent(event_path))
+            # Update Event
+
+        if self.graghdog.should_stream(event_path):
+            return self.create_streamed_note(event_path)
+
+        note = note if note is not None else self.serialize_note(event_path, self.embedding_target)
+        with METRICS.stage("graph_write", size=size_bucket(len(note.content))):
+            neonote = self.create_note_node(note)
+            neonote.set_tags_and_folder(note, self.folder_of(event_path), self.graghdog.vault_name)
+
+        with METRICS.stage("link_resolve"):
+            self.resolve_links(neonote, note)
+            self.resolve_incoming_chunk_links(neonote, note.anchors)
+            self.centrality.note_linked(neonote.element_id)
+
+        logging.info(f"Create Operation on {event_path.stem} completed.")
+        return neonote
 
-            logging.info(f"Create Operation on {event_path.stem} completed.")
-            return neonote
+    def on_created(self) -> Callable[[FileSystemEvent], NeoNote]:
+        def _on_created(event: FileSystemEvent, note: Optional[Note] = None) -> NeoNote:
+            return self.create_note(Path(event.src_path), note)
 
-        return _on_created
+        return self.instrumented("created", _on_created, lambda event, target: self.serialize_note(Path(event.src_path), target))
 
     def on_modified(self) -> Callable[[FileSystemEvent], NeoNote]:
-        def _on_modified(event: FileSystemEvent) -> NeoNote:
+        def _on_modified(event: FileSystemEvent, note: Optional[Note] = None) -> NeoNote:
             event_path = Path(event.src_path)
             note_with_path = FilledNeoNote.nodes.get_or_none(path=str(event_path))
             if note_with_path is None:
                 logging.critical(f"Database Out of Sync: Modified event triggered on Path does not exist.")
-                return self.on_created()(MockFileSystemEvent(Path(event.src_path)))
+                return self.create_note(event_path, note)
 
             logging.info(f"Modified Operation on {event_path.stem} Started.")
-            self.on_deleted()(MockFileSystemEvent(Path(event.src_path)))
-            self.on_created()(MockFileSystemEvent(Path(event.src_path)))
+            self.on_deleted()(MockFileSystemEvent(event_path))
+            neonote = self.create_note(event_path, note)
             logging.info(f"Modified Operation on {event_path.stem} completed.")
+            return neonote
 
-        return _on_modified
-
-    def prune(self):
-        logging.warning("Running Prune is in-advised.")
-        pass
+        return self.instrumented("modified", _on_modified, lambda event, target: self.serialize_note(Path(event.src_path), target))
+
+    def prune(self, batch_size: int = PRUNE_BATCH_SIZE) -> Dict[str, int]:
+        """
+        Removes what the graph holds that the vault no longer supports.
+
+        Notes whose path is gone from disk are deleted (or demoted to dangles when still linked),
+        then NEXT_SPLIT links between splits of different notes, splits without an owning note,
+        dangles nothing mentions, aliases no note declares and tags or folders left empty. Each
+        missing note, and each statement of at most `batch_size` orphans, is committed in its own
+        transaction, so prune can run while the handler is live. Must be called outside of a
+        transaction, an event handler calls request_prune instead.
+
+        Returns:
+            Dict[str, int]: How many of each kind were removed
+        """
+        if in_transaction():
+            raise RuntimeError("prune commits batch by batch and cannot join an open transaction, use request_prune.")
+        report = {"missing_notes": self.prune_missing_notes(batch_size)}
+        for kind, q in _PRUNE_ORPHAN_CYPHER.items():
+            report[kind] = self._delete_in_batches(q, batch_size)
+        # Dangles and aliases were removed behind the name resolver's back
+        self.name_resolver.clear()
+
+        logging.info(f"Prune removed: {', '.join(f'{count} {kind}' for kind, count in report.items())}.")
+        return report
+
+    def request_prune(self) -> None:
+        # Prunes on a background thread, called once the requesting event committed
+        with self._prune_lock:
+            if self._prune_thread is not None:
+                self._prune_again = True
+                return
+            self._prune_thread = threading.Thread(target=self._run_prune, name="prune", daemon=True)
+            self._prune_thread.start()
+
+    def _run_prune(self) -> None:
+        scheduler = self._unit_of_work.scheduler
+        while True:
+            try:
+                with scheduler.priority(Priority.BACKGROUND) if scheduler else nullcontext():
+                    self.prune()
+            except Exception as e:
+                logging.exception(f"Prune failed: {e}")
+            with self._prune_lock:
+                if not self._prune_again:
+                    self._prune_thread = None
+                    return
+                self._prune_again = False
+
+    def prune_missing_notes(self, batch_size: int = PRUNE_BATCH_SIZE) -> int:
+        q = """
+        MATCH (n:FilledNeoNote) WHERE n.path > $after
+        RETURN n.path ORDER BY n.path LIMIT $batch_size"""
+        removed = 0
+        after = ""
+        while True:
+            results, _ = db.cypher_query(q, {"after": after, "batch_size": batch_size})
+            for (path,) in results:
+                if not Path(path).exists() and self._unit_of_work.run(self.delete_missing_note, path):
+                    removed += 1
+            if len(results) < batch_size:
+                return removed
+            after = results[-1][0]
+
+    def delete_missing_note(self, path: str) -> bool:
+        # Checked again inside the transaction, an event may have removed the note or recreated its file since
+        neonote = FilledNeoNote.nodes.get_or_none(path=path)
+        if neonote is None or Path(path).exists():
+            return False
+        self.delete_note(neonote)
+        return True
+
+    def _delete_in_batches(self, q: str, batch_size: int) -> int:
+        removed = 0
+        while True:
+            batch_removed = self._unit_of_work.run(self._delete_batch, q, batch_size)
+            removed += batch_removed
+            # Removing a leaf tag or folder can orphan its parent, so stop only once nothing is left
+            if batch_removed == 0:
+                return removed
+
+    def _delete_batch(self, q: str, batch_size: int) -> int:
+        results, _ = db.cypher_query(q, {"batch_size": batch_size})
+        return results[0][0] if results else 0
+
+    def delete_note(self, note_with_path: FilledNeoNote) -> Optional[DanglingNeoNote]:
+        self.centrality.note_unlinking(note_with_path.element_id)
+        if not self.has_incoming_link(note_with_path):
+            self.remove_note(note_with_path)
+            return None
+        return self.demote_note_to_dangle(note_with_path)
 
     def on_deleted(self) -> Callable[[FileSystemEvent], Optional[DanglingNeoNote]]:
         # When deleting a FilledNeoNote, their Respective Splits needs to removed as well.
-        def _on_deleted(event: FileSystemEvent) -> Optional[DanglingNeoNote]:
+        def _on_deleted(event: FileSystemEvent, prepared=None) -> Optional[DanglingNeoNote]:
             event_path = Path(event.src_path)
             note_with_path = FilledNeoNote.nodes.get_or_none(path=str(event_path))
             if note_with_path is None:
@@ -191,44 +738,40 @@ class NeoModelEventHandler(GraphEventHandler):
                 if RUN_PRUNE_ON_OUT_OF_SYNC:
                     log_message = f"Running clean up to prune orphans."
                     logging.critical(log_message)
-                    self.prune()
-                    logging.info(f"Delete Operation on {event_path.stem} completed.")
-                    return
-
-            if not self.has_incoming_link(note_with_path):
-                nodes_needing_support = set(note_with_path.mentions.all())
-                note_with_path.remove()
-                self.validate_unsupported_nodes(nodes_needing_support)
+                    # Outside the event's transaction, or the batch's, which would hold locks for the whole scan
+                    after_commit(self.request_prune)
                 logging.info(f"Delete Operation on {event_path.stem} completed.")
                 return
 
-            dangle = self.create_dangle(event_path.stem)
-            dangle = self.demote_note_to_dangle(dangle, note_with_path)
+            dangle = self.delete_note(note_with_path)
             logging.info(f"Delete Operation on {event_path.stem} completed.")
             return dangle
 
-        return _on_deleted
+        return self.instrumented("deleted", _on_deleted)
 
     def on_moved(self) -> Callable[[FileSystemEvent], NeoNote]:
-        def _on_moved(event: FileSystemEvent) -> NeoNote:
+        def _on_moved(event: FileSystemEvent, note: Optional[Note] = None) -> NeoNote:
             event_path = Path(event.src_path)
             logging.info(f"Modified Operation on {event_path.stem} Started.")
-            self.on_deleted()(MockFileSystemEvent(Path(event.src_path)))
-            self.on_created()(MockFileSystemEvent(Path(event.dest_path)))
+            self.on_deleted()(MockFileSystemEvent(event_path))
+            neonote = self.create_note(Path(event.dest_path), note)
             logging.info(f"Modified Operation on {event_path.stem} completed.")
+            return neonote
 
-        return _on_moved
+        return self.instrumented("moved", _on_moved, lambda event, target: self.serialize_note(Path(event.dest_path), target))
 
     def create_vector_index(
         self,
         name: str,
         node_type: str,
-        embed_name: str = "content_embedding",
-        dimension: int = 1028,
+        embed_name: Optional[str] = None,
+        dimension: Optional[int] = None,
         sim_func: str = "cosine",
         m: int = 128,
         ef: int = 400,
     ):
+        embed_name = embed_name if embed_name else self.embedding_property
+        dimension = dimension if dimension else embedding_dimension(self.graghdog.embedder)
         q = f"""
         CREATE VECTOR INDEX {name} IF NOT EXISTS
         FOR (n:{node_type}) ON (n.{embed_name})
@@ -241,23 +784,133 @@ class NeoModelEventHandler(GraphEventHandler):
         q_param = {"dimension": dimension, "sim_func": sim_func, "m": m, "ef": ef}
         return db.cypher_query(q, params=q_param)
 
-    def query_vector_index(self, q_embed: List[float], top_k: int = 5, node_type: Optional[str] = None, embed_name: str = "content_embedding"):
-        node_type = f":{node_type}" if node_type else ""
+    def query_vector_index(
+        self,
+        q_embed: List[float],
+        top_k: int = 5,
+        node_type: Optional[str] = None,
+        embed_name: Optional[str] = None,
+        search_filter: Optional["VectorSearchFilter"] = None,
+        centrality_weight: float = 0.0,
+    ):
+        """
+        Scores notes or splits by cosine similarity to `q_embed`.
+
+        With `centrality_weight` above 0 the score becomes (1 - weight) * similarity + weight * boost,
+        where the boost is the stored centrality squashed into [0, 1), so heavily linked hubs rank higher.
+        """
+        embed_name = embed_name if embed_name else self.embedding_property
+        score = "similarity"
+        if centrality_weight > 0:
+            score = f"(1.0 - $centrality_weight) * similarity + $centrality_weight * {centrality_boost('n')}"
+        if search_filter is None or search_filter.is_empty():
+            node_type = f":{node_type}" if node_type else ""
+            q = f"""
+            MATCH (n{node_type})
+            WITH n, vector.similarity.cosine(n.{embed_name}, $vector) AS similarity
+            WITH n, {score} AS score
+            RETURN n, score
+            ORDER BY score DESC
+            LIMIT $top_k"""
+            q_param = {"vector": q_embed, "top_k": top_k, "centrality_weight": centrality_weight}
+            with METRICS.stage("query", filtered="false"):
+                return db.cypher_query(q, q_param, resolve_objects=True)
+
+        # Candidates are narrowed by the filter's index seeks first, so only the scope gets scored
+        if node_type == "NeoSplit":
+            candidates, scored = "(note:FilledNeoNote)-[:CONTAIN_SPLIT]->(split:NeoSplit)", "split"
+        elif node_type == "FilledNeoNote":
+            candidates, scored = "(note:FilledNeoNote)", "note"
+        else:
+            raise ValueError(f"Filtered vector search needs node_type FilledNeoNote or NeoSplit, got {node_type}.")
+
+        scope_matches, conditions, q_param = search_filter.to_cypher("note")
+        scope = "".join(f"MATCH {pattern}\n            " for pattern in scope_matches)
+        where = " AND ".join(conditions + [f"{scored}.{embed_name} IS NOT NULL"])
         q = f"""
-        MATCH (n{node_type})
-        WITH n, vector.similarity.cosine(n.{embed_name}, $vector) AS similarity
-        RETURN n, similarity
-        ORDER BY similarity DESC
-        LIMIT $top_k"""
-        q_param = {"vector": q_embed, "top_k": top_k}
-        return db.cypher_query(q, q_param, resolve_objects=True)
+            {scope}MATCH {candidates}
+            WHERE {where}
+            WITH DISTINCT {scored} AS n
+            WITH n, vector.similarity.cosine(n.{embed_name}, $vector) AS similarity
+            WITH n, {score} AS score
+            RETURN n, score
+            ORDER BY score DESC
+            LIMIT $top_k"""
+        q_param.update({"vector": q_embed, "top_k": top_k, "centrality_weight": centrality_weight})
+        with METRICS.stage("query", filtered="true"):
+            return db.cypher_query(q, q_param, resolve_objects=True)
+
+
+class VectorSearchFilter:
+    """
+    Predicates restricting which notes, or splits of which notes, a vector search scores.
+
+    Tags and folders are matched through the Tag/Folder nodes and the path prefix through the
+    unique path index, so the search only visits candidates inside the requested scope. Every
+    predicate given must hold.
+
+    Args:
+        path_prefix: Only notes whose absolute path starts with this
+        folder: Vault relative folder, notes in it or any of its subfolders
+        tags: Tags the note must carry, a parent tag also matches its children
+        modified_after: Only notes modified at or after this time
+        modified_before: Only notes modified before this time
+    """
+
+    def __init__(
+        self,
+        path_prefix: Optional[str] = None,
+        folder: Optional[str] = None,
+        tags: Optional[List[str]] = None,
+        modified_after: Optional[datetime] = None,
+        modified_before: Optional[datetime] = None,
+    ):
+        self.path_prefix = path_prefix
+        self.folder = folder
+        self.tags = [tag.lstrip("#").casefold() for tag in tags] if tags else []
+        self.modified_after = modified_after
+        self.modified_before = modified_before
+
+    def is_empty(self) -> bool:
+        return not (self.path_prefix or self.folder is not None or self.tags or self.modified_after or self.modified_before)
+
+    def to_cypher(self, note_var: str) -> Tuple[List[str], List[str], Dict]:
+        """
+        Returns:
+            Tuple[List[str], List[str], Dict]: MATCH patterns, WHERE conditions on `note_var`, and their parameters
+        """
+        matches, conditions, params = [], [], {}
+        for idx, tag in enumerate(self.tags):
+            # Note tags already include every parent of a hierarchical tag
+            matches.append(f"(:Tag {{name: $tag_{idx}}})<-[:TAGGED]-({note_var}:FilledNeoNote)")
+            params[f"tag_{idx}"] = tag
+
+        if self.folder is not None:
+            matches.append(f"(:Folder {{path: $folder}})<-[:CHILD_OF*0..]-(:Folder)<-[:IN_FOLDER]-({note_var}:FilledNeoNote)")
+            params["folder"] = self.folder.strip("/")
+
+        if self.path_prefix:
+            conditions.append(f"{note_var}.path STARTS WITH $path_prefix")
+            params["path_prefix"] = str(self.path_prefix)
+
+        # neomodel stores DateTimeProperty as epoch seconds
+        if self.modified_after:
+            conditions.append(f"{note_var}.modified_time >= $modified_after")
+            params["modified_after"] = self.modified_after.timestamp()
+
+        if self.modified_before:
+            conditions.append(f"{note_var}.modified_time < $modified_before")
+            params["modified_before"] = self.modified_before.timestamp()
+
+        return matches, conditions, params
 
 
 class MockFileSystemEvent:
-    def __init__(self, path, dest_path=""):
+    def __init__(self, path, dest_path="", event_type: str = "Mock", is_directory: bool = False):
         self.src_path = path
         self.dest_path = dest_path
-        self.event_type = "Mock"
+        self.event_type = event_type
+        self.is_directory = is_directory
 
 
 def main():
@@ -1,5 +1,6 @@
 from abc import ABC
-from typing import List
+import json
+from typing import Dict, List, Optional
 from neomodel import db
 from neomodel import (
     StructuredRel,
@@ -12,17 +13,44 @@ from neomodel import (
     UniqueIdProperty,
     DateTimeProperty,
     FulltextIndex,
+    JSONProperty,
+    RelationshipTo,
 )
 
-from world_graph.objects import Note, Split
+from world_graph.objects import Note, Split, normalize_name
+from world_graph.unit_of_work import transactional
+
+# Property the embeddings were written to before embedding spaces, still used when a space adopts it
+LEGACY_EMBEDDING_PROPERTY = "content_embedding"
 
 
 class Folder(StructuredNode):
-    pass
+    # Vault relative posix path, "" for the vault root
+    path = StringProperty(unique_index=True)
+    name = StringProperty()
+    parent = RelationshipTo("Folder", "CHILD_OF")
 
 
 class Tag(StructuredNode):
-    pass
+    # Full case-folded hierarchical name, e.g. "project/alpha"
+    name = StringProperty(unique_index=True)
+    parent = RelationshipTo("Tag", "CHILD_OF")
+
+
+class Alias(StructuredNode):
+    # One lookup node per normalized alias, shared by every note declaring it
+    key = StringProperty(unique_index=True)
+    name = StringProperty()
+
+
+class EmbeddingSpace(StructuredNode):
+    # One per embedding model, its vectors live in `property` on every NeoSplit and FilledNeoNote
+    model = StringProperty(unique_index=True)
+    property = StringProperty()
+    dimension = IntegerProperty()
+    # shadow while being backfilled, active while serving queries, retired once replaced
+    state = StringProperty(index=True)
+    updated_time = DateTimeProperty()
 
 
 class Link(StructuredRel):
@@ -33,6 +61,9 @@ class ObsidianLink(Link):
     uid = UniqueIdProperty()
     format_type = StringProperty()
     display_text = StringProperty()
+    # [source split count, headers, block id] of each header or block link along the edge, kept so the
+    # links can be resolved again when the target note is recreated, see resolve_incoming_chunk_links
+    chunk_links = JSONProperty()
 
 
 class NeoSplit(StructuredNode):
@@ -40,24 +71,35 @@ class NeoSplit(StructuredNode):
     name = StringProperty()
     content = StringProperty(fulltext_index=FulltextIndex(analyzer="english", eventually_consistent=True))
     content_embedding = ArrayProperty(FloatProperty())
+    # The owning note's centrality, see CentralityIndex
+    centrality = FloatProperty()
 
     next = Relationship("NeoSplit", "NEXT_SPLIT")
+    # Header and ^block links resolved down to the exact split they point at
+    mentions = RelationshipTo("NeoSplit", "MENTIONED_SPLIT")
+    tags = RelationshipTo("Tag", "TAGGED")
 
     @classmethod
-    def from_split(cls, split: Split):
+    def from_split(cls, split: Split, embedding_property: str = LEGACY_EMBEDDING_PROPERTY):
         kwargs = {
             "count": split.count,
             "name": split.name,
             "content": split.content,
-            "content_embedding": split.embedding,
         }
+        if embedding_property == LEGACY_EMBEDDING_PROPERTY:
+            kwargs["content_embedding"] = split.embedding.tolist()
         return cls(**kwargs)
 
 
 class NeoNote(StructuredNode):
     name = StringProperty()
+    # normalize_name(name), so links resolve through an index seek instead of a case-insensitive regex scan
+    name_key = StringProperty(index=True)
     mentions = Relationship("NeoNote", "MENTIONED", model=ObsidianLink)
 
+    def pre_save(self):
+        self.name_key = normalize_name(self.name) if self.name is not None else None
+
 
 class DanglingNeoNote(NeoNote):
     name = StringProperty(unique_index=True)
@@ -71,25 +113,36 @@ class FilledNeoNote(NeoNote):
     content = StringProperty(fulltext_index=FulltextIndex(analyzer="english", eventually_consistent=True))
     content_embedding = ArrayProperty(FloatProperty())
     modified_time = DateTimeProperty()
+    # AnchorIndex of header paths and block ids to split counts
+    anchor_index = JSONProperty()
+    # Maintained by CentralityIndex, distinct notes linking here and the PageRank style score
+    in_degree = IntegerProperty()
+    centrality = FloatProperty()
 
     head = Relationship("NeoSplit", "HEAD_SPLIT")
     contain = Relationship("NeoSplit", "CONTAIN_SPLIT")
+    aliases = RelationshipTo("Alias", "HAS_ALIAS")
+    tags = RelationshipTo("Tag", "TAGGED")
+    folder = RelationshipTo("Folder", "IN_FOLDER")
 
     def __hash__(self):
         return hash(self.path)
 
     @classmethod
-    # @db.transaction
-    def from_note(cls, note: Note):
+    @transactional
+    def from_note(cls, note: Note, embedding_property: str = LEGACY_EMBEDDING_PROPERTY):
         kwargs = {
             "path": note.path,
             "content": note.content,
             "name": note.name,
             "modified_time": note.modified_time,
-            "content_embedding": note.embedding,
+            "anchor_index": note.anchors.to_dict(),
         }
+        if embedding_property == LEGACY_EMBEDDING_PROPERTY:
+            kwargs["content_embedding"] = note.embedding.tolist()
         neonote = cls(**kwargs).save()
-        splits = neonote.create_splits(note.splits)
+        neonote.set_aliases(list(note.aliases))
+        splits = neonote.create_splits(note.splits, embedding_property)
 
         previous_split = None
         for idx, split in enumerate(splits):
@@ -100,13 +153,180 @@ class FilledNeoNote(NeoNote):
             neonote.contain.connect(split)
             previous_split = split
 
+        if embedding_property != LEGACY_EMBEDDING_PROPERTY:
+            neonote.set_embeddings(note, embedding_property)
         return neonote
 
-    def create_splits(self, splits: List[Split]) -> List[NeoSplit]:
-        return [NeoSplit.from_split(split).save() for split in splits]
+    def set_embeddings(self, note: Note, embedding_property: str) -> None:
+        # Per-model properties are not declared on the class, so the note's and its splits' vectors are set in one statement
+        q = """
+        MATCH (n:FilledNeoNote) WHERE elementId(n) = $element_id
+        SET n += $note_props
+        WITH n
+        UNWIND $splits AS row
+        MATCH (n)-[:CONTAIN_SPLIT]->(split:NeoSplit {count: row.count})
+        SET split += row.props"""
+        q_param = {
+            "element_id": self.element_id,
+            "note_props": {embedding_property: note.embedding.tolist()},
+            "splits": [{"count": split.count, "props": {embedding_property: split.embedding.tolist()}} for split in note.splits],
+        }
+        db.cypher_query(q, q_param)
+
+    def append_window(self, splits: List[Split], embedding_property: str) -> None:
+        """
+        Writes one window of a streamed note in one statement, its splits with their vectors and tags
+        chained after the note's last split. A streamed note keeps its text in its splits only, its
+        own content stays unset rather than being rewritten whole for every window.
+        """
+        q = """
+        MATCH (n:FilledNeoNote) WHERE elementId(n) = $element_id
+        REMOVE n.content
+        WITH n
+        OPTIONAL MATCH (n)-[:CONTAIN_SPLIT]->(last:NeoSplit {count: $previous_count})
+        CALL {
+            WITH n
+            UNWIND $splits AS row
+            CREATE (n)-[:CONTAIN_SPLIT]->(split:NeoSplit)
+            SET split = row
+            RETURN collect(split) AS splits
+        }
+        CALL {
+            WITH n, last, splits
+            WITH n, last, head(splits) AS first WHERE last IS NULL AND first IS NOT NULL
+            CREATE (n)-[:HEAD_SPLIT]->(first)
+        }
+        CALL {
+            WITH last, splits
+            WITH last, head(splits) AS first WHERE last IS NOT NULL AND first IS NOT NULL
+            CREATE (last)-[:NEXT_SPLIT]->(first)
+        }
+        CALL {
+            WITH splits
+            UNWIND range(0, size(splits) - 2) AS i
+            WITH splits[i] AS previous_split, splits[i + 1] AS split
+            CREATE (previous_split)-[:NEXT_SPLIT]->(split)
+        }
+        CALL {
+            WITH n
+            UNWIND $split_tags AS row
+            MATCH (n)-[:CONTAIN_SPLIT]->(split:NeoSplit {count: row.count})
+            MERGE (tag:Tag {name: row.tag})
+            MERGE (split)-[:TAGGED]->(tag)
+        }"""
+        q_param = {
+            "element_id": self.element_id,
+            "previous_count": splits[0].count - 1 if splits else -1,
+            "splits": [
+                {"count": split.count, "name": split.name, "content": split.content, embedding_property: split.embedding.tolist()} for split in splits
+            ],
+            "split_tags": [{"count": split.count, "tag": tag.casefold()} for split in splits for tag in split.tags],
+        }
+        db.cypher_query(q, q_param)
+
+    def finish_stream(self, note: Note, embedding_property: str) -> None:
+        # A streamed note's anchors and embedding are only known once its last window was read
+        q = """
+        MATCH (n:FilledNeoNote) WHERE elementId(n) = $element_id
+        SET n.anchor_index = $anchor_index, n += $note_props"""
+        q_param = {
+            "element_id": self.element_id,
+            "anchor_index": json.dumps(note.anchors.to_dict()),
+            "note_props": {embedding_property: note.embedding.tolist()},
+        }
+        db.cypher_query(q, q_param)
+        # The name resolver may hand this node out to notes linking into it
+        self.anchor_index = note.anchors.to_dict()
+
+    def set_aliases(self, aliases: List[str]) -> None:
+        if not aliases:
+            return
+        q = """
+        MATCH (n:FilledNeoNote) WHERE elementId(n) = $element_id
+        UNWIND $aliases AS alias
+        MERGE (a:Alias {key: alias.key})
+        ON CREATE SET a.name = alias.name
+        MERGE (n)-[:HAS_ALIAS]->(a)"""
+        rows = [{"key": normalize_name(alias), "name": alias} for alias in aliases]
+        db.cypher_query(q, {"element_id": self.element_id, "aliases": rows})
+
+    def set_tags_and_folder(self, note: Note, folder_path: Optional[str], vault_name: str = "") -> None:
+        """
+        Brings the note's TAGGED and IN_FOLDER edges, and its splits' TAGGED edges, in line with `note`.
+
+        Tag and Folder nodes are merged along with their CHILD_OF parents, edges to tags the note no
+        longer carries are removed, and everything is written in one statement.
+        """
+        tag_rows = [{"name": tag, "parent": tag.rsplit("/", 1)[0] if "/" in tag else None} for tag in {tag.casefold() for tag in note.tags}]
+        split_tag_rows = [{"count": split.count, "tag": tag.casefold()} for split in note.splits for tag in split.tags]
+        folder_rows = folder_hierarchy(folder_path, vault_name) if folder_path is not None else []
+
+        q = """
+        MATCH (n:FilledNeoNote) WHERE elementId(n) = $element_id
+        CALL {
+            WITH n
+            MATCH (n)-[tagged:TAGGED]->(tag:Tag) WHERE NOT tag.name IN [row IN $tags | row.name]
+            DELETE tagged
+        }
+        CALL {
+            WITH n
+            UNWIND $tags AS row
+            MERGE (tag:Tag {name: row.name})
+            MERGE (n)-[:TAGGED]->(tag)
+            WITH tag, row WHERE row.parent IS NOT NULL
+            MERGE (parent:Tag {name: row.parent})
+            MERGE (tag)-[:CHILD_OF]->(parent)
+        }
+        CALL {
+            WITH n
+            UNWIND $split_tags AS row
+            MATCH (n)-[:CONTAIN_SPLIT]->(split:NeoSplit {count: row.count})
+            MERGE (tag:Tag {name: row.tag})
+            MERGE (split)-[:TAGGED]->(tag)
+        }
+        CALL {
+            WITH n
+            MATCH (n)-[in_folder:IN_FOLDER]->(folder:Folder) WHERE folder.path <> $folder
+            DELETE in_folder
+        }
+        CALL {
+            WITH n
+            UNWIND $folders AS row
+            MERGE (folder:Folder {path: row.path})
+            ON CREATE SET folder.name = row.name
+            WITH folder, row WHERE row.parent IS NOT NULL
+            MERGE (parent:Folder {path: row.parent})
+            MERGE (folder)-[:CHILD_OF]->(parent)
+        }
+        CALL {
+            WITH n
+            MATCH (folder:Folder {path: $folder})
+            MERGE (n)-[:IN_FOLDER]->(folder)
+        }"""
+        q_param = {
+            "element_id": self.element_id,
+            "tags": tag_rows,
+            "split_tags": split_tag_rows,
+            "folder": folder_path,
+            "folders": folder_rows,
+        }
+        db.cypher_query(q, q_param)
+
+    def create_splits(self, splits: List[Split], embedding_property: str = LEGACY_EMBEDDING_PROPERTY) -> List[NeoSplit]:
+        return [NeoSplit.from_split(split, embedding_property).save() for split in splits]
 
     def remove(self):
         splits_to_delete = self.contain.all()
         for split in splits_to_delete:
             split.delete()
         self.delete()
+
+
+def folder_hierarchy(folder_path: str, vault_name: str = "") -> List[Dict[str, Optional[str]]]:
+    # The folder and each of its ancestors up to the vault root ("")
+    parts = folder_path.split("/") if folder_path else []
+    rows = []
+    for depth in range(len(parts), 0, -1):
+        rows.append({"path": "/".join(parts[:depth]), "name": parts[depth - 1], "parent": "/".join(parts[: depth - 1])})
+    rows.append({"path": "", "name": vault_name, "parent": None})
+    return rows
@@ -1,25 +1,32 @@
+import functools
 import itertools
 from pathlib import Path
 from pprint import pprint
 import re
-from typing import Any, Dict, List, Optional, Set, Tuple
-import yaml
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 import os
 import logging
 
-from rich.logging import RichHandler
-import nltk
-
 from world_graph.read_backwards import reverse_readline
 from world_graph.objects import Link, ObsidianLink
 
 
-# Configure the logger with RichHandler
-logging.basicConfig(level=logging.INFO, format="%(message)s", datefmt="[%X]", handlers=[RichHandler(rich_tracebacks=True)])
-
 parse_log = logging.getLogger("rich_logger")
 
 
+@functools.lru_cache(maxsize=None)
+def sentence_tokenizer(language: str = "english") -> Callable[[str], List[str]]:
+    # NLTK is imported and the punkt model loaded on first use, then shared by every thread
+    try:
+        from nltk.tokenize import PunktTokenizer
+
+        return PunktTokenizer(language).tokenize
+    except ImportError:
+        import nltk
+
+        return nltk.data.load(f"tokenizers/punkt/{language}.pickle").tokenize
+
+
 def does_not_start_with_frontmatter(file_contents: str) -> bool:
     return len(file_contents) < 4 or (len(file_contents) >= 4 and file_contents[:4] != f"---{os.linesep}")
 
@@ -35,6 +42,8 @@ def get_note_frontmatter(file_contents: str) -> Dict[str, Any]:
     for idx, line in enumerate(lines[1:], start=1):
         if line == "---":
             parse_log.debug(f"Found end of properties token '---' on line: {idx}. Stopping.")
+            import yaml
+
             return yaml.safe_load(yaml_property_lines)
         yaml_property_lines += line + "\n"
     else:
@@ -58,6 +67,35 @@ def where_does_frontmatter_stop(file_contents: str) -> int:
     return end_idx if end_idx != -1 else 0
 
 
+def locate_chunk_spans(file_contents: str, chunks: List[str], start: int = 0) -> List[Optional[Tuple[int, int]]]:
+    """
+    Finds where each chunk sits in the note buffer so splits can hold offsets instead of copies.
+
+    Chunks are expected in document order, so each search starts at the end of the previous
+    match and only looks a bounded distance ahead. Chunks the splitter rewrote (e.g. sentences
+    re-joined with a different separator) are not verbatim in the buffer and get None.
+
+    Args:
+        file_contents: the str containing the note
+        chunks: the split strings, in order
+        start: the index to begin searching from, usually where the frontmatter stops
+
+    Returns:
+        List[Optional[Tuple[int, int]]]: The (start, end) offsets of each chunk, or None
+    """
+    spans = []
+    cursor = start
+    for chunk in chunks:
+        search_end = cursor + 4 * len(chunk) + 256
+        found = file_contents.find(chunk, cursor, search_end) if chunk else -1
+        if found == -1:
+            spans.append(None)
+            continue
+        spans.append((found, found + len(chunk)))
+        cursor = found + len(chunk)
+    return spans
+
+
 def extract_tags_from_yaml(yaml_tags: List[str] | str) -> Set[str]:
     if isinstance(yaml_tags, str):
         yaml_tags = [single_tag for single_tag in re.split(", | ", yaml_tags)]
@@ -69,6 +107,16 @@ def extract_tags_from_yaml(yaml_tags: List[str] | str) -> Set[str]:
     return []
 
 
+def extract_aliases_from_yaml(yaml_aliases: List[str] | str | None) -> List[str]:
+    if isinstance(yaml_aliases, str):
+        return [yaml_aliases]
+
+    if isinstance(yaml_aliases, List):
+        return [str(alias) for alias in yaml_aliases if alias is not None]
+
+    return []
+
+
 def extract_hierarchical_tags_from_list(tag_list: List[str]) -> Set[str]:
     tags = set()
     for single_tag in tag_list:
@@ -105,7 +153,7 @@ def obsidian_specific_rule_sentence_splitter_nltk(text: str) -> List[str]:
     # Replace all [[wikilinks]] with placeholders
     text_with_placeholders = re.sub(wikilink_pattern, replace_wikilinks, text)
 
-    sentences = nltk.sent_tokenize(text_with_placeholders)
+    sentences = sentence_tokenizer()(text_with_placeholders)
 
     restored_sentences = []
     for s in sentences:
@@ -194,6 +242,29 @@ def get_tags_from_line(line: str) -> List[str]:
 
 WIKILINK_PATTERN = re.compile(r"\[\[(.*?)\]\]")
 
+# https://help.obsidian.md/Linking+notes+and+files/Internal+links#Link+to+a+heading+in+a+note
+HEADER_PATTERN = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+# https://help.obsidian.md/Linking+notes+and+files/Internal+links#Link+to+a+block+in+a+note
+BLOCK_ID_PATTERN = re.compile(r"(?:^|\s)\^([A-Za-z0-9-]+)\s*$")
+
+
+def get_header_from_line(line: str) -> Optional[Tuple[int, str]]:
+    """
+    Returns the (level, text) of a markdown header line, or None if the line is not a header.
+    """
+    match = HEADER_PATTERN.match(line)
+    if match is None:
+        return None
+    return len(match.group(1)), match.group(2)
+
+
+def get_block_id_from_line(line: str) -> Optional[str]:
+    """
+    Returns the block id of a line ending in ` ^block-id`, or None.
+    """
+    match = BLOCK_ID_PATTERN.search(line)
+    return match.group(1) if match else None
+
 
 def get_links(content: str, source_path: Path, chunk_idx: int) -> List[Link]:
     # Internal
@@ -237,14 +308,18 @@ def parse_wikilink_simple(between_brackets: str) -> ObsidianLink:
 
     wikilink_section_split = wikilink_url.split("#")
     header_path = wikilink_section_split[1:]
+    target_part = wikilink_section_split[0]
 
+    # Block references are written [[Note#^id]], also accept [[Note^id]] and [[Note#Header^id]]
     block_hash = None
-    if len(header_path) > 0:
-        block_split = header_path[0].split("^", 1)
-        block_hash = block_split[1] if len(block_split) > 1 else None
+    if len(header_path) > 0 and "^" in header_path[-1]:
+        last_header, block_hash = header_path[-1].split("^", 1)
+        header_path = header_path[:-1] + ([last_header] if last_header else [])
+    elif "^" in target_part:
+        target_part, block_hash = target_part.split("^", 1)
 
     # path_split = wikilink_section_split[0].split("/")
-    target_path = Path(wikilink_section_split[0])
+    target_path = Path(target_part)
 
     return ObsidianLink("Wikilink", target=target_path, display_text=wikilink_display_text, headers=header_path, block_hash=block_hash)
 
@@ -1,9 +1,23 @@
 from abc import ABC, abstractmethod
+from array import array
 from datetime import datetime
 from collections import defaultdict
 from pathlib import Path
 import string
-from typing import Dict, List, Optional
+import sys
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from world_graph.utils import read_note_content
+
+# Embeddings are held as packed float32 rather than lists of boxed Python floats
+EMBEDDING_TYPECODE = "f"
+EMPTY_EMBEDDING = array(EMBEDDING_TYPECODE)
+
+_PUNCTUATION_TO_SPACE = str.maketrans(string.punctuation, " " * len(string.punctuation))
+
+
+def as_embedding(vector: Iterable[float]) -> array:
+    return vector if isinstance(vector, array) and vector.typecode == EMBEDDING_TYPECODE else array(EMBEDDING_TYPECODE, vector)
 
 
 class Node:
@@ -24,11 +38,22 @@ class Folder:
 
 # Obsidian Graph Objects
 class Link:
-    def __init__(self, type: str, properties={}):
+    __slots__ = ("type", "properties")
+
+    _blacklisted_repr = frozenset({"context"})
+    _interned: Dict[str, "Link"] = {}
+
+    def __init__(self, type: str, properties: Optional[Dict] = None):
         self.type = type  # "Wikilink", "Markdown", "External"
-        self.properties = properties
+        self.properties = properties if properties is not None else {}
 
-        self._blacklisted_repr = {"context"}
+    @classmethod
+    def of(cls, type: str) -> "Link":
+        # Shared singleton per link kind, for the property-less links made on every tag occurrence. Treat as read-only.
+        link = cls._interned.get(type)
+        if link is None:
+            link = cls._interned.setdefault(type, cls(sys.intern(type)))
+        return link
 
     def __str__(self):
         return self.type + self.properties.__str__()
@@ -40,6 +65,8 @@ class Link:
 
 # Enumarate through all the different types of links components there could be in a Wikilink
 class ObsidianLink:
+    __slots__ = ("format_type", "target", "display_text", "headers", "block_hash")
+
     def __init__(self, format_type: str, target: Path, display_text: Optional[str] = None, headers: List[str] = [], block_hash: Optional[str] = None):
         self.format_type = format_type  # "Wikilink", "Markdown", "External"
         self.target = target  # The target file or path
@@ -51,11 +78,11 @@ class ObsidianLink:
         return self.rebuild()
 
     def rebuild(self):
-        base = f"[[{str(self.target)}"
+        base = f"[[{'' if self.is_self_link() else str(self.target)}"
         if self.headers:
             base += "#" + "#".join(self.headers)
         if self.block_hash:
-            base += f"^#{self.block_hash}"
+            base += f"#^{self.block_hash}"
         if self.display_text:
             base += f"|{self.display_text}"
         return base + "]]"
@@ -63,10 +90,17 @@ class ObsidianLink:
     def is_target_relative_path(self) -> bool:
         return len(self.target.parts) > 1
 
+    def _identity(self) -> Tuple:
+        # Display text only changes how the link renders, not what it references
+        return (self.format_type, self.target, tuple(self.headers), self.block_hash)
+
     def __hash__(self):
-        # Rebuild without display text
-        # Does adding the Display text help or hurt for uniqueness and referencing the correct thing
-        hash(self.rebuild())
+        return hash(self._identity())
+
+    def __eq__(self, other):
+        if not isinstance(other, ObsidianLink):
+            return NotImplemented
+        return self._identity() == other._identity()
 
     def is_self_link(self) -> bool:
         return len(self.target.parts) == 0
@@ -78,18 +112,77 @@ class ObsidianLink:
         return has_block_hash or has_headers
 
 
+class AnchorIndex:
+    """
+    Maps the header paths and ^block ids of a note to the ordinal of the split they start in.
+
+    Header keys are stored both as the full path ("overview#section-1") and as the bare header,
+    the first occurrence winning, so a link can be resolved with a dictionary lookup.
+    """
+
+    __slots__ = ("_headers", "_blocks")
+
+    def __init__(self, headers: Optional[Dict[str, int]] = None, blocks: Optional[Dict[str, int]] = None):
+        self._headers = headers if headers is not None else {}
+        self._blocks = blocks if blocks is not None else {}
+
+    @classmethod
+    def from_dict(cls, index: Optional[Dict[str, Dict[str, int]]]) -> "AnchorIndex":
+        if not index:
+            return cls()
+        return cls(index.get("headers"), index.get("blocks"))
+
+    def to_dict(self) -> Dict[str, Dict[str, int]]:
+        return {"headers": self._headers, "blocks": self._blocks}
+
+    def __len__(self) -> int:
+        return len(self._headers) + len(self._blocks)
+
+    def add_header(self, header_path: List[str], split_idx: int) -> None:
+        keys = [_normalize_anchor(header) for header in header_path]
+        self._headers.setdefault("#".join(keys), split_idx)
+        self._headers.setdefault(keys[-1], split_idx)
+
+    def add_block(self, block_id: str, split_idx: int) -> None:
+        self._blocks.setdefault(_normalize_anchor(block_id), split_idx)
+
+    def resolve(self, link: ObsidianLink) -> Optional[int]:
+        if link.block_hash:
+            return self._blocks.get(_normalize_anchor(link.block_hash))
+        if not link.headers:
+            return None
+        keys = [_normalize_anchor(header) for header in link.headers]
+        split_idx = self._headers.get("#".join(keys))
+        return split_idx if split_idx is not None else self._headers.get(keys[-1])
+
+
+def _normalize_anchor(anchor: str) -> str:
+    return " ".join(anchor.split()).casefold()
+
+
+def normalize_name(name: str) -> str:
+    # Lookup key for note names and aliases, matching how Obsidian resolves [[links]] case-insensitively
+    return " ".join(name.split()).casefold()
+
+
 class Split:
-    def __init__(self, count: int, content: str):
+    # Tag and link containers are only allocated once something is added, most splits have none.
+    __slots__ = ("_count", "_content", "_buffer", "_span", "_tags", "_aliases", "_outgoing_chunk_links", "_outgoing_note_links", "_embedding")
+
+    def __init__(self, count: int, content: Optional[str] = None, buffer: Optional[str] = None, span: Optional[Tuple[int, int]] = None):
+        # A split either owns its text or is a (start, end) view into its Note's content buffer.
         self._count = count
         self._content = content
-        self._tags = defaultdict(list)
-        self._aliases = defaultdict(list)
-        self._outgoing_chunk_links = []
-        self._outgoing_note_links = []
-        self._embedding = []
+        self._buffer = buffer
+        self._span = span
+        self._tags = None
+        self._aliases = None
+        self._outgoing_chunk_links = None
+        self._outgoing_note_links = None
+        self._embedding = EMPTY_EMBEDDING
 
     @property
-    def embedding(self) -> List[float]:
+    def embedding(self) -> array:
         return self._embedding
 
     @property
@@ -104,7 +197,7 @@ class Split:
         # Can/Should be overloaded to have Generative LLM name
         return (
             f"{self.count}_"
-            + " ".join(self.first_line.translate(str.maketrans(string.punctuation, " " * len(string.punctuation))).strip().split(" ")[:5])[:32]
+            + " ".join(self.first_line.translate(_PUNCTUATION_TO_SPACE).strip().split(" ")[:5])[:32]
             + "..."
         )
 
@@ -114,38 +207,68 @@ class Split:
 
     @property
     def content(self) -> str:
+        if self._span is not None:
+            start, end = self._span
+            return self._buffer[start:end]
         return self._content
 
+    @property
+    def span(self) -> Optional[Tuple[int, int]]:
+        return self._span
+
     @property
     def tags(self) -> Dict[str, List[Link]]:
-        return self._tags
+        return self._tags if self._tags is not None else {}
+
+    @property
+    def outgoing_links(self) -> List[ObsidianLink]:
+        return self._outgoing_note_links if self._outgoing_note_links is not None else []
+
+    @classmethod
+    def from_span(cls, count: int, buffer: str, span: Tuple[int, int]) -> "Split":
+        return cls(count, buffer=buffer, span=span)
 
     def add_alias(self, alias: Alias, link: Link) -> None:
-        self._aliases[alias].append(link)
+        if self._aliases is None:
+            self._aliases = defaultdict(list)
+        self._aliases[sys.intern(alias)].append(link)
 
     def add_tag(self, tag: Tag, link: Link) -> None:
-        self._tags[tag].append(link)
+        if self._tags is None:
+            self._tags = defaultdict(list)
+        self._tags[sys.intern(tag)].append(link)
 
     def add_outgoing_chunk_link(self, link: Link) -> None:
+        if self._outgoing_chunk_links is None:
+            self._outgoing_chunk_links = []
         self._outgoing_chunk_links.append(link)
 
     def add_outgoing_note_link(self, link: Link) -> None:
+        if self._outgoing_note_links is None:
+            self._outgoing_note_links = []
         self._outgoing_note_links.append(link)
 
     def set_embedding(self, vectorizer) -> None:
         # Handle how we want short chunks (less than threshold ex 35 char) to be embedded.
-        self._embedding = vectorizer.embed_query(self.content)
+        self._embedding = as_embedding(vectorizer.embed_query(self.content))
+
+    def set_embedding_vector(self, vector: Iterable[float]) -> None:
+        self._embedding = as_embedding(vector)
 
 
 class Note:
-    def __init__(self, path: Path, tags: List[str] = [], aliases: List[str] = [], splits: Optional[List[Split]] = None):
+    __slots__ = ("_path", "_tags", "_aliases", "_outgoing_chunk_links", "_outgoing_note_links", "_embedding", "_splits", "_content", "_anchors", "_created_time", "_modified_time")
+
+    def __init__(self, path: Path, tags: List[str] = [], aliases: List[str] = [], splits: Optional[List[Split]] = None, content: Optional[str] = None):
         self._path = path
         self._tags = defaultdict(list)
+        self._aliases = defaultdict(list)
         self._outgoing_chunk_links = []
         self._outgoing_note_links = []
-        self._embedding = []
+        self._embedding = EMPTY_EMBEDDING
         self._splits = splits if splits else []
-        self._content = None
+        self._content = content
+        self._anchors = AnchorIndex()
         self._created_time = None
         self._modified_time = None
 
@@ -155,11 +278,13 @@ class Note:
 
     @property
     def content(self) -> str:
-        with open(self.path, mode="r", encoding="utf-8") as file:
-            return file.read()
+        # Captured once, so every stage of an ingest sees the same snapshot of the file.
+        if self._content is None:
+            self._content = read_note_content(self.path)
+        return self._content
 
     @property
-    def embedding(self) -> List[float]:
+    def embedding(self) -> array:
         return self._embedding
 
     @property
@@ -182,12 +307,23 @@ class Note:
     def tags(self) -> Dict[str, List[Link]]:
         return self._tags
 
+    @property
+    def aliases(self) -> Dict[str, List[Link]]:
+        return self._aliases
+
+    @property
+    def anchors(self) -> AnchorIndex:
+        return self._anchors
+
     @property
     def modified_time(self) -> datetime:
         return self._modified_time
 
     def add_tag(self, tag: Tag, link: Link) -> None:
-        self._tags[tag].append(link)
+        self._tags[sys.intern(tag)].append(link)
+
+    def add_alias(self, alias: Alias, link: Link) -> None:
+        self._aliases[alias].append(link)
 
     def add_outgoing_chunk_link(self, link: Link) -> None:
         self._outgoing_chunk_links.append(link)
@@ -197,7 +333,10 @@ class Note:
 
     def set_embedding(self, vectorizer) -> None:
         # Handle how we want long note (more than x char) to be embedded.
-        self._embedding = vectorizer.embed_query(self.content)
+        self._embedding = as_embedding(vectorizer.embed_query(self.content))
+
+    def set_embedding_vector(self, vector: Iterable[float]) -> None:
+        self._embedding = as_embedding(vector)
 
     def add_split(self, split: Split) -> None:
         self._splits.append(split)
@@ -205,6 +344,9 @@ class Note:
     def set_modified_time(self, time):
         self._modified_time = time
 
+    def set_anchors(self, anchors: AnchorIndex) -> None:
+        self._anchors = anchors
+
 
 class GraphEventHandler(ABC):
     pass
@@ -215,6 +357,11 @@ class NoteSplitter(ABC):
     def split_string(self, note_content: str) -> List[str]:
         return
 
+    @property
+    def signature(self) -> str:
+        # Identifies the splitter and its settings, anything cached from its output is keyed on this.
+        return type(self).__name__
+
 
 class NoSplitting(NoteSplitter):
     def split_string(self, note_content: str) -> List[str]:
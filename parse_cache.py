@@ -0,0 +1,195 @@
+from array import array
+import hashlib
+import json
+import logging
+import mmap
+import os
+from pathlib import Path
+import struct
+import tempfile
+from typing import Any, Dict, List, Optional
+
+from world_graph.objects import EMBEDDING_TYPECODE, AnchorIndex, Link, Note, NoteSplitter, ObsidianLink, Split
+
+cache_log = logging.getLogger("rich_logger")
+
+# Bump whenever serialize_obsidian_note changes what it produces, every older entry is then ignored.
+PARSER_VERSION = 3
+
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "world_graph" / "parse"
+
+# Entry layout: magic, format version, header length, JSON header, padding to 4 bytes, float32 rows
+_MAGIC = b"WGPC"
+_PREAMBLE = struct.Struct("<4sHI")
+_FORMAT_VERSION = 1
+
+
+def content_hash(file_contents: str) -> str:
+    return hashlib.blake2b(file_contents.encode("utf-8"), digest_size=20).hexdigest()
+
+
+def embedder_signature(embedder) -> Optional[str]:
+    if embedder is None:
+        return None
+    return getattr(embedder, "model", None) or type(embedder).__name__
+
+
+class ParseCache:
+    """
+    Persistent cache of serialized notes, keyed on the file contents and the parser/splitter version.
+
+    Each entry is one file holding a small JSON header (tags, links, split offsets) followed by a
+    packed float32 block with the note and split embeddings. Entries are read through mmap, so a
+    rebuild over unchanged files only touches the header and the embedding bytes it needs.
+    """
+
+    def __init__(self, directory: Path = DEFAULT_CACHE_DIR):
+        self._directory = Path(directory)
+        self._directory.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def directory(self) -> Path:
+        return self._directory
+
+    def key_for(self, file_contents: str, splitter: NoteSplitter) -> str:
+        parser_hash = hashlib.blake2b(f"{PARSER_VERSION}:{splitter.signature}".encode("utf-8"), digest_size=8).hexdigest()
+        return f"{content_hash(file_contents)}-{parser_hash}"
+
+    def _entry_path(self, key: str) -> Path:
+        return self._directory / key[:2] / f"{key}.wgpc"
+
+    def load(self, key: str, path: Path, file_contents: str, embedding_model: Optional[str] = None) -> Optional[Note]:
+        """
+        Rebuilds the Note for `path` from the cache entry, or returns None on a miss.
+
+        Embeddings are only restored when they were produced by `embedding_model`; otherwise the
+        returned Note has none and the caller is expected to embed and store it again.
+        """
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, mode="rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                magic, version, header_len = _PREAMBLE.unpack_from(mapped, 0)
+                if magic != _MAGIC or version != _FORMAT_VERSION:
+                    cache_log.debug(f"Ignoring parse cache entry {entry_path.name} with unknown format.")
+                    return None
+                header = json.loads(mapped[_PREAMBLE.size : _PREAMBLE.size + header_len])
+
+                vectors = None
+                if embedding_model is not None and header["embedding_model"] == embedding_model:
+                    vectors = array(EMBEDDING_TYPECODE)
+                    vectors.frombytes(mapped[_embedding_offset(header_len) :])
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, struct.error) as e:
+            cache_log.warning(f"Unreadable parse cache entry {entry_path}: {e}")
+            return None
+
+        return _note_from_header(path, file_contents, header, vectors)
+
+    def store(self, key: str, note: Note, embedding_model: Optional[str] = None) -> None:
+        header = _note_to_header(note, embedding_model)
+        header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+        padding = _embedding_offset(len(header_bytes)) - _PREAMBLE.size - len(header_bytes)
+
+        entry_path = self._entry_path(key)
+        entry_path.parent.mkdir(parents=True, exist_ok=True)
+        # Write then rename, so a concurrent reader never maps a half written entry
+        with tempfile.NamedTemporaryFile(mode="wb", dir=entry_path.parent, delete=False) as file:
+            file.write(_PREAMBLE.pack(_MAGIC, _FORMAT_VERSION, len(header_bytes)))
+            file.write(header_bytes)
+            file.write(b"\0" * padding)
+            if header["embedding_model"] is not None:
+                file.write(note.embedding.tobytes())
+                for split in note.splits:
+                    file.write(split.embedding.tobytes())
+        os.replace(file.name, entry_path)
+
+    def clear(self) -> int:
+        removed = 0
+        for entry_path in self._directory.rglob("*.wgpc"):
+            entry_path.unlink(missing_ok=True)
+            removed += 1
+        return removed
+
+
+def _embedding_offset(header_len: int) -> int:
+    end = _PREAMBLE.size + header_len
+    return end + (-end % 4)
+
+
+def _link_kinds(tag_links: Dict[str, List[Link]]) -> Dict[str, List[str]]:
+    return {tag: [link.type for link in links] for tag, links in tag_links.items()}
+
+
+def _link_to_header(link: ObsidianLink) -> List[Any]:
+    return [link.format_type, str(link.target), link.display_text, link.headers, link.block_hash]
+
+
+def _link_from_header(fields: List[Any]) -> ObsidianLink:
+    format_type, target, display_text, headers, block_hash = fields
+    return ObsidianLink(format_type, target=Path(target), display_text=display_text, headers=headers, block_hash=block_hash)
+
+
+def _note_to_header(note: Note, embedding_model: Optional[str]) -> Dict[str, Any]:
+    has_embeddings = embedding_model is not None and len(note.embedding) > 0
+    splits = []
+    for split in note.splits:
+        splits.append(
+            {
+                "span": split.span,
+                "content": None if split.span else split.content,
+                "tags": _link_kinds(split.tags),
+                "links": [_link_to_header(link) for link in split.outgoing_links],
+            }
+        )
+
+    return {
+        "tags": _link_kinds(note.tags),
+        "aliases": _link_kinds(note.aliases),
+        "anchors": note.anchors.to_dict(),
+        "splits": splits,
+        "embedding_model": embedding_model if has_embeddings else None,
+        "dimension": len(note.embedding) if has_embeddings else 0,
+    }
+
+
+def _note_from_header(path: Path, file_contents: str, header: Dict[str, Any], vectors: Optional[array]) -> Note:
+    note = Note(path, content=file_contents)
+    note.set_anchors(AnchorIndex.from_dict(header["anchors"]))
+    dimension = header["dimension"]
+    if vectors is not None and len(vectors) != dimension * (len(header["splits"]) + 1):
+        cache_log.warning(f"Parse cache entry for {path.name} has a truncated embedding block, ignoring its embeddings.")
+        vectors = None
+
+    for tag, kinds in header["tags"].items():
+        for kind in kinds:
+            note.add_tag(tag, Link.of(kind))
+
+    for alias, kinds in header["aliases"].items():
+        for kind in kinds:
+            note.add_alias(alias, Link.of(kind))
+
+    for chunk_idx, fields in enumerate(header["splits"]):
+        span = fields["span"]
+        split = Split.from_span(chunk_idx, file_contents, tuple(span)) if span else Split(chunk_idx, fields["content"])
+
+        for tag, kinds in fields["tags"].items():
+            for kind in kinds:
+                split.add_tag(tag, Link.of(kind))
+
+        for link_fields in fields["links"]:
+            wikilink = _link_from_header(link_fields)
+            if wikilink.is_link_to_chunk():
+                note.add_outgoing_chunk_link(wikilink)
+                split.add_outgoing_chunk_link(wikilink)
+            note.add_outgoing_note_link(wikilink)
+            split.add_outgoing_note_link(wikilink)
+
+        if vectors is not None:
+            row = (chunk_idx + 1) * dimension
+            split.set_embedding_vector(vectors[row : row + dimension])
+        note.add_split(split)
+
+    if vectors is not None:
+        note.set_embedding_vector(vectors[:dimension])
+    return note
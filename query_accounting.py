@@ -0,0 +1,170 @@
+from collections import Counter, deque
+from contextlib import contextmanager
+import logging
+from pathlib import Path
+import threading
+import time
+import traceback
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from neomodel import db
+
+from world_graph.metrics import METRICS
+
+accounting_log = logging.getLogger(__name__)
+
+DEFAULT_QUERY_BUDGET = 50
+
+_PACKAGE_DIR = Path(__file__).resolve().parent
+_THIS_FILE = Path(__file__).resolve()
+
+
+class EventQueryProfile:
+    """
+    The Cypher round trips issued while handling one file event.
+
+    `seconds` is the round-trip time seen by the client, neomodel does not hand back the server's
+    result summary. `bytes` is an estimate of the parameters sent plus the rows received.
+    """
+
+    __slots__ = ("event_type", "path", "queries", "seconds", "rows", "bytes", "call_sites")
+
+    def __init__(self, event_type: str, path: str):
+        self.event_type = event_type
+        self.path = path
+        self.queries = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.bytes = 0
+        self.call_sites: Counter = Counter()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "event_type": self.event_type,
+            "path": self.path,
+            "queries": self.queries,
+            "seconds": self.seconds,
+            "rows": self.rows,
+            "bytes": self.bytes,
+            "call_sites": dict(self.call_sites.most_common()),
+        }
+
+
+class QueryAccountant:
+    """
+    Counts every `neomodel.db.cypher_query` round trip and attributes it to the file event being handled.
+
+    `install` wraps `db.cypher_query` once for the process. Events are opened with `event`; queries
+    made by nested handler calls (on_modified running on_deleted then on_created) fold into the
+    outermost event. An event issuing more than `query_budget` queries is logged with the call
+    sites in this package responsible for them, the usual sign of an N+1 pattern.
+    """
+
+    def __init__(self, query_budget: int = DEFAULT_QUERY_BUDGET, history: int = 100):
+        self._query_budget = query_budget
+        self._local = threading.local()
+        self._original_cypher_query = None
+        self._profiles: Deque[EventQueryProfile] = deque(maxlen=history)
+
+    @property
+    def query_budget(self) -> int:
+        return self._query_budget
+
+    @property
+    def recent_profiles(self) -> List[EventQueryProfile]:
+        return list(self._profiles)
+
+    def install(self) -> None:
+        if self._original_cypher_query is not None:
+            return
+        self._original_cypher_query = db.cypher_query
+        accountant = self
+
+        def cypher_query(query, params=None, *args, **kwargs):
+            start_time = time.perf_counter()
+            results, meta = accountant._original_cypher_query(query, params, *args, **kwargs)
+            accountant._record(time.perf_counter() - start_time, params, results)
+            return results, meta
+
+        db.cypher_query = cypher_query
+
+    def uninstall(self) -> None:
+        if self._original_cypher_query is None:
+            return
+        db.cypher_query = self._original_cypher_query
+        self._original_cypher_query = None
+
+    @contextmanager
+    def event(self, event_type: str, path: str = ""):
+        if getattr(self._local, "profile", None) is not None:
+            yield self._local.profile
+            return
+
+        profile = EventQueryProfile(event_type, str(path))
+        self._local.profile = profile
+        try:
+            yield profile
+        finally:
+            self._local.profile = None
+            self._finish(profile)
+
+    def _record(self, elapsed: float, params: Optional[Dict], results: List) -> None:
+        profile = getattr(self._local, "profile", None)
+        event_type = profile.event_type if profile else "none"
+        rows = len(results) if results else 0
+        size = _estimate_size(params) + _estimate_size(results)
+
+        METRICS.inc("cypher_queries_total", event_type=event_type)
+        METRICS.inc("cypher_rows_total", rows, event_type=event_type)
+        METRICS.inc("cypher_bytes_total", size, event_type=event_type)
+        METRICS.observe("cypher_seconds", elapsed, event_type=event_type)
+
+        if profile is None:
+            return
+        profile.queries += 1
+        profile.seconds += elapsed
+        profile.rows += rows
+        profile.bytes += size
+        profile.call_sites[_call_site()] += 1
+
+    def _finish(self, profile: EventQueryProfile) -> None:
+        self._profiles.append(profile)
+        if profile.queries <= self._query_budget:
+            accounting_log.debug(f"{profile.event_type} {Path(profile.path).name}: {profile.queries} queries in {round(profile.seconds, 4)} seconds.")
+            return
+
+        METRICS.inc("query_budget_exceeded_total", event_type=profile.event_type)
+        sites = "\n".join(f"    {count:>5} x {site}" for site, count in profile.call_sites.most_common(5))
+        accounting_log.warning(
+            f"{profile.event_type} {Path(profile.path).name} issued {profile.queries} queries (budget {self._query_budget}), "
+            f"{profile.rows} rows, ~{profile.bytes} bytes, {round(profile.seconds, 4)} seconds. Top call sites:\n{sites}"
+        )
+
+
+def _call_site() -> str:
+    # The innermost frame in this package outside of the accountant, i.e. the line that triggered the query
+    for frame in reversed(traceback.extract_stack(limit=40)):
+        frame_path = Path(frame.filename).resolve()
+        if frame_path.parent == _PACKAGE_DIR and frame_path != _THIS_FILE:
+            return f"{frame_path.name}:{frame.lineno} {frame.name}"
+    return "<outside world_graph>"
+
+
+def _estimate_size(value: Any, depth: int = 0) -> int:
+    # Rough wire size, close enough to spot a query shipping embeddings it did not need
+    if value is None or depth > 6:
+        return 1
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, (int, float, bool)):
+        return 8
+    if isinstance(value, dict):
+        return sum(len(str(k)) + _estimate_size(v, depth + 1) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        if value and isinstance(value[0], float):
+            return 8 * len(value)
+        return sum(_estimate_size(item, depth + 1) for item in value)
+    properties = getattr(value, "__properties__", None)
+    if isinstance(properties, dict):
+        return _estimate_size(properties, depth + 1)
+    return 16
@@ -1,33 +1,85 @@
+from collections import OrderedDict
 import datetime
+import hashlib
+import math
 from urllib.parse import quote
 import random
 from pathlib import Path
-from typing import Any, Callable, Dict, List, Optional
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
 import logging
 
-from joblib import Parallel, delayed, parallel_config
-
-from tqdm import tqdm
-from rich.logging import RichHandler
-
+from world_graph.change_detection import scan_vault
 from world_graph.chunking import MarkdownThenNLTKSentWithLinkMasking
 import world_graph.note_parsing as np
-from world_graph.utils import time_function
+from world_graph.parse_cache import ParseCache, embedder_signature
+from world_graph.metrics import METRICS, size_bucket
+from world_graph.utils import iter_note_windows, read_note_content, time_function
 
 from world_graph.objects import GraphEventHandler, Link, Note, NoteSplitter, NoSplitting, Split
 
-logging.basicConfig(level=logging.WARNING, format="%(message)", datefmt="%X", handlers=[RichHandler(rich_tracebacks=True)])
-
 file_log = logging.getLogger("rich_logger")
 
+# Notes at least this many bytes are memory-mapped when read, None to always read normally.
+LARGE_NOTE_MMAP_THRESHOLD = 8 * 1024 * 1024
+
+# Notes serialized together by sync_database_with_notes, their split texts are deduplicated before embedding.
+EMBEDDING_BATCH_NOTES = 16
+# Vectors of the most recently embedded distinct texts kept for later notes, e.g. templates shared across live events.
+RECENT_EMBEDDINGS_SIZE = 2048
+
+# Notes at least this many bytes are streamed window by window, see GraphDog.stream_obsidian_note. None to never stream.
+STREAMING_THRESHOLD = 32 * 1024 * 1024
+# Memory a streamed note may take while being parsed and embedded, half for its text window and half for vectors
+DEFAULT_MEMORY_CEILING = 256 * 1024 * 1024
+# Bytes held per character of a window: the window, its frontmatter-less and link-masked copies, the splitter's Documents and the splits
+WINDOW_MEMORY_FACTOR = 8
+# Bytes held per vector element between the embedder's answer and the split's array, a Python float and its list slot
+VECTOR_ELEMENT_BYTES = 32
+ESTIMATED_EMBEDDING_DIMENSION = 1024
+MIN_WINDOW_SIZE = 64 * 1024
+
+
+class SplitScan:
+    # Header path and fenced code state carried from one split to the next, and across a streamed note's windows
+    __slots__ = ("header_path", "in_code_block")
+
+    def __init__(self):
+        self.header_path = []  # (level, text) of the headers enclosing the current line
+        self.in_code_block = False
+
+
+def normalize_embedding_text(text: str) -> str:
+    return " ".join(text.split())
+
 
 class GraphDog:
-    def __init__(self, path_to_notes, event_handler: GraphEventHandler, splitter: Optional[NoteSplitter] = None, embedder = None):
-        self._path_to_notes = path_to_notes
+    def __init__(
+        self,
+        path_to_notes,
+        event_handler: GraphEventHandler,
+        splitter: Optional[NoteSplitter] = None,
+        embedder=None,
+        mmap_threshold: Optional[int] = LARGE_NOTE_MMAP_THRESHOLD,
+        parse_cache: Optional[ParseCache] = None,
+        stream_threshold: Optional[int] = STREAMING_THRESHOLD,
+        memory_ceiling: int = DEFAULT_MEMORY_CEILING,
+        recent_embeddings_size: int = RECENT_EMBEDDINGS_SIZE,
+    ):
+        self._path_to_notes = Path(path_to_notes)
         self._event_handler = event_handler
         self._splitter = splitter if splitter else NoSplitting()
         self._embedder = embedder
+        self._mmap_threshold = mmap_threshold
+        self._parse_cache = parse_cache
+        self._stream_threshold = stream_threshold
+        self._memory_ceiling = memory_ceiling
+        # Digest of a normalized text to its vector, for the embedder in _recent_embedder only
+        self._recent_embeddings: OrderedDict = OrderedDict()
+        self._recent_embeddings_size = recent_embeddings_size
+        self._recent_embedder = None
+        self._recent_lock = threading.Lock()
 
     @property
     def path_to_notes(self) -> Path:
@@ -45,8 +97,18 @@ class GraphDog:
     def splitter(self) -> NoSplitting:
         return self._splitter
 
+    @property
+    def embedder(self):
+        return self._embedder
+
+    def set_embedder(self, embedder) -> None:
+        # Notes serialized from now on are embedded, and looked up in the parse cache, with this model
+        self._embedder = embedder
+
     @time_function
-    def sync_database_with_notes(self, callable_override: Optional[Callable] = None):
+    def sync_database_with_notes(self, callable_override: Optional[Callable] = None, batch_size: int = EMBEDDING_BATCH_NOTES):
+        from joblib import Parallel, delayed, parallel_config
+
         job_number = 1
         parallelism_type = "threading"  # loky
 
@@ -55,78 +117,293 @@ class GraphDog:
         random.seed(2342)
 
         note_path = Path(self._path_to_notes)
-        note_tree = note_path.rglob("*" + note_ext_type)
-
-        note_paths = [path for path in note_tree]
+        note_paths = sorted(scan_vault(note_path, note_ext_type).paths())
         sample_size = sample_size if sample_size else len(note_paths)
         shuffled_sample_notes = random.sample(note_paths, sample_size)
 
-        apply_func = callable_override if callable_override else self.serialize_obsidian_note
         with parallel_config(backend=parallelism_type, n_jobs=job_number):
             # results = list(tqdm(Parallel(return_as="generator")(delayed(self.serialize_obsidian_note)(i) for i in shuffled_sample_notes)))
-            results = list(Parallel(return_as="generator")(delayed(apply_func)(i) for i in shuffled_sample_notes))
+            if callable_override:
+                results = list(Parallel(return_as="generator")(delayed(callable_override)(i) for i in shuffled_sample_notes))
+            else:
+                # Notes are serialized in batches so repeated text is embedded once per batch
+                batches = [shuffled_sample_notes[i : i + batch_size] for i in range(0, len(shuffled_sample_notes), batch_size)]
+                results = [note for batch in Parallel(return_as="generator")(delayed(self.serialize_obsidian_notes)(b) for b in batches) for note in batch]
 
         file_log.info(f"{len(results)=}")
         return results
         # file_log.info(results)
 
-    def serialize_obsidian_note(self, file_path: Path) -> Note:
-        current_note = Note(file_path)
+    def serialize_obsidian_note(self, file_path: Path, embedder=None) -> Note:
+        return self.serialize_obsidian_notes([file_path], embedder)[0]
+
+    def serialize_obsidian_notes(self, file_paths: List[Path], embedder=None) -> List[Note]:
+        """
+        Parses, or loads from the parse cache, each note, then embeds all of those still lacking
+        embeddings together through `embed_notes`. With `embedder`, that model is used instead of
+        the GraphDog's, e.g. the one an event captured before a model switch.
+        """
+        embedder = embedder if embedder is not None else self._embedder
+        embedding_model = embedder_signature(embedder)
+        notes, cache_keys, to_store = [], [], []
+        for file_path in file_paths:
+            with METRICS.stage("read"):
+                file_content = read_note_content(file_path, mmap_threshold=self._mmap_threshold)
+
+            cache_key = self._parse_cache.key_for(file_content, self.splitter) if self._parse_cache else None
+            current_note = self._parse_cache.load(cache_key, file_path, file_content, embedding_model) if cache_key else None
+            is_cache_hit = current_note is not None
+            if cache_key:
+                METRICS.inc("parse_cache_lookups_total", result="hit" if is_cache_hit else "miss")
+            if not is_cache_hit:
+                current_note = self.parse_obsidian_note(file_path, file_content)
+
+            # Add back in the additional Properties we'd like to persist on the Note Object
+            added_fm_props = self.add_file_type_properties(file_path)
+            current_note.set_modified_time(added_fm_props["modified_time"])
+
+            notes.append(current_note)
+            cache_keys.append(cache_key)
+            to_store.append(cache_key is not None and not is_cache_hit)
+
+        unembedded = [idx for idx, note in enumerate(notes) if embedder is not None and len(note.embedding) == 0]
+        if unembedded:
+            size = size_bucket(sum(len(notes[idx].content) for idx in unembedded))
+            with METRICS.stage("embed", size=size):
+                self.embed_notes([notes[idx] for idx in unembedded], embedder)
+            for idx in unembedded:
+                to_store[idx] = cache_keys[idx] is not None
+
+        for note, cache_key, store in zip(notes, cache_keys, to_store):
+            if store:
+                self._parse_cache.store(cache_key, note, embedding_model)
+        return notes
+
+    def parse_obsidian_note(self, file_path: Path, file_content: str) -> Note:
+        current_note = Note(file_path, content=file_content)
+        size = size_bucket(len(file_content))
+
+        idx = self.parse_frontmatter(current_note, file_content)
+        note_content = file_content[idx:]
+
+        with METRICS.stage("chunk", size=size):
+            splits = self.splitter.split_string(note_content)
+            spans = np.locate_chunk_spans(file_content, splits, start=idx)
 
-        with open(file_path, mode="r", encoding="utf-8") as file:
-            file_content = file.read()
+        scan = SplitScan()
+        for chunk_idx, (chunk, span) in enumerate(zip(splits, spans)):
+            # Prefer a view into the note's buffer, only keeping a copy when the splitter rewrote the text
+            current_split = Split.from_span(chunk_idx, file_content, span) if span else Split(chunk_idx, chunk)
+            self.scan_split(current_note, current_split, chunk, scan)
+            current_note.add_split(current_split)
 
-        frontmatter_props = np.get_note_frontmatter(file_content)
-        serialized_fm_props = self.special_properties_handler(frontmatter_props)
+        return current_note
+
+    def parse_frontmatter(self, current_note: Note, file_content: str) -> int:
+        # Adds the frontmatter's tags and aliases to the note, returns where its body starts
+        with METRICS.stage("frontmatter", size=size_bucket(len(file_content))):
+            frontmatter_props = np.get_note_frontmatter(file_content)
+            serialized_fm_props = self.special_properties_handler(frontmatter_props)
         # current_tags = set(serialized_fm_props["tags"]) if "tags" in serialized_fm_props else {}
 
         file_log.debug(f"{serialized_fm_props=}")
 
         for tag in serialized_fm_props.get("tags", []):
-            current_note.add_tag(tag, Link("frontmatter"))
+            current_note.add_tag(tag, Link.of("frontmatter"))
 
         for alias in serialized_fm_props.get("aliases", []):
-            current_note.add_alias(alias, Link("frontmatter"))
-
-        # Add back in the additional Properties we'd like to persist on the Note Object
-        added_fm_props = self.add_file_type_properties(file_path)
-        current_note.set_modified_time(added_fm_props["modified_time"])
-
-        idx = np.where_does_frontmatter_stop(file_content)
-        note_content = file_content[idx:]
-
-        splits = self.splitter.split_string(note_content)
-
-        for chunk_idx, chunk in enumerate(splits):
-            current_split = Split(chunk_idx, chunk)
-            if self._embedder:
-                current_split.set_embedding(self._embedder)
-
-            for line in chunk.split("\n"):
-                for tag_it in np.get_tags_from_line(line):
-                    # current_tags.add(tag_it)
-
-                    current_note.add_tag(tag_it, Link("inline"))
-                    current_split.add_tag(tag_it, Link("inline"))
-
-                links = np.get_wikilinks(line, file_path)
-
-                for wikilink in links:
-                    if wikilink.is_link_to_chunk():
-                        current_note.add_outgoing_chunk_link(wikilink)
-                        current_split.add_outgoing_chunk_link(wikilink)
-
-                    current_note.add_outgoing_note_link(wikilink)
-                    current_split.add_outgoing_note_link(wikilink)
-
-            current_note.add_split(current_split)
-
-        if self._embedder:
-            current_note.set_embedding(self._embedder)
-        return current_note
+            current_note.add_alias(alias, Link.of("frontmatter"))
+
+        return np.where_does_frontmatter_stop(file_content)
+
+    def scan_split(self, current_note: Note, current_split: Split, chunk: str, scan: SplitScan) -> None:
+        # Adds the headers, block ids, tags and links found in one split's lines to the split and its note
+        for line in chunk.split("\n"):
+            if line.lstrip().startswith(("```", "~~~")):
+                scan.in_code_block = not scan.in_code_block
+
+            header = None if scan.in_code_block else np.get_header_from_line(line)
+            if header:
+                level, text = header
+                scan.header_path = [h for h in scan.header_path if h[0] < level] + [header]
+                current_note.anchors.add_header([h[1] for h in scan.header_path], current_split.count)
+
+            block_id = None if scan.in_code_block else np.get_block_id_from_line(line)
+            if block_id:
+                current_note.anchors.add_block(block_id, current_split.count)
+
+            for tag_it in np.get_tags_from_line(line):
+                # current_tags.add(tag_it)
+
+                current_note.add_tag(tag_it, Link.of("inline"))
+                current_split.add_tag(tag_it, Link.of("inline"))
+
+            links = np.get_wikilinks(line, current_note.path)
+
+            for wikilink in links:
+                if wikilink.is_link_to_chunk():
+                    current_note.add_outgoing_chunk_link(wikilink)
+                    current_split.add_outgoing_chunk_link(wikilink)
+
+                current_note.add_outgoing_note_link(wikilink)
+                current_split.add_outgoing_note_link(wikilink)
+
+    def should_stream(self, file_path: Path) -> bool:
+        # Notes past the streaming threshold are ingested through `stream_obsidian_note`
+        if self._stream_threshold is None:
+            return False
+        try:
+            return Path(file_path).stat().st_size >= self._stream_threshold
+        except OSError:
+            return False
+
+    def streaming_budget(self, embedder=None) -> Tuple[int, int]:
+        """
+        Splits the memory ceiling between a streamed note's text and its vectors.
+
+        Returns:
+            Tuple[int, int]: Characters read per window and splits embedded per request
+        """
+        embedder = embedder if embedder is not None else self._embedder
+        dimension = getattr(embedder, "dimension", None) or ESTIMATED_EMBEDDING_DIMENSION
+        window_size = max(MIN_WINDOW_SIZE, self._memory_ceiling // (2 * WINDOW_MEMORY_FACTOR))
+        embedding_batch_size = max(1, self._memory_ceiling // (2 * dimension * VECTOR_ELEMENT_BYTES))
+        return window_size, embedding_batch_size
+
+    def stream_obsidian_note(self, file_path: Path, embedder=None) -> Iterator[Tuple[Note, str, List[Split]]]:
+        """
+        Parses and embeds a note one window of text at a time, windows sized from the memory ceiling.
+
+        Yields the note, the window's text and the window's splits, embedded. The note only gathers
+        what stays small: its tags, aliases, anchors and modified time. Its content stays empty and
+        the splits are not kept, so the caller persists each window before asking for the next.
+        Splits never cross windows and keep counting across them. Once the last window has been
+        consumed the note's embedding is set to the mean of its splits', as a note this size would be
+        cut short by the model anyway. Notes streamed this way bypass the parse cache.
+        """
+        embedder = embedder if embedder is not None else self._embedder
+        window_size, embedding_batch_size = self.streaming_budget(embedder)
+        current_note = Note(file_path, content="")
+        current_note.set_modified_time(self.add_file_type_properties(file_path)["modified_time"])
+
+        scan = SplitScan()
+        split_count = 0
+        vector_sum = None
+        window_idx = -1
+        for window_idx, window in enumerate(iter_note_windows(file_path, window_size)):
+            size = size_bucket(len(window))
+            idx = self.parse_frontmatter(current_note, window) if window_idx == 0 else 0
+
+            with METRICS.stage("chunk", size=size):
+                chunks = self.splitter.split_string(window[idx:])
+                spans = np.locate_chunk_spans(window, chunks, start=idx)
+
+            # Links and tag occurrences are gathered per window, the note only keeps which tags it carries
+            window_note = Note(file_path, content="")
+            window_note.set_anchors(current_note.anchors)
+            splits = []
+            for chunk, span in zip(chunks, spans):
+                current_split = Split.from_span(split_count, window, span) if span else Split(split_count, chunk)
+                self.scan_split(window_note, current_split, chunk, scan)
+                splits.append(current_split)
+                split_count += 1
+            for tag, links in window_note.tags.items():
+                if tag not in current_note.tags:
+                    current_note.add_tag(tag, links[0])
+            del chunks, spans, window_note
+
+            if embedder is not None and splits:
+                with METRICS.stage("embed", size=size):
+                    self.embed_targets(splits, batch_size=embedding_batch_size, embedder=embedder)
+                for current_split in splits:
+                    vector_sum = list(current_split.embedding) if vector_sum is None else [a + b for a, b in zip(vector_sum, current_split.embedding)]
+
+            METRICS.inc("streamed_windows_total")
+            yield current_note, window, splits
+            del window, splits  # Released before the next window is read
+
+        if window_idx == -1:
+            yield current_note, "", []  # An empty file is still one note
+
+        if vector_sum is not None:
+            norm = math.sqrt(sum(v * v for v in vector_sum)) or 1.0
+            current_note.set_embedding_vector([v / norm for v in vector_sum])
+
+    def embed_note(self, note: Note, embedder=None) -> None:
+        self.embed_notes([note], embedder)
+
+    def embed_notes(self, notes: List[Note], embedder=None) -> float:
+        """
+        Embeds every split and note in `notes`, sending each distinct text to the model once.
+
+        Texts are compared after collapsing whitespace, so templates, boilerplate sections and
+        repeated headers shared across the batch cost a single embedding. Texts embedded for
+        recent notes are reused as well, see embed_targets.
+
+        Returns:
+            float: Share of the texts that were not sent to the model, 0.0 when all were
+        """
+        return self.embed_targets([target for note in notes for target in (*note.splits, note)], embedder=embedder)
+
+    def embed_targets(self, targets: List[Any], batch_size: Optional[int] = None, embedder=None) -> float:
+        """
+        Embeds notes or splits, each distinct text once, in requests of at most `batch_size` texts.
+
+        Targets are grouped on their whitespace-collapsed text and the model is sent the original
+        content of one target per group. The vectors of the last `recent_embeddings_size` distinct
+        texts are kept, so a text seen in an earlier event or window is not embedded again.
+        """
+        total = len(targets)
+        if total == 0:
+            return 0.0
+
+        embedder = embedder if embedder is not None else self._embedder
+        targets_by_key: Dict[bytes, List[Any]] = {}
+        for target in targets:
+            key = hashlib.sha1(normalize_embedding_text(target.content).encode("utf-8")).digest()
+            targets_by_key.setdefault(key, []).append(target)
+
+        with self._recent_lock:
+            if self._recent_embedder is not embedder:
+                self._recent_embeddings.clear()
+                self._recent_embedder = embedder
+            recent = {key: self._recent_embeddings[key] for key in targets_by_key if key in self._recent_embeddings}
+            for key in recent:
+                self._recent_embeddings.move_to_end(key)
+        for key, vector in recent.items():
+            for target in targets_by_key[key]:
+                target.set_embedding_vector(vector)
+
+        missing_keys = [key for key in targets_by_key if key not in recent]
+        batch_size = batch_size if batch_size else max(len(missing_keys), 1)
+        for start in range(0, len(missing_keys), batch_size):
+            batch = missing_keys[start : start + batch_size]
+            vectors = embedder.embed_documents([targets_by_key[key][0].content for key in batch])
+            for key, vector in zip(batch, vectors):
+                for target in targets_by_key[key]:
+                    target.set_embedding_vector(vector)
+            self._remember_embeddings({key: targets_by_key[key][0].embedding for key in batch}, embedder)
+
+        METRICS.inc("embedding_inputs_total", total)
+        METRICS.inc("embedding_unique_inputs_total", len(targets_by_key))
+        METRICS.inc("embedding_recent_hits_total", len(recent))
+        METRICS.inc("embedding_model_inputs_total", len(missing_keys))
+        skipped_ratio = 1 - len(missing_keys) / total
+        file_log.debug(f"Embedded {total} texts as {len(targets_by_key)} unique, {len(recent)} of them reused ({round(skipped_ratio * 100, 1)}% not sent).")
+        return skipped_ratio
+
+    def _remember_embeddings(self, vectors: Dict[bytes, Any], embedder) -> None:
+        with self._recent_lock:
+            if self._recent_embedder is not embedder or self._recent_embeddings_size <= 0:
+                return
+            self._recent_embeddings.update(vectors)
+            for key in vectors:
+                self._recent_embeddings.move_to_end(key)
+            while len(self._recent_embeddings) > self._recent_embeddings_size:
+                self._recent_embeddings.popitem(last=False)
 
     def build_fm_tag_relations(self, tags: List[str]) -> Dict[str, List[Link]]:
-        return {tag: [Link("frontmatter")] for tag in tags}
+        return {tag: [Link.of("frontmatter")] for tag in tags}
 
     def special_properties_handler(self, fm_properties: Dict[str, Any]) -> Dict[str, Any]:
         key_map = {}
@@ -136,6 +413,7 @@ class GraphDog:
         content_map = {}
         content_map["id"] = lambda x: f"OBS_{x}"
         content_map["tags"] = np.extract_tags_from_yaml
+        content_map["aliases"] = np.extract_aliases_from_yaml
 
         serialized_properties = {}
         for name, contents in fm_properties.items():
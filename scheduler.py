@@ -0,0 +1,198 @@
+from contextlib import contextmanager
+from enum import IntEnum
+import logging
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from neomodel import db
+
+from world_graph.metrics import METRICS
+
+if TYPE_CHECKING:
+    from langchain_core.embeddings.embeddings import Embeddings
+
+scheduler_log = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    # Lower values are served first
+    INTERACTIVE = 0
+    LIVE_EDIT = 1
+    BACKGROUND = 2
+
+
+RESOURCES = ("embedding", "graph")
+
+# Concurrent slots per resource and priority class, background work gets the fewest so it can never crowd out a query
+DEFAULT_QUOTAS: Dict[str, Dict[Priority, int]] = {
+    "embedding": {Priority.INTERACTIVE: 4, Priority.LIVE_EDIT: 2, Priority.BACKGROUND: 1},
+    "graph": {Priority.INTERACTIVE: 4, Priority.LIVE_EDIT: 2, Priority.BACKGROUND: 1},
+}
+
+
+class _ResourceGate:
+    __slots__ = ("_name", "_quotas", "_capacity", "_condition", "_in_use", "_waiting")
+
+    def __init__(self, name: str, quotas: Dict[Priority, int], capacity: Optional[int] = None):
+        self._name = name
+        self._quotas = quotas
+        self._capacity = capacity if capacity else sum(quotas.values())
+        self._condition = threading.Condition()
+        self._in_use = {priority: 0 for priority in Priority}
+        self._waiting = {priority: 0 for priority in Priority}
+
+    def acquire(self, priority: Priority) -> float:
+        start_time = time.perf_counter()
+        with self._condition:
+            self._waiting[priority] += 1
+            try:
+                self._condition.wait_for(lambda: self._can_enter(priority))
+            finally:
+                self._waiting[priority] -= 1
+            self._in_use[priority] += 1
+        return time.perf_counter() - start_time
+
+    def release(self, priority: Priority) -> None:
+        with self._condition:
+            self._in_use[priority] -= 1
+            self._condition.notify_all()
+
+    def is_contended_above(self, priority: Priority) -> bool:
+        with self._condition:
+            return any(self._in_use[p] or self._waiting[p] for p in Priority if p < priority)
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        with self._condition:
+            return {p.name.lower(): {"in_use": self._in_use[p], "waiting": self._waiting[p], "quota": self._quotas[p]} for p in Priority}
+
+    def _can_enter(self, priority: Priority) -> bool:
+        if self._in_use[priority] >= self._quotas[priority] or sum(self._in_use.values()) >= self._capacity:
+            return False
+        # Strict priority between waiters, a freed slot goes to the most urgent class first
+        return not any(self._waiting[p] for p in Priority if p < priority)
+
+
+class PriorityScheduler:
+    """
+    Shares the embedding server and the graph connection between interactive queries, live edit
+    events and background reindexing.
+
+    Work runs under the priority set on its thread with `priority`, LIVE_EDIT when none was set,
+    so the watchdog observer needs no changes. Each resource hands out at most its per-class quota
+    of concurrent slots, and a freed slot always goes to the most urgent waiting class. Background
+    loops call `checkpoint` between items to step aside entirely while more urgent work is in
+    flight or queued.
+
+    Args:
+        quotas: Concurrent slots per resource and priority, DEFAULT_QUOTAS if None
+        capacities: Total slots per resource across classes, the sum of its quotas if missing
+    """
+
+    def __init__(self, quotas: Optional[Dict[str, Dict[Priority, int]]] = None, capacities: Optional[Dict[str, int]] = None):
+        quotas = quotas if quotas else DEFAULT_QUOTAS
+        capacities = capacities if capacities else {}
+        self._gates = {resource: _ResourceGate(resource, quotas[resource], capacities.get(resource)) for resource in RESOURCES}
+        self._local = threading.local()
+        self._original_cypher_query = None
+
+    @property
+    def current_priority(self) -> Priority:
+        return getattr(self._local, "priority", Priority.LIVE_EDIT)
+
+    @contextmanager
+    def priority(self, priority: Priority):
+        previous = getattr(self._local, "priority", None)
+        self._local.priority = priority
+        try:
+            yield
+        finally:
+            if previous is None:
+                del self._local.priority
+            else:
+                self._local.priority = previous
+
+    @contextmanager
+    def slot(self, resource: str):
+        # Reentrant per thread, a call made while already holding the resource does not queue again
+        held: Dict[str, int] = self._local.__dict__.setdefault("held", {})
+        if held.get(resource):
+            held[resource] += 1
+            try:
+                yield
+            finally:
+                held[resource] -= 1
+            return
+
+        priority = self.current_priority
+        gate = self._gates[resource]
+        waited = gate.acquire(priority)
+        METRICS.observe("scheduler_wait_seconds", waited, resource=resource, priority=priority.name.lower())
+        held[resource] = 1
+        try:
+            yield
+        finally:
+            held[resource] = 0
+            gate.release(priority)
+
+    def checkpoint(self, poll_interval: float = 0.01, max_wait: float = 5.0) -> None:
+        """
+        Blocks a lower priority thread while more urgent work holds or waits for any resource.
+
+        `max_wait` bounds the pause, so a constant stream of queries slows background work down
+        rather than starving it.
+        """
+        priority = self.current_priority
+        if priority == Priority.INTERACTIVE:
+            return
+        deadline = time.monotonic() + max_wait
+        while any(gate.is_contended_above(priority) for gate in self._gates.values()) and time.monotonic() < deadline:
+            time.sleep(poll_interval)
+
+    def install_graph(self) -> None:
+        """
+        Routes every `neomodel.db.cypher_query` through the graph resource's slots.
+        """
+        if self._original_cypher_query is not None:
+            return
+        self._original_cypher_query = db.cypher_query
+        scheduler = self
+
+        def cypher_query(*args, **kwargs):
+            with scheduler.slot("graph"):
+                return scheduler._original_cypher_query(*args, **kwargs)
+
+        db.cypher_query = cypher_query
+
+    def uninstall_graph(self) -> None:
+        if self._original_cypher_query is None:
+            return
+        db.cypher_query = self._original_cypher_query
+        self._original_cypher_query = None
+
+    def snapshot(self) -> Dict[str, Dict]:
+        return {resource: gate.snapshot() for resource, gate in self._gates.items()}
+
+
+class ScheduledEmbeddings:
+    """
+    Embeddings whose calls each take a slot of the scheduler's embedding resource.
+    """
+
+    def __init__(self, embeddings: "Embeddings", scheduler: PriorityScheduler, dimension: Optional[int] = None):
+        self._embeddings = embeddings
+        self._scheduler = scheduler
+        self.model = getattr(embeddings, "model", embeddings.__class__.__name__)
+        self.dimension = dimension if dimension else getattr(embeddings, "dimension", None)
+
+    @property
+    def embeddings(self) -> "Embeddings":
+        return self._embeddings
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with self._scheduler.slot("embedding"):
+            return self._embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        with self._scheduler.slot("embedding"):
+            return self._embeddings.embed_query(text)
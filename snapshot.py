@@ -0,0 +1,563 @@
+from array import array
+import argparse
+from datetime import datetime, timezone
+import hashlib
+import heapq
+import json
+import logging
+import math
+import mmap
+import os
+from pathlib import Path
+import shutil
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+import uuid
+
+from neomodel import db
+
+from world_graph.change_detection import DEFAULT_SNAPSHOT_PATH
+from world_graph.metrics import METRICS
+from world_graph.neo_model_schema import LEGACY_EMBEDDING_PROPERTY, EmbeddingSpace, folder_hierarchy
+from world_graph.objects import normalize_name
+
+snapshot_log = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+VAULT_SNAPSHOT_NAME = "vault_snapshot.json"
+EXPORT_BATCH_SIZE = 500
+RECORD_SETS = ("notes", "splits")
+
+_NOTES_PAGE_CYPHER = """
+MATCH (n:FilledNeoNote) WHERE n.path > $after
+WITH n ORDER BY n.path LIMIT $batch_size
+RETURN elementId(n), n.path, n.name, n.content, n.modified_time, n.anchor_index, n.in_degree, n.centrality, n[$property],
+    [(n)-[:HAS_ALIAS]->(alias:Alias) | alias.name],
+    [(n)-[:TAGGED]->(tag:Tag) | tag.name],
+    head([(n)-[:IN_FOLDER]->(folder:Folder) | folder.path]),
+    [(n)-[:CONTAIN_SPLIT]->(split:NeoSplit) | [split.count, split.name, split.content, split[$property], [(split)-[:TAGGED]->(tag:Tag) | tag.name]]]"""
+
+_MENTIONS_CYPHER = """
+MATCH (source:FilledNeoNote)-[link:MENTIONED]->(target:NeoNote)
+RETURN elementId(source), elementId(target), target.name, head(collect(link.chunk_links))"""
+
+_CHUNK_LINKS_CYPHER = """
+MATCH (source:FilledNeoNote)-[:CONTAIN_SPLIT]->(from_split:NeoSplit)-[:MENTIONED_SPLIT]->(to_split:NeoSplit)<-[:CONTAIN_SPLIT]-(target:FilledNeoNote)
+RETURN DISTINCT elementId(source), from_split.count, elementId(target), to_split.count"""
+
+
+def _file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _little_endian(values: array) -> array:
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values
+
+
+class _RecordSetWriter:
+    """
+    One record set of a snapshot: JSON lines with their offsets, and float32 vectors, norms and centrality.
+    """
+
+    def __init__(self, directory: Path, name: str, dimension: int):
+        self._name = name
+        self._dimension = dimension
+        self._records = open(directory / f"{name}.jsonl", "wb")
+        self._offsets = open(directory / f"{name}.offsets", "wb")
+        self._vectors = open(directory / f"{name}.f32", "wb")
+        self._norms = open(directory / f"{name}.norms.f32", "wb")
+        self._centrality = open(directory / f"{name}.centrality.f32", "wb")
+        self._position = 0
+        self.count = 0
+
+    def write(self, record: Dict[str, Any], vector: Optional[List[float]], centrality: Optional[float]) -> int:
+        line = json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n"
+        self._records.write(line)
+        _little_endian(array("Q", [self._position])).tofile(self._offsets)
+        self._position += len(line)
+
+        # A missing vector is stored as zeros with norm 0, which queries skip
+        vector = vector if vector is not None and len(vector) == self._dimension else None
+        _little_endian(array("f", vector if vector else [0.0] * self._dimension)).tofile(self._vectors)
+        _little_endian(array("f", [math.sqrt(sum(v * v for v in vector)) if vector else 0.0])).tofile(self._norms)
+        _little_endian(array("f", [centrality if centrality is not None else 0.0])).tofile(self._centrality)
+        self.count += 1
+        return self.count - 1
+
+    def close(self) -> None:
+        _little_endian(array("Q", [self._position])).tofile(self._offsets)
+        for f in (self._records, self._offsets, self._vectors, self._norms, self._centrality):
+            f.close()
+
+
+def export_snapshot(out_dir, vault_snapshot_path=None, batch_size: int = EXPORT_BATCH_SIZE) -> Dict[str, Any]:
+    """
+    Dumps the graph's notes, splits, links, embeddings and lookup indexes into a snapshot directory.
+
+    The snapshot is written next to `out_dir` and renamed into place once complete, so a reader
+    never sees a partial one. Vectors of the active embedding space are stored as float32.
+
+    Args:
+        out_dir: Snapshot directory, replaced if it exists
+        vault_snapshot_path: ChangeVerifier state to include, restore installs it so a restored node does not ingest the vault again
+        batch_size: Notes read per query
+
+    Returns:
+        The manifest
+    """
+    start_time = time.perf_counter()
+    out_dir = Path(out_dir)
+    tmp_dir = out_dir.with_name(out_dir.name + ".tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    # Copied first, so the restored verifier never believes more than the graph read below holds
+    if vault_snapshot_path and Path(vault_snapshot_path).exists():
+        shutil.copyfile(vault_snapshot_path, tmp_dir / VAULT_SNAPSHOT_NAME)
+
+    # Every read shares one transaction, so notes, mentions and chunk links come from the same state of the graph
+    with db.read_transaction:
+        space = EmbeddingSpace.nodes.first_or_none(state="active")
+        embedding_property = space.property if space else LEGACY_EMBEDDING_PROPERTY
+        dimension = space.dimension if space else None
+        if dimension is None:
+            results, _ = db.cypher_query(f"MATCH (n:FilledNeoNote) WHERE n.{embedding_property} IS NOT NULL RETURN size(n.{embedding_property}) LIMIT 1")
+            dimension = results[0][0] if results else 0
+
+        notes = _RecordSetWriter(tmp_dir, "notes", dimension)
+        splits = _RecordSetWriter(tmp_dir, "splits", dimension)
+        note_index: Dict[str, int] = {}
+        names: Dict[str, List[int]] = {}
+        vault = None
+        try:
+            after = ""
+            while True:
+                rows, _ = db.cypher_query(_NOTES_PAGE_CYPHER, {"after": after, "batch_size": batch_size, "property": embedding_property})
+                for element_id, path, name, content, modified_time, anchor_index, in_degree, centrality, vector, aliases, tags, folder, note_splits in rows:
+                    note_splits = sorted(note_splits, key=lambda split: split[0])
+                    first_split = splits.count
+                    for count, split_name, split_content, split_vector, split_tags in note_splits:
+                        split_record = {"note": notes.count, "count": count, "name": split_name, "content": split_content, "tags": split_tags}
+                        splits.write(split_record, split_vector, centrality)
+
+                    record = {
+                        "path": path,
+                        "name": name,
+                        "content": content,
+                        "content_hash": hashlib.sha256((content or "").encode("utf-8")).hexdigest(),
+                        "modified_time": modified_time,
+                        "anchor_index": json.loads(anchor_index) if isinstance(anchor_index, str) else anchor_index,
+                        "in_degree": in_degree,
+                        "centrality": centrality,
+                        "aliases": aliases,
+                        "tags": tags,
+                        "folder": folder,
+                        "splits": [first_split, len(note_splits)],
+                    }
+                    note_index[element_id] = notes.write(record, vector, centrality)
+                    for key in {normalize_name(name), *(normalize_name(alias) for alias in aliases)}:
+                        names.setdefault(key, []).append(note_index[element_id])
+                    if vault is None and folder is not None:
+                        vault = _vault_root(path, folder)
+                if len(rows) < batch_size:
+                    break
+                after = rows[-1][1]
+        finally:
+            notes.close()
+            splits.close()
+
+        links = {"mentions": [], "dangles": [], "dangle_mentions": [], "chunk_links": []}
+        dropped_links = 0  # Links to or from a note missing from the pages, none unless the graph was written to mid-export
+        dangle_index: Dict[str, int] = {}
+        rows, _ = db.cypher_query(_MENTIONS_CYPHER)
+        for source_id, target_id, target_name, chunk_links in rows:
+            source = note_index.get(source_id)
+            if source is None:
+                dropped_links += 1
+                continue
+            if target_id in note_index:
+                links["mentions"].append([source, note_index[target_id], chunk_links])
+                continue
+            if target_id not in dangle_index:
+                dangle_index[target_id] = len(links["dangles"])
+                links["dangles"].append(target_name)
+            links["dangle_mentions"].append([source, dangle_index[target_id], chunk_links])
+        rows, _ = db.cypher_query(_CHUNK_LINKS_CYPHER)
+        for source_id, source_count, target_id, target_count in rows:
+            if source_id not in note_index or target_id not in note_index:
+                dropped_links += 1
+                continue
+            links["chunk_links"].append([note_index[source_id], source_count, note_index[target_id], target_count])
+
+    if dropped_links:
+        METRICS.inc("snapshot_dropped_links_total", dropped_links)
+        snapshot_log.warning(f"Snapshot dropped {dropped_links} links whose notes were not exported.")
+
+    (tmp_dir / "links.json").write_text(json.dumps(links, separators=(",", ":")))
+    (tmp_dir / "names.json").write_text(json.dumps(names, separators=(",", ":")))
+    manifest = {
+        "version": SNAPSHOT_FORMAT_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(),
+        "vault": str(vault) if vault else None,
+        "model": space.model if space else None,
+        "embedding_property": embedding_property,
+        "dimension": dimension,
+        "counts": {"notes": notes.count, "splits": splits.count, "mentions": len(links["mentions"]), "dangles": len(links["dangles"])},
+        "files": {path.name: _file_sha256(path) for path in sorted(tmp_dir.iterdir())},
+    }
+    (tmp_dir / MANIFEST_NAME).write_text(json.dumps(manifest, indent=2))
+
+    shutil.rmtree(out_dir, ignore_errors=True)
+    tmp_dir.rename(out_dir)
+    METRICS.observe("snapshot_export_seconds", time.perf_counter() - start_time)
+    snapshot_log.info(f"Snapshot of {notes.count} notes and {splits.count} splits written to {out_dir} in {round(time.perf_counter() - start_time, 2)} seconds.")
+    return manifest
+
+
+def _vault_root(path: str, folder: str) -> Path:
+    # The vault is the note's directory minus its vault relative folder
+    parent = Path(path).parent
+    return parent if folder == "" else Path(str(parent)[: -len(folder) - 1])
+
+
+class SnapshotRecord:
+    """
+    A note or split read from a snapshot, its fields exposed as attributes like the neomodel nodes.
+    """
+
+    __slots__ = ("index", "_fields")
+
+    def __init__(self, index: int, fields: Dict[str, Any]):
+        self.index = index
+        self._fields = fields
+
+    def __getattr__(self, name: str):
+        try:
+            return self._fields[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __repr__(self) -> str:
+        return f"SnapshotRecord({self.index}, {self._fields.get('name')!r})"
+
+
+class _RecordSet:
+    """
+    Memory-mapped view of one record set, records are decoded only when asked for.
+    """
+
+    def __init__(self, directory: Path, name: str, dimension: int):
+        self._dimension = dimension
+        self._files = []
+        self._records = self._map(directory / f"{name}.jsonl")
+        self._offsets = self._map(directory / f"{name}.offsets", "Q")
+        self._vectors = self._map(directory / f"{name}.f32", "f")
+        self._norms = self._map(directory / f"{name}.norms.f32", "f")
+        self._centrality = self._map(directory / f"{name}.centrality.f32", "f")
+        self._matrix = None
+
+    def __len__(self) -> int:
+        return len(self._norms)
+
+    def record(self, index: int) -> SnapshotRecord:
+        return SnapshotRecord(index, json.loads(bytes(self._records[self._offsets[index] : self._offsets[index + 1]])))
+
+    def vector(self, index: int) -> memoryview:
+        return self._vectors[index * self._dimension : (index + 1) * self._dimension]
+
+    def scores(self, q_embed: List[float], centrality_weight: float) -> List[Tuple[float, int]]:
+        """
+        (score, index) of every record with a vector, numpy is used when installed.
+        """
+        q_norm = math.sqrt(sum(v * v for v in q_embed)) or 1.0
+        try:
+            import numpy as np
+        except ImportError:
+            np = None
+
+        if np is not None:
+            if self._matrix is None:
+                self._matrix = np.frombuffer(self._vectors, dtype="<f4").reshape(len(self), self._dimension)
+            norms = np.frombuffer(self._norms, dtype="<f4")
+            with np.errstate(divide="ignore", invalid="ignore"):
+                similarity = (self._matrix @ np.asarray(q_embed, dtype=np.float32)) / (norms * q_norm)
+            if centrality_weight > 0:
+                centrality = np.frombuffer(self._centrality, dtype="<f4")
+                similarity = (1.0 - centrality_weight) * similarity + centrality_weight * centrality / (centrality + 1.0)
+            present = np.nonzero(norms > 0)[0]
+            return list(zip(similarity[present].tolist(), present.tolist()))
+
+        scored = []
+        for index in range(len(self)):
+            norm = self._norms[index]
+            if norm <= 0:
+                continue
+            similarity = math.fsum(a * b for a, b in zip(self.vector(index), q_embed)) / (norm * q_norm)
+            if centrality_weight > 0:
+                centrality = self._centrality[index]
+                similarity = (1.0 - centrality_weight) * similarity + centrality_weight * centrality / (centrality + 1.0)
+            scored.append((similarity, index))
+        return scored
+
+    def close(self) -> None:
+        self._matrix = None
+        for view, mapped, f in self._files:
+            view.release()
+            if mapped is not None:
+                mapped.close()
+            f.close()
+
+    def _map(self, path: Path, typecode: Optional[str] = None) -> memoryview:
+        f = open(path, "rb")
+        if os.fstat(f.fileno()).st_size == 0:
+            view, mapped = memoryview(b""), None
+        else:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(mapped)
+        if typecode is not None:
+            if sys.byteorder != "little":
+                swapped = array(typecode, bytes(view))
+                swapped.byteswap()
+                view = memoryview(swapped)
+            else:
+                view = view.cast(typecode)
+        self._files.append((view, mapped, f))
+        return view
+
+
+class SnapshotReader:
+    """
+    Serves queries read-only from a snapshot, without a Neo4j behind it.
+
+    Vectors, norms and scores are memory-mapped, and records are decoded on demand through their
+    offsets, so opening a snapshot costs a few file maps whatever its size. Queries score every
+    vector, with numpy when it is installed and in plain Python otherwise.
+
+    Args:
+        path: Snapshot directory written by `export_snapshot`
+        verify: Check every file against the manifest hashes first
+    """
+
+    def __init__(self, path, verify: bool = False):
+        self._path = Path(path)
+        self._manifest = json.loads((self._path / MANIFEST_NAME).read_text())
+        if self._manifest.get("version") != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(f"Snapshot {self._path} has format version {self._manifest.get('version')}, expected {SNAPSHOT_FORMAT_VERSION}.")
+        if verify:
+            self.verify()
+        self._record_sets = {name: _RecordSet(self._path, name, self._manifest["dimension"]) for name in RECORD_SETS}
+        self._names: Optional[Dict[str, List[int]]] = None
+        self._links: Optional[Dict[str, List]] = None
+
+    @property
+    def manifest(self) -> Dict[str, Any]:
+        return self._manifest
+
+    @property
+    def notes(self) -> _RecordSet:
+        return self._record_sets["notes"]
+
+    @property
+    def splits(self) -> _RecordSet:
+        return self._record_sets["splits"]
+
+    @property
+    def links(self) -> Dict[str, List]:
+        if self._links is None:
+            self._links = json.loads((self._path / "links.json").read_text())
+        return self._links
+
+    def verify(self) -> None:
+        for name, expected in self._manifest["files"].items():
+            if _file_sha256(self._path / name) != expected:
+                raise ValueError(f"Snapshot file {self._path / name} does not match its manifest hash.")
+
+    def resolve(self, name: str) -> List[SnapshotRecord]:
+        # Notes a link text could mean, by name or alias, as NameResolver resolves them
+        if self._names is None:
+            self._names = json.loads((self._path / "names.json").read_text())
+        return [self.notes.record(index) for index in self._names.get(normalize_name(name), [])]
+
+    def query_vector_index(self, q_embed: List[float], top_k: int = 5, node_type: str = "FilledNeoNote", centrality_weight: float = 0.0):
+        """
+        Same rows as NeoModelEventHandler.query_vector_index, (record, score) best first, and no metadata.
+        """
+        record_set = self.splits if node_type == "NeoSplit" else self.notes
+        with METRICS.stage("query", filtered="false"):
+            best = heapq.nlargest(top_k, record_set.scores(q_embed, centrality_weight))
+        return [(record_set.record(index), score) for score, index in best], None
+
+    def close(self) -> None:
+        for record_set in self._record_sets.values():
+            record_set.close()
+
+
+def write_import_files(reader: SnapshotReader, out_dir) -> Dict[str, int]:
+    """
+    Turns a snapshot into neo4j-admin import CSVs, for `bulk_export.load_into_neo4j` to restore into a fresh database.
+    """
+    from world_graph.bulk_export import open_import_files, write_import_manifest
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    manifest = reader.manifest
+    embedding_property = manifest["embedding_property"]
+    vault = manifest["vault"]
+    vault_name = Path(vault).stem if vault else ""
+    nodes, relationships = open_import_files(out_dir, embedding_property)
+    aliases, tags, folders = set(), set(), set()
+    try:
+        for index in range(len(reader.notes)):
+            note = reader.notes.record(index)
+            note_id = f"n{index}"
+            vector = list(reader.notes.vector(index)) if reader.notes._norms[index] > 0 else None
+            nodes["FilledNeoNote"].add(
+                note_id,
+                path=note.path,
+                content=note.content,
+                name=note.name,
+                name_key=normalize_name(note.name),
+                modified_time=datetime.fromtimestamp(note.modified_time, timezone.utc) if note.modified_time is not None else None,
+                anchor_index=note.anchor_index,
+                in_degree=note.in_degree,
+                centrality=note.centrality,
+                **{embedding_property: vector},
+            )
+
+            first_split, num_splits = note.splits
+            previous_split_id = None
+            for split_index in range(first_split, first_split + num_splits):
+                split = reader.splits.record(split_index)
+                split_id = f"{note_id}s{split.count}"
+                split_vector = list(reader.splits.vector(split_index)) if reader.splits._norms[split_index] > 0 else None
+                nodes["NeoSplit"].add(split_id, count=split.count, name=split.name, content=split.content, centrality=note.centrality, **{embedding_property: split_vector})
+                relationships["HEAD_SPLIT" if previous_split_id is None else "NEXT_SPLIT"].add(previous_split_id if previous_split_id else note_id, split_id)
+                relationships["CONTAIN_SPLIT"].add(note_id, split_id)
+                for tag in split.tags:
+                    tags.add(tag)
+                    relationships["TAGGED"].add(split_id, f"t:{tag}")
+                previous_split_id = split_id
+
+            for alias in note.aliases:
+                key = normalize_name(alias)
+                if key not in aliases:
+                    aliases.add(key)
+                    nodes["Alias"].add(f"a:{key}", key=key, name=alias)
+                relationships["HAS_ALIAS"].add(note_id, f"a:{key}")
+            for tag in note.tags:
+                tags.add(tag)
+                relationships["TAGGED"].add(note_id, f"t:{tag}")
+            if note.folder is not None:
+                for row in folder_hierarchy(note.folder, vault_name):
+                    if row["path"] not in folders:
+                        folders.add(row["path"])
+                        nodes["Folder"].add(f"f:{row['path']}", path=row["path"], name=row["name"])
+                        if row["parent"] is not None:
+                            relationships["CHILD_OF"].add(f"f:{row['path']}", f"f:{row['parent']}")
+                relationships["IN_FOLDER"].add(note_id, f"f:{note.folder}")
+
+        parents = {tag.rsplit("/", 1)[0] for tag in tags if "/" in tag}
+        for tag in sorted(tags | parents):
+            nodes["Tag"].add(f"t:{tag}", name=tag)
+        for tag in sorted(tags):
+            if "/" in tag:
+                relationships["CHILD_OF"].add(f"t:{tag}", f"t:{tag.rsplit('/', 1)[0]}")
+
+        links = reader.links
+        for dangle_index, name in enumerate(links["dangles"]):
+            nodes["DanglingNeoNote"].add(f"d{dangle_index}", name=name, name_key=normalize_name(name))
+        for source, target, chunk_links in links["mentions"]:
+            relationships["MENTIONED"].add(f"n{source}", f"n{target}", uid=uuid.uuid4().hex, chunk_links=chunk_links)
+        for source, dangle_index, chunk_links in links["dangle_mentions"]:
+            relationships["MENTIONED"].add(f"n{source}", f"d{dangle_index}", uid=uuid.uuid4().hex, chunk_links=chunk_links)
+        for source, source_count, target, target_count in links["chunk_links"]:
+            relationships["MENTIONED_SPLIT"].add(f"n{source}s{source_count}", f"n{target}s{target_count}")
+
+        if manifest["model"]:
+            nodes["EmbeddingSpace"].add(
+                "space",
+                model=manifest["model"],
+                property=embedding_property,
+                dimension=manifest["dimension"],
+                state="active",
+                updated_time=datetime.now(timezone.utc),
+            )
+    finally:
+        for csv_file in (*nodes.values(), *relationships.values()):
+            csv_file.close()
+
+    return write_import_manifest(out_dir, vault, embedding_property, manifest["dimension"], nodes, relationships)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Snapshot the graph for warm restarts and read replicas.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="Write a snapshot of the connected graph")
+    export.add_argument("out", type=Path)
+    export.add_argument("--vault-snapshot", type=Path, default=Path(os.getenv("WORLD_GRAPH_VAULT_SNAPSHOT", DEFAULT_SNAPSHOT_PATH)))
+    verify = commands.add_parser("verify", help="Check a snapshot against its manifest hashes")
+    verify.add_argument("snapshot", type=Path)
+    restore = commands.add_parser("restore", help="Import a snapshot into a stopped, fresh database")
+    restore.add_argument("snapshot", type=Path)
+    restore.add_argument("work_dir", type=Path, help="Where the import CSVs are written")
+    restore.add_argument("--database", default="neo4j")
+    restore.add_argument("--neo4j-admin", default=None)
+    restore.add_argument("--vault-snapshot", type=Path, default=None, help="ChangeVerifier's snapshot path, WORLD_GRAPH_VAULT_SNAPSHOT by default")
+    serve = commands.add_parser("serve", help="Answer queries from a snapshot, without Neo4j")
+    serve.add_argument("snapshot", type=Path)
+    serve.add_argument("--top-k", type=int, default=8)
+    serve.add_argument("--centrality-weight", type=float, default=float(os.getenv("WORLD_GRAPH_CENTRALITY_WEIGHT", "0.1")))
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "export":
+        from world_graph.neo_model_handler import create_neo_model_connection
+
+        create_neo_model_connection()
+        print(json.dumps(export_snapshot(args.out, args.vault_snapshot), indent=2))
+        db.close_connection()
+    elif args.command == "verify":
+        SnapshotReader(args.snapshot, verify=True).close()
+        print(f"{args.snapshot} is intact.")
+    elif args.command == "restore":
+        from world_graph.bulk_export import install_vault_snapshot, load_into_neo4j
+
+        reader = SnapshotReader(args.snapshot, verify=True)
+        try:
+            write_import_files(reader, args.work_dir)
+        finally:
+            reader.close()
+        load_into_neo4j(args.work_dir, args.database, args.neo4j_admin)
+        # Only once the graph holds the snapshot, the verifier then picks up what changed in the vault since the export
+        install_vault_snapshot(args.snapshot / VAULT_SNAPSHOT_NAME, args.vault_snapshot)
+        print(f"Imported, start the database then run: python -m world_graph.bulk_export finalize {args.work_dir}")
+    else:
+        from world_graph.embedding import load_embedding_model
+
+        start_time = time.perf_counter()
+        reader = SnapshotReader(args.snapshot)
+        embedding, _ = load_embedding_model(model_name=reader.manifest["model"], dimension=reader.manifest["dimension"], backend=os.getenv("WORLD_GRAPH_EMBEDDING_BACKEND"))
+        print(f"Serving {len(reader.notes)} notes, ready in {round(time.perf_counter() - start_time, 2)} seconds.")
+        try:
+            while True:
+                user_input = input("Q:")
+                results, _ = reader.query_vector_index(embedding.embed_query(user_input), top_k=args.top_k, centrality_weight=args.centrality_weight)
+                for row in results:
+                    print(row[0].name, row[1])
+        except (KeyboardInterrupt, EOFError):
+            pass
+        finally:
+            reader.close()
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -1,9 +1,11 @@
-from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import chdir
+import itertools
 import random
 from pathlib import Path
 import sys
-import time
+from typing import Dict, List
+
 from sh import git
 
 # from git import Repo
@@ -33,69 +35,171 @@ class SyntheticVault:
         "Mammals", "Birds", "Reptiles", "Amphibians", "Fish", "Invertebrates", "Marine Animals",
         "Insects", "Arachnids", "Crustaceans", "Myriapods", "Mollusks"
     ]
+    words = [
+        "habitat", "diet", "range", "migration", "behavior", "predator", "prey", "season", "climate", "forest",
+        "river", "ocean", "desert", "grassland", "colony", "nest", "burrow", "territory", "mating", "offspring",
+        "nocturnal", "diurnal", "solitary", "social", "omnivore", "herbivore", "carnivore", "lifespan", "weight", "speed",
+    ]
     # fmt: on
-    def __init__(self, path: str):
+
+    def __init__(
+        self,
+        path: str,
+        seed: int = 2342,
+        link_density: int = 3,
+        hub_exponent: float = 1.0,
+        note_length: int = 3,
+        frontmatter_rate: float = 0.5,
+        tag_rate: float = 0.5,
+        folder_depth: int = 0,
+        folder_fanout: int = 4,
+        dangling_rate: float = 0.0,
+        workers: int = 8,
+    ):
+        """
+        Deterministic generator of animal themed vaults, the same seed and settings always give the same files.
+
+        Args:
+            path: Directory the vault is written under (notes go in `path/notes`)
+            seed: Seed for every random choice
+            link_density: Mean number of wikilinks per note
+            hub_exponent: Zipf exponent of link targets, 0 is uniform, larger makes a few notes hubs
+            note_length: Paragraphs per detail section
+            frontmatter_rate: Share of notes starting with a tags/aliases property block
+            tag_rate: Share of notes carrying inline (hierarchical) tags
+            folder_depth: Maximum folder nesting, 0 writes every note at the vault root
+            folder_fanout: Folders per level
+            dangling_rate: Share of links pointing at notes that do not exist
+            workers: Threads writing files
+        """
         self._path = Path(path) / "notes"
-        self._link_density = 3
+        self._seed = seed
+        self._link_density = link_density
+        self._hub_exponent = hub_exponent
+        self._note_length = note_length
+        self._frontmatter_rate = frontmatter_rate
+        self._tag_rate = tag_rate
+        self._folder_depth = folder_depth
+        self._folder_fanout = folder_fanout
+        self._dangling_rate = dangling_rate
+        self._workers = workers
         self._notes_written = {}
 
-    def generate(self, num_notes: int = 50) -> None:
-        while len(self.animals) < num_notes:
-            self.animals += [f"Animal_{i}" for i in range(len(self.animals), num_notes + 1)]
-
-        # Directory setup
-        self._path.mkdir(parents=True, exist_ok=True)
-
-        note_filenames = [f"{animal}.md" for animal in random.sample(self.animals, k=num_notes)]
-        note_queue = deque(note_filenames)
-
-        while note_queue:
-            filename = note_queue.popleft()
-            animal_name = Path(filename).stem
-            # Generate links
-            links = random.sample(note_filenames, k=random.randint(1, self._link_density))
-            wikilinks = [f"[[{Path(link).stem}#Section-{random.randint(1, 3)}]]" for link in links]
-
-            # Content creation
-            content = f"# {animal_name}\n\n"
-            content += "## Overview\n\n"
-            content += f"This note contains an overview of {animal_name}.\n\n"
-            content += "### Section-1\n\n"
-            content += "Example Food\n\n"
-            content += "### Section-2\n\n"
-            content += "Example Habitat\n\n"
-            content += "### Section-3\n\n"
-            content += "Example Behaviors\n\n"
-            content += "## Related Links\n\n"
-            content += "Explore related animals:\n\n"
-            content += "\n".join(wikilinks) + "\n\n"
-            content += "## Details\n\n"
-            content += f"This section dives deeper into the details about {animal_name}.\n"
-
-            # Write file
-            note_path = self._path / filename
-            time.sleep(0.5)
-            with open(note_path, "w") as note_file:
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    @property
+    def notes_written(self) -> Dict[str, Path]:
+        return self._notes_written
+
+    def note_name(self, idx: int) -> str:
+        animal = self.animals[idx % len(self.animals)]
+        return animal if idx < len(self.animals) else f"{animal} {idx // len(self.animals)}"
+
+    def note_folder(self, idx: int) -> Path:
+        rng = random.Random(self._seed * 7919 + idx)
+        depth = rng.randint(0, self._folder_depth) if self._folder_depth else 0
+        return Path(*[f"Folder-{level}-{rng.randrange(self._folder_fanout)}" for level in range(depth)])
+
+    def generate(self, num_notes: int = 50) -> Dict[str, Path]:
+        """
+        Writes `num_notes` notes, returning their vault relative paths keyed by note name.
+        """
+        names = [self.note_name(idx) for idx in range(num_notes)]
+
+        # Hub ranks are a seeded permutation, so the most linked notes are spread over the alphabet
+        ranks = list(range(num_notes))
+        random.Random(self._seed).shuffle(ranks)
+        cum_weights = list(itertools.accumulate(1.0 / (rank + 1) ** self._hub_exponent for rank in ranks))
+
+        relative_paths = [self.note_folder(idx) / f"{names[idx]}.md" for idx in range(num_notes)]
+        for folder in {relative_path.parent for relative_path in relative_paths}:
+            (self._path / folder).mkdir(parents=True, exist_ok=True)
+
+        def write_note(idx: int) -> None:
+            content = self.note_content(idx, names, cum_weights)
+            with open(self._path / relative_paths[idx], "w", encoding="utf-8") as note_file:
                 note_file.write(content)
 
-            self._notes_written[filename] = content
+        with ThreadPoolExecutor(max_workers=self._workers) as pool:
+            for _ in pool.map(write_note, range(num_notes), chunksize=256):
+                pass
+
+        self._notes_written.update(zip(names, relative_paths))
+        return self._notes_written
+
+    def note_content(self, idx: int, names: List[str], cum_weights: List[float]) -> str:
+        rng = random.Random(self._seed * 1_000_003 + idx)
+        animal_name = names[idx]
+
+        # Generate links, targets drawn by hub weight, a share of them to notes which do not exist
+        num_links = rng.randint(1, max(1, 2 * self._link_density - 1))
+        targets = rng.choices(range(len(names)), cum_weights=cum_weights, k=num_links)
+        wikilinks = []
+        for target in targets:
+            target_name = f"Missing {names[target]}" if rng.random() < self._dangling_rate else names[target]
+            form = rng.random()
+            if form < 0.4:
+                wikilinks.append(f"[[{target_name}]]")
+            elif form < 0.8:
+                wikilinks.append(f"[[{target_name}#Section-{rng.randint(1, 3)}]]")
+            elif form < 0.9:
+                wikilinks.append(f"[[{target_name}#^fact-{rng.randint(1, self._note_length)}]]")
+            else:
+                wikilinks.append(f"[[{target_name}|the {target_name.lower()}]]")
+
+        content = ""
+        if rng.random() < self._frontmatter_rate:
+            tags = rng.sample(self.tags, k=rng.randint(1, 2))
+            content += "---\n"
+            content += f"tags: [{', '.join(tag.replace(' ', '-') for tag in tags)}]\n"
+            content += f"aliases: [{animal_name} Notes]\n"
+            content += "---\n"
+
+        # Content creation
+        content += f"# {animal_name}\n\n"
+        content += "## Overview\n\n"
+        content += f"This note contains an overview of {animal_name}.\n\n"
+        content += "### Section-1\n\n"
+        content += "Example Food\n\n"
+        content += "### Section-2\n\n"
+        content += "Example Habitat\n\n"
+        content += "### Section-3\n\n"
+        content += "Example Behaviors\n\n"
+        content += "## Related Links\n\n"
+        content += "Explore related animals:\n\n"
+        content += "\n".join(wikilinks) + "\n\n"
+        content += "## Details\n\n"
+        content += f"This section dives deeper into the details about {animal_name}.\n"
+        for paragraph in range(1, self._note_length + 1):
+            sentences = [" ".join(rng.choices(self.words, k=rng.randint(6, 14))).capitalize() + "." for _ in range(rng.randint(2, 5))]
+            content += "\n" + " ".join(sentences) + f" ^fact-{paragraph}\n"
+
+        if rng.random() < self._tag_rate:
+            group = rng.choice(self.tags).replace(" ", "-")
+            content += f"\n#zoo/{group.lower()} #{animal_name.split()[0].lower()}\n"
+
+        return content
 
     @classmethod
-    def with_git_repo(cls, path: str):
-        vault = cls(path)
+    def with_git_repo(cls, path: str, num_notes: int = 50, **settings):
+        vault = cls(path, **settings)
         notes = Path(path)
         notes.mkdir(parents=True, exist_ok=True)
         with chdir(notes):
             git.init(_out=sys.stdout, _err=sys.stderr)
-            vault.generate()
-            git.add("*.md", _out=sys.stdout, _err=sys.stderr)
+            vault.generate(num_notes=num_notes)
+            git.add("-A", _out=sys.stdout, _err=sys.stderr)
             git.commit("-m", "Animal-themed markdown notes", _out=sys.stdout, _err=sys.stderr)
 
         return vault
 
     def remove_vault(self):
-        for note in self._path.glob("*.md"):
+        for note in self._path.rglob("*.md"):
             note.unlink()
+        for folder in sorted(self._path.rglob("*"), key=lambda folder: len(folder.parts), reverse=True):
+            folder.rmdir()
         self._path.rmdir()
 
 
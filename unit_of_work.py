@@ -0,0 +1,369 @@
+from functools import wraps
+import logging
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from neo4j.exceptions import DriverError, Neo4jError
+from neomodel import db
+
+from world_graph.metrics import METRICS
+
+unit_log = logging.getLogger(__name__)
+
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF = 0.1
+DEFAULT_MAX_BATCH_SIZE = 32
+DEFAULT_MAX_BATCH_DELAY = 0.25
+
+# Callbacks waiting for the commit of the transaction open on this thread, see after_commit
+_commit_hooks = threading.local()
+
+
+def in_transaction() -> bool:
+    # neomodel keeps the open transaction per thread and context, but has no public accessor for it
+    return db._active_transaction is not None
+
+
+def is_transient(error: Exception) -> bool:
+    # Deadlocks, lock timeouts, leader switches and dropped connections succeed when run again
+    return isinstance(error, (Neo4jError, DriverError)) and error.is_retryable()
+
+
+def after_commit(callback: Callable, *args) -> None:
+    """
+    Calls `callback` once the transaction run_in_transaction opened on this thread commits.
+
+    Callbacks run in the order they were added and are dropped when the transaction rolls back,
+    so in-process state mirroring the graph only ever reflects committed writes. Outside such a
+    transaction `callback` is called right away.
+    """
+    _defer(callback, args, on_rollback=False)
+
+
+def after_transaction(callback: Callable, *args) -> None:
+    """
+    Like after_commit, but `callback` also runs when the transaction rolls back, e.g. to release what it held.
+    """
+    _defer(callback, args, on_rollback=True)
+
+
+def _defer(callback: Callable, args: Tuple, on_rollback: bool) -> None:
+    pending = getattr(_commit_hooks, "pending", None)
+    if pending is None or not in_transaction():
+        callback(*args)
+        return
+    pending.append((callback, args, on_rollback))
+
+
+def run_in_transaction(
+    function: Callable,
+    *args,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    backoff: float = DEFAULT_BACKOFF,
+    **kwargs,
+) -> Any:
+    """
+    Calls `function` inside one explicit write transaction, committed once it returns.
+
+    Called while a transaction is already open on this thread, `function` simply joins it, so
+    handlers calling each other commit once at the outermost call. A transaction failing on a
+    transient error is rolled back and `function` run again from the start, up to `max_retries`
+    times with jittered exponential backoff.
+
+    Args:
+        function: Does all of the unit's reads and writes through neomodel
+        max_retries: Attempts after the first before a transient error is raised
+        backoff: Base delay in seconds, doubled after every failed attempt
+    """
+    if in_transaction():
+        return function(*args, **kwargs)
+
+    for attempt in range(max_retries + 1):
+        start_time = time.perf_counter()
+        _commit_hooks.pending = []
+        try:
+            with db.write_transaction:
+                result = function(*args, **kwargs)
+        except Exception as e:
+            pending, _commit_hooks.pending = _commit_hooks.pending, None
+            for callback, callback_args, on_rollback in pending:
+                if on_rollback:
+                    callback(*callback_args)
+            if not is_transient(e) or attempt == max_retries:
+                METRICS.inc("transactions_total", result="rolled_back")
+                raise
+            delay = backoff * 2**attempt * random.uniform(0.5, 1.5)
+            METRICS.inc("transactions_total", result="retried")
+            unit_log.warning(f"Transaction failed on a transient error ({e}), retrying in {round(delay, 2)} seconds.")
+            time.sleep(delay)
+            continue
+
+        METRICS.inc("transactions_total", result="committed")
+        METRICS.observe("transaction_seconds", time.perf_counter() - start_time)
+        pending, _commit_hooks.pending = _commit_hooks.pending, None
+        for callback, callback_args, _ in pending:
+            callback(*callback_args)
+        return result
+
+
+def transactional(function: Callable) -> Callable:
+    """
+    Decorator running `function` through `run_in_transaction`, joining the caller's transaction if there is one.
+    """
+
+    @wraps(function)
+    def _return(*args, **kwargs):
+        return run_in_transaction(function, *args, **kwargs)
+
+    return _return
+
+
+class UnitOfWork:
+    """
+    Groups all the graph writes made for one file event, or one batch of them, into a single transaction.
+
+    Without it every neomodel call commits on its own, so an event commits dozens of times and a
+    failure half way leaves a partial note behind. `wrap` turns an event callback into one atomic
+    unit. With a scheduler, the unit holds one graph slot for its whole transaction instead of
+    queueing for a slot per statement while holding locks.
+
+    Args:
+        max_retries: Attempts after the first when a transaction fails on a transient error
+        backoff: Base delay in seconds between attempts, doubled after each
+        scheduler: PriorityScheduler whose graph resource the transaction is charged to
+    """
+
+    def __init__(self, max_retries: int = DEFAULT_MAX_RETRIES, backoff: float = DEFAULT_BACKOFF, scheduler=None):
+        self._max_retries = max_retries
+        self._backoff = backoff
+        self._scheduler = scheduler
+
+    @property
+    def scheduler(self):
+        return self._scheduler
+
+    def run(self, function: Callable, *args, **kwargs) -> Any:
+        if in_transaction():
+            return function(*args, **kwargs)
+        if self._scheduler is None:
+            return self._run(function, *args, **kwargs)
+        with self._scheduler.slot("graph"):
+            return self._run(function, *args, **kwargs)
+
+    def wrap(self, function: Callable) -> Callable:
+        @wraps(function)
+        def _return(*args, **kwargs):
+            return self.run(function, *args, **kwargs)
+
+        return _return
+
+    def _run(self, function: Callable, *args, **kwargs) -> Any:
+        return run_in_transaction(function, *args, max_retries=self._max_retries, backoff=self._backoff, **kwargs)
+
+
+def coalesce_event_types(previous: str, current: str) -> str:
+    # What a pending event on a path becomes when another event for the same path arrives before it ran
+    if previous == "created" and current == "modified":
+        return "created"
+    if previous == "deleted" and current in ("created", "modified"):
+        return "modified"  # on_modified recreates the note, or creates it when the delete never reached the graph
+    return current
+
+
+class EventBatcher:
+    """
+    Queues file events and applies them in batches, each batch in one transaction.
+
+    Events for a path already waiting in the batch are coalesced into one, e.g. a save burst of
+    modified events runs once. Moves are kept in order and end coalescing for the events before
+    them. A batch is applied once `max_batch_size` events are waiting or `max_batch_delay` seconds
+    after its first event. Callbacks exposing `prepare(event)` get that run for each event before
+    the transaction is opened, and its result passed back as their second argument. When a batch
+    fails, its events are applied again one transaction each, so one broken note does not hold
+    back the rest. Events a callback's `commits_alone(event)` accepts, e.g. streamed notes, are
+    applied outside any transaction between the batch's others. Each event's `on_done` callbacks,
+    those of the events coalesced into it included, are called with True once its transaction
+    committed and with False once it finally failed.
+
+    Args:
+        unit_of_work: Runs each batch, and each event of a failed batch
+        callbacks: Event callback per event type, i.e. created, modified, moved and deleted
+        max_batch_size: Most events applied in one transaction
+        max_batch_delay: Seconds the first event of a batch waits for others to join it
+    """
+
+    def __init__(
+        self,
+        unit_of_work: UnitOfWork,
+        callbacks: Dict[str, Callable],
+        max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+        max_batch_delay: float = DEFAULT_MAX_BATCH_DELAY,
+    ):
+        self._unit_of_work = unit_of_work
+        self._callbacks = callbacks
+        self._max_batch_size = max_batch_size
+        self._max_batch_delay = max_batch_delay
+        self._condition = threading.Condition()
+        # Event type, event and the on_done callbacks waiting on it
+        self._pending: List[Tuple[str, Any, List[Callable[[bool], None]]]] = []
+        self._pending_by_path: Dict[str, int] = {}
+        self._first_event_time: Optional[float] = None
+        self._stop = False
+        self._thread: Optional[threading.Thread] = None
+
+    def callback(self, event_type: str) -> Callable:
+        # Drop-in for a watchdog handler's on_<event_type>, returns as soon as the event is queued
+        def _return(event, on_done: Optional[Callable[[bool], None]] = None):
+            self.submit(event_type, event, on_done)
+
+        return _return
+
+    def submit(self, event_type: str, event, on_done: Optional[Callable[[bool], None]] = None) -> None:
+        done_callbacks = [on_done] if on_done else []
+        with self._condition:
+            path = str(event.src_path)
+            if event_type == "moved":
+                self._pending.append((event_type, event, done_callbacks))
+                self._pending_by_path.clear()
+            elif path in self._pending_by_path:
+                position = self._pending_by_path[path]
+                previous_type, _, previous_callbacks = self._pending[position]
+                self._pending[position] = (coalesce_event_types(previous_type, event_type), event, previous_callbacks + done_callbacks)
+                METRICS.inc("coalesced_events_total", event_type=event_type)
+            else:
+                self._pending_by_path[path] = len(self._pending)
+                self._pending.append((event_type, event, done_callbacks))
+
+            if self._first_event_time is None:
+                self._first_event_time = time.monotonic()
+            self._condition.notify_all()
+
+    def start(self) -> threading.Thread:
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name="event-batcher", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self) -> None:
+        # Applies whatever is still queued before returning
+        with self._condition:
+            self._stop = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def flush(self) -> int:
+        with self._condition:
+            batch = self._take_batch()
+        self._apply(batch)
+        return len(batch)
+
+    def _take_batch(self) -> List[Tuple[str, Any, List[Callable[[bool], None]]]]:
+        batch, self._pending = self._pending[: self._max_batch_size], self._pending[self._max_batch_size :]
+        self._pending_by_path = {}
+        for position, (event_type, event, _) in enumerate(self._pending):
+            if event_type == "moved":
+                self._pending_by_path.clear()
+            else:
+                self._pending_by_path[str(event.src_path)] = position
+        self._first_event_time = time.monotonic() if self._pending else None
+        return batch
+
+    def _ready(self) -> bool:
+        if not self._pending:
+            return False
+        return len(self._pending) >= self._max_batch_size or time.monotonic() - self._first_event_time >= self._max_batch_delay
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._stop and not self._ready():
+                    timeout = None if not self._pending else self._first_event_time + self._max_batch_delay - time.monotonic()
+                    self._condition.wait(timeout)
+                if self._stop and not self._pending:
+                    return
+                batch = self._take_batch()
+            self._apply(batch)
+
+    def _apply(self, batch: List[Tuple[str, Any, List[Callable[[bool], None]]]]) -> None:
+        if not batch:
+            return
+        METRICS.observe("event_batch_size", len(batch))
+        segment = []
+        for entry in self._prepare_all(batch):
+            event_type, event, _, _ = entry
+            commits_alone = getattr(self._callbacks[event_type], "commits_alone", None)
+            if commits_alone is not None and commits_alone(event):
+                # e.g. streamed notes, written window by window, so the events before it are committed first
+                self._apply_segment(segment)
+                segment = []
+                self._apply_alone(entry)
+            else:
+                segment.append(entry)
+        self._apply_segment(segment)
+
+    def _apply_alone(self, entry: Tuple[str, Any, Any, List[Callable[[bool], None]]]) -> None:
+        event_type, event, prepared, done_callbacks = entry
+        try:
+            self._apply_one(event_type, event, prepared)
+        except Exception as e:
+            unit_log.exception(f"Applying {event_type} of {event.src_path} failed: {e}")
+            self._done(done_callbacks, False)
+            return
+        self._done(done_callbacks, True)
+
+    def _apply_segment(self, prepared_batch: List[Tuple[str, Any, Any, List[Callable[[bool], None]]]]) -> None:
+        if not prepared_batch:
+            return
+        try:
+            self._unit_of_work.run(self._apply_all, prepared_batch)
+        except Exception as e:
+            if len(prepared_batch) == 1:
+                event_type, event, _, done_callbacks = prepared_batch[0]
+                unit_log.exception(f"Applying {event_type} of {event.src_path} failed: {e}")
+                self._done(done_callbacks, False)
+                return
+            unit_log.warning(f"Batch of {len(prepared_batch)} events failed ({e}), applying them one at a time.")
+        else:
+            for _, _, _, done_callbacks in prepared_batch:
+                self._done(done_callbacks, True)
+            return
+
+        for event_type, event, prepared, done_callbacks in prepared_batch:
+            try:
+                self._unit_of_work.run(self._apply_one, event_type, event, prepared)
+            except Exception as e:
+                unit_log.exception(f"Applying {event_type} of {event.src_path} failed: {e}")
+                self._done(done_callbacks, False)
+                continue
+            self._done(done_callbacks, True)
+
+    def _prepare_all(self, batch: List[Tuple[str, Any, List[Callable[[bool], None]]]]) -> List[Tuple[str, Any, Any, List[Callable[[bool], None]]]]:
+        # Reading, parsing and embedding happen before the batch's transaction is opened, see NeoModelEventHandler.instrumented
+        prepared_batch = []
+        for event_type, event, done_callbacks in batch:
+            prepare = getattr(self._callbacks[event_type], "prepare", None)
+            try:
+                prepared_batch.append((event_type, event, prepare(event) if prepare else None, done_callbacks))
+            except Exception as e:
+                unit_log.exception(f"Preparing {event_type} of {event.src_path} failed: {e}")
+                self._done(done_callbacks, False)
+        return prepared_batch
+
+    def _apply_one(self, event_type: str, event, prepared) -> Any:
+        callback = self._callbacks[event_type]
+        return callback(event, prepared) if prepared is not None else callback(event)
+
+    def _apply_all(self, prepared_batch: List[Tuple[str, Any, Any, List[Callable[[bool], None]]]]) -> None:
+        for event_type, event, prepared, _ in prepared_batch:
+            self._apply_one(event_type, event, prepared)
+
+    def _done(self, done_callbacks: List[Callable[[bool], None]], succeeded: bool) -> None:
+        for on_done in done_callbacks:
+            try:
+                on_done(succeeded)
+            except Exception as e:
+                unit_log.exception(f"Completion callback failed: {e}")